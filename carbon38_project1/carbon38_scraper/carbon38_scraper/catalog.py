@@ -0,0 +1,159 @@
+# Normalized product tables next to the flat products table.
+#
+# products keeps sizes, breadcrumbs and image_urls as JSON text and one
+# colour and price per product, so "size M in stock under $100" means
+# decoding every row.  DatabasePipeline also writes each item to
+#
+#   variants    one row per size/colour variant: SKU, price, availability
+#   images      image URLs in page order
+#   categories  the breadcrumb trail, depth 0 first
+#
+# keyed by products.id.  A trigger deletes a product's rows with the product,
+# so the INSERT OR REPLACE of a product clears its old rows before the new
+# ones are inserted (with recursive_triggers on, as BatchWriter sets it).
+# The flat columns are still written: both stay queryable while readers
+# move over.  Tables created on an existing database are filled from the
+# flat columns; those products get one variant per size, with the product's
+# colour and price and unknown availability, until they are scraped again.
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS variants (
+    product_rowid INTEGER NOT NULL REFERENCES products (id),
+    position INTEGER NOT NULL,
+    variant_id TEXT,
+    sku TEXT,
+    size TEXT,
+    colour TEXT,
+    price REAL,
+    available INTEGER,
+    PRIMARY KEY (product_rowid, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_variants_size ON variants (size COLLATE NOCASE, available, price);
+CREATE INDEX IF NOT EXISTS idx_variants_colour ON variants (colour COLLATE NOCASE, available, price);
+CREATE INDEX IF NOT EXISTS idx_variants_sku ON variants (sku);
+CREATE TABLE IF NOT EXISTS images (
+    product_rowid INTEGER NOT NULL REFERENCES products (id),
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (product_rowid, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_images_url ON images (url);
+CREATE TABLE IF NOT EXISTS categories (
+    product_rowid INTEGER NOT NULL REFERENCES products (id),
+    depth INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (product_rowid, depth)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_categories_name ON categories (name COLLATE NOCASE, depth);
+CREATE TRIGGER IF NOT EXISTS products_catalog_delete AFTER DELETE ON products BEGIN
+    DELETE FROM variants WHERE product_rowid = old.id;
+    DELETE FROM images WHERE product_rowid = old.id;
+    DELETE FROM categories WHERE product_rowid = old.id;
+END;
+'''
+
+# The product is found by product_url, so these can follow the product's
+# INSERT in the same batch without knowing its new id
+INSERT_VARIANT_SQL = '''
+    INSERT OR REPLACE INTO variants (product_rowid, position, variant_id, sku, size, colour, price, available)
+    SELECT id, ?, ?, ?, ?, ?, ?, ? FROM products WHERE product_url = ?
+'''
+INSERT_IMAGE_SQL = '''
+    INSERT OR REPLACE INTO images (product_rowid, position, url)
+    SELECT id, ?, ? FROM products WHERE product_url = ?
+'''
+INSERT_CATEGORY_SQL = '''
+    INSERT OR REPLACE INTO categories (product_rowid, depth, name)
+    SELECT id, ?, ? FROM products WHERE product_url = ?
+'''
+
+
+def has_catalog_tables(connection):
+    return connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'variants'"
+    ).fetchone() is not None
+
+
+def ensure_catalog_tables(connection):
+    """Create the normalized tables and their trigger; True if they are new.
+
+    New tables are filled from the flat columns of the rows already in products.
+    """
+    created = not has_catalog_tables(connection)
+    connection.executescript(CATALOG_SCHEMA)
+    if created:
+        backfill(connection)
+    return created
+
+
+def variant_rows(item):
+    """(position, variant_id, sku, size, colour, price, available) rows of a cleaned item.
+
+    Items without variants (HTML pages without product JSON, rows from
+    before variants were scraped) get one row per size, or a single row,
+    with the product's SKU, colour and price.
+    """
+    variants = item.get('variants')
+    if variants:
+        return [
+            (position, variant.get('variant_id'), variant.get('sku'), variant.get('size'),
+             variant.get('colour'), variant.get('price'),
+             None if variant.get('available') is None else int(bool(variant['available'])))
+            for position, variant in enumerate(variants)
+        ]
+    sizes = item.get('sizes') or [None]
+    sku = item.get('sku') if len(sizes) == 1 else None
+    return [(position, None, sku, size, item.get('colour'), item.get('price'), None)
+            for position, size in enumerate(sizes)]
+
+
+def image_rows(item):
+    return [(position, url) for position, url in enumerate(item.get('image_urls') or []) if url]
+
+
+def category_rows(item):
+    return [(depth, name) for depth, name in enumerate(item.get('breadcrumbs') or []) if name]
+
+
+def statements(item):
+    """(sql, params) to store a cleaned item's rows, after its products row."""
+    url = item.get('product_url')
+    for row in variant_rows(item):
+        yield INSERT_VARIANT_SQL, row + (url,)
+    for row in image_rows(item):
+        yield INSERT_IMAGE_SQL, row + (url,)
+    for row in category_rows(item):
+        yield INSERT_CATEGORY_SQL, row + (url,)
+
+
+def _decoded(value):
+    try:
+        value = json.loads(value) if value else []
+    except ValueError:
+        return []
+    return value if isinstance(value, list) else []
+
+
+def backfill(connection):
+    """Fill the normalized tables from the flat columns of every product."""
+    rows = connection.execute(
+        'SELECT id, sku, colour, price, sizes, breadcrumbs, image_urls FROM products'
+    ).fetchall()
+    with connection:
+        for rowid, sku, colour, price, sizes, breadcrumbs, image_urls in rows:
+            item = {'sku': sku, 'colour': colour, 'price': price, 'sizes': _decoded(sizes),
+                    'breadcrumbs': _decoded(breadcrumbs), 'image_urls': _decoded(image_urls)}
+            connection.executemany(
+                'INSERT OR REPLACE INTO variants VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(rowid,) + row for row in variant_rows(item)])
+            connection.executemany('INSERT OR REPLACE INTO images VALUES (?, ?, ?)',
+                                   [(rowid,) + row for row in image_rows(item)])
+            connection.executemany('INSERT OR REPLACE INTO categories VALUES (?, ?, ?)',
+                                   [(rowid,) + row for row in category_rows(item)])
+    if rows:
+        logger.info(f'Filled the variants, images and categories tables from {len(rows)} products')
@@ -0,0 +1 @@
+# Project commands, registered through COMMANDS_MODULE in settings.py
@@ -0,0 +1,90 @@
+"""Import a filesystem HTTP cache into the SQLite cache storage.
+
+    scrapy cachemigrate
+    scrapy cachemigrate --spider carbon38 --delete
+
+Reads HTTPCACHE_DIR/<spider>/ as written by Scrapy's FilesystemCacheStorage
+and stores every response in HTTPCACHE_DIR/<spider>.sqlite3, keeping the
+request fingerprints and timestamps, so a crawl with
+
+    HTTPCACHE_STORAGE = 'carbon38_scraper.httpcache.SqliteCacheStorage'
+
+hits the same entries.  Existing rows for the same requests are replaced.
+"""
+
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.http import Headers
+from scrapy.utils.project import data_path
+from w3lib.http import headers_raw_to_dict
+
+from carbon38_scraper import httpcache
+from carbon38_scraper.commands.replay import iter_cache
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return '[options]'
+
+    def short_desc(self):
+        return 'Import the filesystem HTTP cache into the SQLite cache storage'
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('--spider', default='carbon38', help='spider whose cache to import (default: %(default)s)')
+        parser.add_argument('--batch', type=int, default=500, help='responses per transaction (default: %(default)s)')
+        parser.add_argument('--delete', action='store_true', help='remove the filesystem cache once imported')
+
+    def run(self, args, opts):
+        cachedir = Path(data_path(self.settings['HTTPCACHE_DIR'])).resolve() / opts.spider
+        if not cachedir.is_dir():
+            raise UsageError(f'No filesystem HTTP cache at {cachedir}')
+        path = httpcache.cache_path(self.settings, opts.spider)
+        level = self.settings.getint('CARBON38_HTTPCACHE_COMPRESSION_LEVEL', 6)
+
+        start = time.perf_counter()
+        connection = httpcache.connect(path)
+        imported = 0
+        source_bytes = 0
+        rows = []
+        try:
+            for meta, entry in iter_cache(cachedir):
+                raw_headers = (entry / 'response_headers').read_bytes()
+                body = (entry / 'response_body').read_bytes()
+                extra = {}
+                if (entry / 'response_data').exists():
+                    with open(entry / 'response_data', 'rb') as f:
+                        extra = pickle.load(f)
+                source_bytes += sum(f.stat().st_size for f in entry.iterdir())
+                rows.append(httpcache.entry_row(
+                    bytes.fromhex(entry.name), meta['url'], meta.get('method', 'GET'), meta['status'],
+                    meta['response_url'], Headers(headers_raw_to_dict(raw_headers)), body, extra,
+                    meta['timestamp'], level,
+                ))
+                if len(rows) >= opts.batch:
+                    with connection:
+                        connection.executemany(httpcache.INSERT_SQL, rows)
+                    imported += len(rows)
+                    rows = []
+            with connection:
+                connection.executemany(httpcache.INSERT_SQL, rows)
+            imported += len(rows)
+            connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            connection.close()
+
+        print(f'Imported {imported} responses from {cachedir} ({source_bytes / 2 ** 20:.1f} MB) '
+              f'into {path} ({os.path.getsize(path) / 2 ** 20:.1f} MB) '
+              f'in {time.perf_counter() - start:.1f}s')
+        if opts.delete:
+            shutil.rmtree(cachedir)
+            print(f'Removed {cachedir}')
@@ -0,0 +1,47 @@
+"""Inspect or clear the shared crawl frontier.
+
+    scrapy frontier status -s CARBON38_FRONTIER_URL=sqlite:///frontier.db
+    scrapy frontier reset -s CARBON38_FRONTIER_URL=redis://localhost:6379/0
+
+status prints how many requests wait in each shard found in the store,
+whatever CARBON38_FRONTIER_WORKERS is set to, and how many request
+fingerprints have been seen; reset deletes both, so the next crawl starts
+from scratch instead of resuming.
+"""
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from carbon38_scraper.frontier import Frontier
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return 'status|reset [options]'
+
+    def short_desc(self):
+        return 'Show or clear the shared crawl frontier (CARBON38_FRONTIER_URL)'
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('--spider', default='carbon38', help='spider whose frontier to use (default: %(default)s)')
+
+    def run(self, args, opts):
+        if len(args) != 1 or args[0] not in ('status', 'reset'):
+            raise UsageError()
+        frontier = Frontier.from_settings(self.settings, opts.spider)
+        if frontier is None:
+            raise UsageError('CARBON38_FRONTIER_URL is not set')
+        try:
+            if args[0] == 'reset':
+                print(f'Cleared frontier {frontier.prefix!r} ({frontier.reset()} entries)')
+                return
+            status = frontier.status()
+            for key, queued in status['queued'].items():
+                print(f'{key:<40} {queued:>8} queued')
+            print(f'{frontier.seen_key:<40} {status["fingerprints"]:>8} fingerprints')
+        finally:
+            frontier.close()
@@ -0,0 +1,154 @@
+"""Search products.db by text, brand and price, a page at a time.
+
+    scrapy query "crop top"
+    scrapy query --brand ALO --min-price 50 --max-price 120 --order price
+    scrapy query --size M --in-stock --max-price 100
+    scrapy query "legging" --after eyJ... --json
+    scrapy query --price-changes 7
+    scrapy query --lowest [--at-lowest]
+    scrapy query --history https://carbon38.com/products/<handle>
+    scrapy query --reindex
+
+Each page ends with the cursor for the next one (--after).  --reindex
+creates the full-text index, the variants, images and categories tables
+and the price history of an existing database, or rebuilds the index; the
+crawl's DatabasePipeline creates them too and keeps them up to date.
+"""
+
+import json
+import sqlite3
+import time
+from datetime import datetime
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from carbon38_scraper import catalog, history, query
+
+
+def _money(cents):
+    return '' if cents is None else f'{cents / 100:.2f}'
+
+
+def _date(timestamp):
+    return '' if timestamp is None else datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
+
+
+def _stock(available):
+    return {0: 'out', 1: 'in'}.get(available, '?')
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return '[TEXT] [options]'
+
+    def short_desc(self):
+        return 'Search the products database (full text, brand, price range, price history)'
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('--db', help='database file (default: CARBON38_DATABASE)')
+        parser.add_argument('--brand', help='only this brand (case-insensitive)')
+        parser.add_argument('--size', help='only products with a variant in this size')
+        parser.add_argument('--in-stock', action='store_true', help='only products with an available variant')
+        parser.add_argument('--min-price', type=float, help='lowest price')
+        parser.add_argument('--max-price', type=float, help='highest price')
+        parser.add_argument('--order', choices=sorted(query.ORDERS),
+                            help='sort order (default: relevance with TEXT, else newest)')
+        parser.add_argument('--price-changes', type=float, metavar='DAYS',
+                            help='list price and availability changes of the last DAYS days instead')
+        parser.add_argument('--lowest', action='store_true',
+                            help='list current and lowest recorded price per product instead')
+        parser.add_argument('--at-lowest', action='store_true',
+                            help='with --lowest, only products at their lowest price now')
+        parser.add_argument('--history', metavar='URL', help="print a product's recorded prices instead")
+        parser.add_argument('--limit', type=int, default=20, help='rows per page (default: %(default)s)')
+        parser.add_argument('--after', metavar='CURSOR', help='continue after the page that returned CURSOR')
+        parser.add_argument('--json', action='store_true', help='print JSON lines instead of a table')
+        parser.add_argument('--reindex', action='store_true',
+                            help='build or rebuild the full-text index, create the variant and history tables')
+
+    def process_options(self, args, opts):
+        super().process_options(args, opts)
+        if not opts.loglevel:
+            self.settings.set('LOG_LEVEL', 'WARNING', priority='cmdline')
+
+    def run(self, args, opts):
+        path = opts.db or self.settings.get('CARBON38_DATABASE', 'database/products.db')
+        if opts.reindex:
+            self.reindex(path)
+            return
+        if opts.limit < 1:
+            raise UsageError('--limit must be at least 1')
+        try:
+            products = query.ProductQuery(path)
+        except (FileNotFoundError, ValueError) as e:
+            raise UsageError(str(e))
+        cursor = None
+        try:
+            start = time.perf_counter()
+            if opts.history:
+                rows, format_row = products.price_history(opts.history), self.history_row
+            elif opts.price_changes is not None:
+                rows, cursor = products.price_changes(opts.price_changes, opts.limit, opts.after)
+                format_row = self.change_row
+            elif opts.lowest or opts.at_lowest:
+                rows, cursor = products.lowest_prices(None, opts.at_lowest, opts.limit, opts.after)
+                format_row = self.lowest_row
+            else:
+                rows, cursor = products.search(' '.join(args), opts.brand, opts.min_price, opts.max_price,
+                                               opts.order, opts.limit, opts.after, opts.size, opts.in_stock)
+                format_row = self.product_row
+            elapsed = time.perf_counter() - start
+        except (ValueError, sqlite3.OperationalError) as e:
+            raise UsageError(str(e))
+        finally:
+            products.close()
+
+        if opts.json:
+            for row in rows:
+                print(json.dumps(row, ensure_ascii=False))
+            print(json.dumps({'next': cursor}))
+            return
+        for row in rows:
+            print(format_row(row))
+        print(f'{len(rows)} rows in {elapsed * 1000:.1f} ms')
+        if cursor:
+            print(f'Next page: --after {cursor}')
+
+    def product_row(self, row):
+        return (f"{row['id']:>7}  {(row['brand'] or '')[:20]:<20} {row['price'] or 0:>9.2f}  "
+                f"{(row['product_name'] or '')[:60]}")
+
+    def change_row(self, row):
+        return (f"{_date(row['observed_at'])}  {_money(row['previous_cents']):>9} -> "
+                f"{_money(row['price_cents']):>9} {_stock(row['available']):<3}  "
+                f"{(row['product_name'] or row['product_url'])[:50]} [{row['variant']}]")
+
+    def lowest_row(self, row):
+        return (f"{_money(row['current_cents']):>9} {_money(row['lowest_cents']):>9} "
+                f"(lowest {_date(row['lowest_at'])})  {(row['product_name'] or row['product_url'])[:50]}")
+
+    def history_row(self, row):
+        return (f"{row['variant'][:24]:<24} {_date(row['observed_at'])}  {_money(row['price_cents']):>9} "
+                f"{_stock(row['available'])}")
+
+    def reindex(self, path):
+        connection = sqlite3.connect(path, timeout=30)
+        try:
+            if not connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products'"
+            ).fetchone():
+                raise UsageError(f'No products table in {path}')
+            start = time.perf_counter()
+            if not query.ensure_search_index(connection):
+                query.rebuild_search_index(connection)
+            catalog.ensure_catalog_tables(connection)
+            history.ensure_history_tables(connection)
+            count = connection.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+        finally:
+            connection.close()
+        print(f'Indexed {count} products in {path} in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,419 @@
+"""Replay the on-disk HTTP cache through the spider and item pipelines.
+
+    scrapy replay -o bench/before.json
+    scrapy replay -o bench/after.json --compare bench/before.json
+    scrapy replay --parser-backend lexbor --parity lxml
+
+No request leaves the machine: every cached listing, catalog and product
+response is fed straight to the matching spider callback, and the items go
+through the ITEM_PIPELINES chain.  Pipelines run inside a scratch directory
+so data/ and database/ are left alone.
+
+--parity BACKEND parses every product page a second time with another
+parser backend and reports each field where the two items differ.
+--trim parses bodies cut down by trimming.trim_html, as BodyTrimMiddleware
+would store them; --trim-parity also parses the untrimmed pages and
+reports items and listing requests that differ.
+"""
+
+import gc
+import json
+import os
+import pickle
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+import scrapy
+from itemadapter import ItemAdapter, is_item
+from scrapy import signals
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import DropItem, NotConfigured, UsageError
+from scrapy.http import Headers, Request
+from scrapy.responsetypes import responsetypes
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.conf import build_component_list
+from scrapy.utils.misc import build_from_crawler, load_object
+from scrapy.utils.project import data_path
+from w3lib.http import headers_raw_to_dict
+
+from carbon38_scraper import httpcache, trimming
+from carbon38_scraper.extraction import ExtractionContext, SelectorEngine, check_backend
+from carbon38_scraper.trimming import decode_body
+
+
+def iter_cache(cachedir):
+    """Yield (metadata, entry directory) for every cached response."""
+    for meta_path in sorted(Path(cachedir).glob('*/*/pickled_meta')):
+        with open(meta_path, 'rb') as f:
+            yield pickle.load(f), meta_path.parent
+
+
+def iter_entries(settings, spider_name):
+    """Iterate over (metadata, raw headers, raw body) in the configured HTTP cache."""
+    if issubclass(load_object(settings['HTTPCACHE_STORAGE']), httpcache.SqliteCacheStorage):
+        path = httpcache.cache_path(settings, spider_name).resolve()
+        if not path.exists():
+            raise UsageError(f'No HTTP cache at {path}')
+        return httpcache.iter_responses(path)
+    cachedir = Path(data_path(settings['HTTPCACHE_DIR'])).resolve() / spider_name
+    if not cachedir.is_dir():
+        raise UsageError(f'No HTTP cache at {cachedir}')
+    return ((meta, (entry / 'response_headers').read_bytes(), (entry / 'response_body').read_bytes())
+            for meta, entry in iter_cache(cachedir))
+
+
+def load_response(meta, raw_headers, raw_body):
+    """Build the decoded response stored in one cache entry."""
+    headers = Headers(headers_raw_to_dict(raw_headers))
+    body = decode_body(raw_body, headers)
+    url = meta['response_url']
+    respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+    request = Request(meta['url'], method=meta.get('method', 'GET'))
+    return respcls(url=url, status=meta['status'], headers=headers, body=body, request=request)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def item_differences(url, expected, actual):
+    """(url, field, expected, actual) for every field where two item lists differ."""
+    if len(expected) != len(actual):
+        return [(url, 'items', len(expected), len(actual))]
+    differences = []
+    for ours, theirs in zip(expected, actual):
+        for field in sorted(set(ours) | set(theirs)):
+            if field != 'scraped_at' and ours.get(field) != theirs.get(field):
+                differences.append((url, field, ours.get(field), theirs.get(field)))
+    return differences
+
+
+def retained_size(objects):
+    """Bytes reachable from objects, counting every shared object once.
+
+    Types, functions and modules are not followed, so this is what the
+    objects themselves hold: with interned strings, a brand shared by a
+    thousand items is counted once.
+    """
+    seen = set()
+    total = 0
+    pending = list(objects)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, (type, type(sys), type(retained_size))):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return total
+
+
+class Timings:
+    """Wall-clock samples per stage, summarised as count/total/p50/p95."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+    def summary(self):
+        result = {}
+        for stage, values in sorted(self.samples.items()):
+            values = sorted(values)
+            result[stage] = {
+                'count': len(values),
+                'total_s': round(sum(values), 6),
+                'p50_ms': round(percentile(values, 50) * 1000, 3),
+                'p95_ms': round(percentile(values, 95) * 1000, 3),
+            }
+        return result
+
+
+def callback_for(spider, response):
+    """Pick the spider callback that would have received this response."""
+    path = urlparse(response.url).path
+    if path.endswith('/products.json'):
+        query = dict(part.split('=', 1) for part in urlparse(response.url).query.split('&') if '=' in part)
+        handle = path.split('/collections/', 1)[-1].split('/', 1)[0]
+        return 'parse_catalog', spider.parse_catalog, {'handle': handle, 'page': int(query.get('page', 1))}
+    if '/products/' in path and path.endswith('.json'):
+        return 'parse_product_json', spider.parse_product_json, {'html_url': response.url[:-len('.json')]}
+    if '/products/' in path:
+        return 'parse_product', spider.parse_product, {}
+    return 'parse', spider.parse, {}
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return '[options]'
+
+    def short_desc(self):
+        return 'Benchmark parsing by replaying the HTTP cache through the spider and pipelines'
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('--spider', default='carbon38', help='spider whose cache to replay (default: %(default)s)')
+        parser.add_argument('-o', '--output', metavar='FILE', help='write the results as JSON to FILE')
+        parser.add_argument('--compare', metavar='FILE', help='print the change against an earlier results FILE')
+        parser.add_argument('--items', metavar='FILE', help='write the items the spider produced as JSON lines')
+        parser.add_argument('--limit', type=int, default=0, help='replay at most N responses')
+        parser.add_argument('--mode', default='html', help='catalog mode for the spider (default: %(default)s)')
+        parser.add_argument('--no-pipelines', action='store_true', help='only run the spider callbacks')
+        parser.add_argument('--trace-memory', action='store_true', help='also report the tracemalloc peak (slower)')
+        parser.add_argument('--parser-backend', metavar='NAME', help='HTML parser for product pages: lxml or lexbor')
+        parser.add_argument('--parity', metavar='NAME',
+                            help='also parse product pages with this backend and report differing items')
+        parser.add_argument('--trim', action='store_true', help='trim HTML bodies like BodyTrimMiddleware')
+        parser.add_argument('--trim-parity', action='store_true',
+                            help='trim, and also parse the untrimmed pages and report differences')
+        parser.add_argument('--compact-items', action='store_true', help='build CompactProductItem instead of ProductItem')
+        parser.add_argument('--retain-items', action='store_true',
+                            help='keep every item alive until the end, to measure memory per item')
+
+    def process_options(self, args, opts):
+        super().process_options(args, opts)
+        # Per-page INFO lines would dominate the timings
+        if not opts.loglevel:
+            self.settings.set('LOG_LEVEL', 'WARNING', priority='cmdline')
+        if opts.compact_items:
+            self.settings.set('CARBON38_COMPACT_ITEMS', True, priority='cmdline')
+        if opts.parser_backend:
+            self.settings.set('CARBON38_PARSER_BACKEND', opts.parser_backend, priority='cmdline')
+
+    def run(self, args, opts):
+        if opts.parity and opts.trim_parity:
+            raise UsageError('--parity and --trim-parity cannot be combined')
+        opts.trim = opts.trim or opts.trim_parity
+        entries = iter_entries(self.settings, opts.spider)
+
+        crawler = self.crawler_process.create_crawler(opts.spider)
+        crawler.stats = MemoryStatsCollector(crawler)
+        spider = crawler.spidercls.from_crawler(crawler, catalog_mode=opts.mode)
+        crawler.spider = spider
+        crawler.signals.send_catch_log(signals.spider_opened, spider=spider)
+
+        parity_spider = None
+        if opts.parity or opts.trim_parity:
+            # A spider of its own, so its selector chains reorder independently
+            parity_spider = crawler.spidercls(catalog_mode=opts.mode)
+            parity_spider.crawler = crawler
+            parity_spider.selector_engine = SelectorEngine(warmup=crawler.settings.getint('CARBON38_SELECTOR_WARMUP', 20))
+            parity_spider.parser_backend = check_backend(opts.parity or spider.parser_backend)
+            parity_spider.item_class = spider.item_class
+        mismatches = []
+
+        timings = Timings()
+        for name in dir(spider):
+            if name.startswith('extract_'):
+                setattr(spider, name, timings.wrap(name, getattr(spider, name)))
+
+        pipelines = []
+        if not opts.no_pipelines:
+            for path in build_component_list(crawler.settings.getwithbase('ITEM_PIPELINES')):
+                try:
+                    pipeline = build_from_crawler(load_object(path), crawler)
+                except NotConfigured as e:
+                    print(f'Skipping {path}: {e}')
+                    continue
+                stage = f'pipeline/{type(pipeline).__name__}'
+                pipelines.append((stage, timings.wrap(stage, pipeline.process_item), pipeline))
+
+        items_file = open(opts.items, 'w', encoding='utf-8') if opts.items else None
+        if opts.trace_memory:
+            tracemalloc.start()
+
+        retained = []
+        counts = {'responses': 0, 'skipped': 0, 'items': 0, 'dropped': 0, 'requests': 0}
+        trimmed = {'responses': 0, 'bytes_before': 0, 'bytes_after': 0}
+        pages = {}
+        elapsed = 0.0
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory(prefix='replay-') as scratch:
+            os.chdir(scratch)
+            try:
+                for _, _, pipeline in pipelines:
+                    if hasattr(pipeline, 'open_spider'):
+                        pipeline.open_spider(spider)
+
+                for meta, raw_headers, raw_body in entries:
+                    if opts.limit and counts['responses'] >= opts.limit:
+                        break
+                    if meta['status'] != 200:
+                        counts['skipped'] += 1
+                        continue
+                    response = untrimmed = load_response(meta, raw_headers, raw_body)
+                    kind, callback, kwargs = callback_for(spider, response)
+                    if opts.trim and isinstance(response, scrapy.http.HtmlResponse):
+                        # Counted in the elapsed time: a crawl pays for it too
+                        trim_start = time.perf_counter()
+                        response = response.replace(body=trimming.trim_html(response.body))
+                        timings.add('trim', time.perf_counter() - trim_start)
+                        elapsed += time.perf_counter() - trim_start
+                        trimmed['responses'] += 1
+                        trimmed['bytes_before'] += len(untrimmed.body)
+                        trimmed['bytes_after'] += len(response.body)
+                    counts['responses'] += 1
+                    pages[kind] = pages.get(kind, 0) + 1
+
+                    start = time.perf_counter()
+                    if kind == 'parse_product':
+                        # Building the document is reported on its own
+                        response = ExtractionContext.of(response, spider.parser_backend)
+                        response.document
+                        timings.add('dom', time.perf_counter() - start)
+                    elif isinstance(response, scrapy.http.TextResponse) and kind == 'parse':
+                        response.selector
+                        timings.add('dom', time.perf_counter() - start)
+                    callback_start = time.perf_counter()
+                    results = list(callback(response, **kwargs) or [])
+                    timings.add(f'callback/{kind}', time.perf_counter() - callback_start)
+                    if parity_spider is not None and kind == 'parse_product':
+                        expected = [ItemAdapter(r).asdict() for r in results if is_item(r)]
+                        other = [ItemAdapter(r).asdict()
+                                 for r in parity_spider.parse_product(untrimmed if opts.trim_parity else response, **kwargs)]
+                        counts['parity_checked'] = counts.get('parity_checked', 0) + 1
+                        mismatches.extend(item_differences(response.url, expected, other))
+                    elif opts.trim_parity and kind == 'parse':
+                        expected = [r.url for r in results if not is_item(r)]
+                        other = [r.url for r in parity_spider.parse(untrimmed, **kwargs) or [] if not is_item(r)]
+                        counts['parity_checked'] = counts.get('parity_checked', 0) + 1
+                        if expected != other:
+                            mismatches.append((response.url, 'requests', expected, other))
+
+                    for result in results:
+                        if not is_item(result):
+                            counts['requests'] += 1
+                            continue
+                        counts['items'] += 1
+                        if items_file:
+                            items_file.write(json.dumps(ItemAdapter(result).asdict(), sort_keys=True, default=str) + '\n')
+                        try:
+                            for _, process_item, _ in pipelines:
+                                result = process_item(result, spider)
+                        except DropItem:
+                            counts['dropped'] += 1
+                        if opts.retain_items:
+                            retained.append(result)
+                    elapsed += time.perf_counter() - start
+
+                for _, _, pipeline in pipelines:
+                    if hasattr(pipeline, 'close_spider'):
+                        pipeline.close_spider(spider)
+            finally:
+                os.chdir(cwd)
+                if items_file:
+                    items_file.close()
+
+        results = {
+            'spider': opts.spider,
+            'mode': opts.mode,
+            'started_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'scrapy': scrapy.__version__,
+            'pipelines': not opts.no_pipelines,
+            'item_class': spider.item_class.__name__,
+            **counts,
+            'pages': pages,
+            'elapsed_s': round(elapsed, 3),
+            'pages_per_s': round(counts['responses'] / elapsed, 2) if elapsed else 0.0,
+            'items_per_s': round(counts['items'] / elapsed, 2) if elapsed else 0.0,
+            'stages': timings.summary(),
+            # ru_maxrss is in KB on Linux and bytes on macOS
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                                 / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+            'stats': {k: v for k, v in crawler.stats.get_stats().items() if isinstance(v, (int, float, str))},
+        }
+        results['parser_backend'] = spider.parser_backend
+        if opts.trim:
+            results['trim'] = {**trimmed, 'bytes_saved': trimmed['bytes_before'] - trimmed['bytes_after']}
+        if parity_spider is not None:
+            against = 'untrimmed' if opts.trim_parity else opts.parity
+            results['parity'] = {'against': against, 'mismatches': mismatches}
+        if retained:
+            results['retained_kb_per_1000_items'] = round(retained_size(retained) / len(retained) * 1000 / 1024, 1)
+        if opts.trace_memory:
+            results['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            tracemalloc.stop()
+
+        self.print_results(results)
+        if opts.trim:
+            self.print_trim(results['trim'])
+        if parity_spider is not None:
+            self.print_parity(results, counts.get('parity_checked', 0))
+        if opts.compare:
+            with open(opts.compare, encoding='utf-8') as f:
+                self.print_comparison(json.load(f), results)
+        if opts.output:
+            os.makedirs(os.path.dirname(os.path.abspath(opts.output)), exist_ok=True)
+            with open(opts.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print(f'Results written to {opts.output}')
+
+    def print_results(self, results):
+        print(f"Replayed {results['responses']} responses ({results['skipped']} non-200 skipped) "
+              f"in {results['elapsed_s']}s: {results['pages_per_s']} pages/s, "
+              f"{results['items']} items, {results['items_per_s']} items/s, "
+              f"peak RSS {results['peak_rss_mb']} MB")
+        if 'tracemalloc_peak_mb' in results:
+            print(f"tracemalloc peak {results['tracemalloc_peak_mb']} MB")
+        if 'retained_kb_per_1000_items' in results:
+            print(f"{results['item_class']}: {results['retained_kb_per_1000_items']} KB per 1000 items")
+        print(f"{'stage':<40} {'count':>7} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for stage, row in results['stages'].items():
+            print(f"{stage:<40} {row['count']:>7} {row['total_s']:>9.3f} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f}")
+
+    def print_trim(self, trim):
+        if not trim['responses']:
+            return
+        print(f"Trimmed {trim['responses']} HTML bodies from {trim['bytes_before'] / 2 ** 20:.1f} MB "
+              f"to {trim['bytes_after'] / 2 ** 20:.1f} MB, "
+              f"{trim['bytes_saved'] / trim['responses'] / 1024:.0f} KB saved per response "
+              f"({trim['bytes_saved'] / trim['bytes_before']:.0%})")
+
+    def print_parity(self, results, checked):
+        mismatches = results['parity']['mismatches']
+        pages = len({url for url, _, _, _ in mismatches})
+        ours = 'trimmed' if results['parity']['against'] == 'untrimmed' else results['parser_backend']
+        print(f"Parity {ours} vs {results['parity']['against']}: "
+              f"{checked} pages, {pages} with differences")
+        for url, field, ours, theirs in mismatches[:20]:
+            print(f'  {url} {field}: {ours!r} != {theirs!r}')
+
+    def print_comparison(self, before, after):
+        def change(old, new):
+            if not old:
+                return 'n/a'
+            return f'{(new - old) / old * 100:+.1f}%'
+
+        print(f"\nAgainst {before.get('started_at', 'baseline')}:")
+        for key in ('pages_per_s', 'items_per_s', 'peak_rss_mb'):
+            print(f"  {key:<38} {before.get(key, 0):>9} -> {after[key]:>9}  {change(before.get(key), after[key])}")
+        for stage, row in after['stages'].items():
+            old = before.get('stages', {}).get(stage)
+            if old:
+                print(f"  {stage + ' p95 ms':<38} {old['p95_ms']:>9} -> {row['p95_ms']:>9}  "
+                      f"{change(old['p95_ms'], row['p95_ms'])}")
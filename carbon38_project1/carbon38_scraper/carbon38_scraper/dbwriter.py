@@ -0,0 +1,134 @@
+# Batched SQLite writes on a dedicated thread.
+#
+# Committing after every item costs an fsync per product on the reactor
+# thread.  BatchWriter takes (sql, params) statements from a bounded queue,
+# groups consecutive statements with the same SQL into executemany() calls
+# and commits once per batch.  A batch is flushed when it reaches batch_size
+# statements or flush_interval seconds after its first statement.
+#
+# When the queue is full, put() blocks the caller, which keeps memory
+# bounded if the disk falls behind.  close() drains everything queued
+# before it was called, commits, and joins the thread.
+#
+# If the thread dies (the database cannot be opened, a write raises
+# something other than sqlite3.Error) it keeps the exception, and put() and
+# close() raise WriterStopped instead of waiting on a queue nobody reads.
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from itertools import groupby
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+class WriterStopped(RuntimeError):
+    """The writer thread is no longer running; queued statements are lost."""
+
+
+class BatchWriter(threading.Thread):
+    """Writes queued statements to one SQLite database in batched transactions."""
+
+    def __init__(self, path, batch_size=500, flush_interval=2.0, max_queue=10000):
+        super().__init__(name='sqlite-writer', daemon=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_queued = 0
+        # The exception that stopped the thread
+        self.error = None
+
+    def put(self, sql, params):
+        self._enqueue((sql, params))
+        self.max_queued = max(self.max_queued, self.queue.qsize())
+
+    def close(self):
+        """Flush the partial batch and stop the thread."""
+        if self.is_alive():
+            try:
+                self._enqueue(_CLOSE)
+            except WriterStopped:
+                pass
+            self.join()
+        if self.error is not None:
+            raise self._stopped() from self.error
+
+    def _enqueue(self, statement):
+        # Wait for room in the queue only while the thread can make some
+        while True:
+            if self.error is not None or not self.is_alive():
+                raise self._stopped() from self.error
+            try:
+                self.queue.put(statement, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    def _stopped(self):
+        if self.error is not None:
+            return WriterStopped(f'SQLite writer for {self.path} failed: {self.error!r}')
+        return WriterStopped(f'SQLite writer for {self.path} is not running')
+
+    def run(self):
+        connection = None
+        try:
+            # Frontier workers share the database; wait for each other's commits
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # With WAL, NORMAL only syncs at checkpoints and cannot corrupt the database
+            connection.execute('PRAGMA synchronous=NORMAL')
+            # REPLACE must fire delete triggers, or the search index (query.py)
+            # keeps entries for replaced rows
+            connection.execute('PRAGMA recursive_triggers=ON')
+            closing = False
+            while not closing:
+                batch = [self.queue.get()]
+                if batch[0] is _CLOSE:
+                    break
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        statement = self.queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if statement is _CLOSE:
+                        closing = True
+                        break
+                    batch.append(statement)
+                self._write(connection, batch)
+        except BaseException as e:
+            self.error = e
+            logger.error(f'SQLite writer for {self.path} stopped: {e!r}')
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _write(self, connection, batch):
+        try:
+            with connection:
+                for sql, statements in groupby(batch, key=lambda statement: statement[0]):
+                    connection.executemany(sql, [params for _, params in statements])
+            self.written += len(batch)
+            self.batches += 1
+        except sqlite3.Error as e:
+            # One bad row must not lose the batch: retry row by row
+            logger.warning(f'Batch of {len(batch)} failed ({e}), writing rows one by one')
+            for sql, params in batch:
+                try:
+                    with connection:
+                        connection.execute(sql, params)
+                    self.written += 1
+                except sqlite3.Error as e:
+                    self.errors += 1
+                    logger.error(f'Error storing row in database: {e}')
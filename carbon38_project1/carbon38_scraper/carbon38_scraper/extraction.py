@@ -0,0 +1,502 @@
+# Per-response extraction context and selector chains shared by the
+# extract_* methods.
+#
+# Shopify product pages carry 60+ <script> blocks, some of them several
+# hundred KB.  Instead of every extractor running its own
+# response.css('script::text') query and lower-casing every body again,
+# the scripts are collected and classified once, the JSON-LD and the
+# embedded product JSON are parsed once, and regex lookups are memoized.
+#
+# Every CSS query on these pages walks a DOM of ~5k elements, and most of the
+# fallback selectors never match carbon38.com.  SelectorChain compiles a
+# field's fallbacks to XPath once, tries the ones that never matched last,
+# and skips selectors whose classes or ids do not occur anywhere in the
+# document, so the common case costs a single query.
+#
+# The documents the chains query come from a parser backend: 'lxml' reuses
+# the response's parsel selector, 'lexbor' parses the page with selectolax's
+# lexbor HTML5 parser instead and never builds an lxml tree.  Selectors are
+# written once, in parsel's CSS dialect (::text, ::attr(name)), for both.
+
+import json
+import re
+
+import cssselect
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# The regex lookups the extract_* methods run over inline scripts, as
+# (pattern, needle, flags): needle is a literal the pattern cannot match
+# without.  A lookup's patterns are tried in order against each script and
+# the first script with a match supplies the value, so trimming.trim_html
+# keeps that script and can drop the others.
+SCRIPT_LOOKUPS = {
+    'reviews': ((r'"review_count":\s*(\d+)', '"review_count":', 0),),
+    'colour': ((r'"color":\s*"([^"]+)"', '"color":', re.IGNORECASE),),
+    'sizes': ((r'"size":\s*"([^"]+)"', '"size":', re.IGNORECASE),),
+    'sku': ((r'"sku":\s*"([^"]+)"', '"sku":', re.IGNORECASE),),
+    'product_id': (
+        (r'"product_id":\s*(\d+)', '"product_id":', 0),
+        (r'"id":\s*(\d+)', '"id":', 0),
+        (r'"productId":\s*"([^"]+)"', '"productId":', 0),
+        (r'"handle":\s*"([^"]+)"', '"handle":', 0),
+    ),
+}
+
+
+class ExtractionContext:
+    """Wraps a response and indexes its scripts on first use."""
+
+    def __init__(self, response, backend='lxml'):
+        self.response = response
+        self.url = response.url
+        self.backend = backend
+        self._document = None
+        self._scripts = None
+        self._lowered = None
+        self._json_ld = None
+        self._product_json = None
+        self._matches = {}
+        self._names = None
+
+    @classmethod
+    def of(cls, response, backend=None):
+        """Return the context for response, wrapping it if needed.
+
+        An existing context is reused unless a different backend is asked for.
+        """
+        if isinstance(response, cls):
+            if backend is None or backend == response.backend:
+                return response
+            response = response.response
+        return cls(response, backend or 'lxml')
+
+    @property
+    def document(self):
+        """The parsed page, built by the context's parser backend on first use."""
+        if self._document is None:
+            self._document = BACKENDS[self.backend](self.response)
+        return self._document
+
+    @property
+    def names(self):
+        """Every class and id used in the document, as ('class'|'id', name)."""
+        if self._names is None:
+            classes, ids = self.document.class_and_id_values()
+            names = {('class', name) for name in ' '.join(classes).split()}
+            names.update(('id', name) for name in ids)
+            self._names = names
+        return self._names
+
+    # The extractors use the context anywhere they used the response
+    def css(self, query):
+        return self.response.css(query)
+
+    def xpath(self, query, **kwargs):
+        return self.response.xpath(query, **kwargs)
+
+    def _index_scripts(self):
+        scripts, json_ld, product_json = [], [], []
+        for text, attrib in self.document.scripts():
+            if not text:
+                continue
+            scripts.append(text)
+            if attrib.get('type') == 'application/ld+json':
+                json_ld.append(text)
+            elif 'data-product-json' in attrib:
+                product_json.append(text)
+        self._scripts = scripts
+        self._json_ld_sources = json_ld
+        self._product_json_sources = product_json
+
+    @property
+    def scripts(self):
+        """Text of every inline script, in document order."""
+        if self._scripts is None:
+            self._index_scripts()
+        return self._scripts
+
+    @property
+    def lowered_scripts(self):
+        if self._lowered is None:
+            self._lowered = [script.lower() for script in self.scripts]
+        return self._lowered
+
+    def scripts_containing(self, needle, case_sensitive=False):
+        """Scripts that contain needle, in document order."""
+        if case_sensitive:
+            return [s for s in self.scripts if needle in s]
+        needle = needle.lower()
+        return [s for s, low in zip(self.scripts, self.lowered_scripts) if needle in low]
+
+    def search(self, pattern, needle, flags=0):
+        """First group(1) of pattern in the first script containing needle.
+
+        needle must be a literal the pattern cannot match without, so the
+        cheap substring test skips scripts the regex would scan in vain.
+        """
+        key = ('search', pattern, needle, flags)
+        if key not in self._matches:
+            result = None
+            regex = re.compile(pattern, flags)
+            for script in self.scripts_containing(needle, not flags & re.IGNORECASE):
+                match = regex.search(script)
+                if match:
+                    result = match.group(1)
+                    break
+            self._matches[key] = result
+        return self._matches[key]
+
+    def findall(self, pattern, needle, flags=0):
+        """All matches of pattern in the first script that has any."""
+        key = ('findall', pattern, needle, flags)
+        if key not in self._matches:
+            result = []
+            regex = re.compile(pattern, flags)
+            for script in self.scripts_containing(needle, not flags & re.IGNORECASE):
+                result = regex.findall(script)
+                if result:
+                    break
+            self._matches[key] = result
+        return self._matches[key]
+
+    def lookup(self, name):
+        """group(1) of SCRIPT_LOOKUPS[name] in the first script it matches."""
+        patterns = SCRIPT_LOOKUPS[name]
+        if len(patterns) == 1:
+            return self.search(*patterns[0])
+        key = ('lookup', name)
+        if key not in self._matches:
+            result = None
+            compiled = [(re.compile(pattern, flags), needle, flags) for pattern, needle, flags in patterns]
+            for index, script in enumerate(self.scripts):
+                for regex, needle, flags in compiled:
+                    if flags & re.IGNORECASE:
+                        found = needle.lower() in self.lowered_scripts[index]
+                    else:
+                        found = needle in script
+                    match = found and regex.search(script)
+                    if match:
+                        result = match.group(1)
+                        break
+                if result is not None:
+                    break
+            self._matches[key] = result
+        return self._matches[key]
+
+    def lookup_all(self, name):
+        """Every match of SCRIPT_LOOKUPS[name] in the first script it matches."""
+        (pattern, needle, flags), = SCRIPT_LOOKUPS[name]
+        return self.findall(pattern, needle, flags)
+
+    @property
+    def json_ld(self):
+        """Parsed JSON-LD blocks; blocks that fail to parse are skipped."""
+        if self._json_ld is None:
+            if self._scripts is None:
+                self._index_scripts()
+            self._json_ld = []
+            for source in self._json_ld_sources:
+                try:
+                    self._json_ld.append(json.loads(source))
+                except json.JSONDecodeError:
+                    continue
+        return self._json_ld
+
+    @property
+    def product_json(self):
+        """The theme's embedded product object (same shape as /products/<handle>.js)."""
+        if self._product_json is None:
+            if self._scripts is None:
+                self._index_scripts()
+            self._product_json = {}
+            for source in self._product_json_sources:
+                try:
+                    data = json.loads(source)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(data, dict):
+                    self._product_json = data.get('product', data)
+                    break
+        return self._product_json or None
+
+
+_translator = HTMLTranslator()
+_all_classes = etree.XPath('//@class', smart_strings=False)
+_all_ids = etree.XPath('//@id', smart_strings=False)
+_all_scripts = etree.XPath('//script')
+_template_tag = re.compile(r'<(/?)template\b', re.IGNORECASE)
+_pseudo_element = re.compile(r'::(text|attr\(\s*([\w:-]+)\s*\))\s*$')
+
+
+def split_selector_list(css):
+    """Split a CSS selector list on its top-level commas."""
+    parts, depth, quote, start = [], 0, None, 0
+    for index, char in enumerate(css):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(css[start:index].strip())
+            start = index + 1
+    parts.append(css[start:].strip())
+    return parts
+
+
+class LxmlDocument:
+    """The lxml tree of the response's parsel selector; queries are XPath."""
+
+    def __init__(self, response):
+        self.root = response.selector.root
+
+    @staticmethod
+    def compile(css):
+        return etree.XPath(_translator.css_to_xpath(css), smart_strings=False)
+
+    def class_and_id_values(self):
+        return _all_classes(self.root), _all_ids(self.root)
+
+    def scripts(self):
+        """(text, attributes) of every <script>, in document order."""
+        return [(script.text, script.attrib) for script in _all_scripts(self.root)]
+
+    def query(self, compiled):
+        return compiled(self.root)
+
+    @staticmethod
+    def value(result):
+        if isinstance(result, str):
+            return str(result)
+        return etree.tostring(result, encoding='unicode', method='html', with_tail=False)
+
+
+class LexborDocument:
+    """The page parsed by selectolax's lexbor engine, queried with its CSS.
+
+    lexbor has no ::text or ::attr(); compile() strips the pseudo-element
+    and query() applies it to the matched nodes, with parsel's semantics:
+    ::text yields the element's own text nodes, ::attr(name) the value of
+    every matched element that has the attribute.  All alternatives of a
+    selector list must use the same pseudo-element.
+
+    An HTML5 parser keeps <template> contents out of the tree, while lxml
+    parses them like any element, and the theme renders price, sizes and
+    gallery inside templates.  They are renamed to a custom element first
+    so both backends see the same elements.
+    """
+
+    def __init__(self, response):
+        self.tree = LexborHTMLParser(_template_tag.sub(r'<\1x-template', response.text))
+
+    @staticmethod
+    def compile(css):
+        selectors, pseudos = [], set()
+        for selector in split_selector_list(css):
+            match = _pseudo_element.search(selector)
+            if match:
+                selector = selector[:match.start()]
+                pseudos.add(('attr', match.group(2)) if match.group(2) else ('text', None))
+            else:
+                pseudos.add((None, None))
+            selectors.append(selector.strip() or '*')
+        if len(pseudos) > 1:
+            raise ValueError(f'Mixed pseudo-elements in {css!r} are not supported by the lexbor backend')
+        return (', '.join(selectors), *pseudos.pop())
+
+    def class_and_id_values(self):
+        classes, ids = [], []
+        for node in self.tree.css('[class], [id]'):
+            attributes = node.attributes
+            if attributes.get('class'):
+                classes.append(attributes['class'])
+            if attributes.get('id'):
+                ids.append(attributes['id'])
+        return classes, ids
+
+    def scripts(self):
+        return [(script.text(deep=True), script.attributes) for script in self.tree.css('script')]
+
+    def query(self, compiled):
+        css, pseudo, name = compiled
+        nodes = self.tree.css(css)
+        if pseudo == 'text':
+            return [child.text_content for node in nodes
+                    for child in node.iter(include_text=True)
+                    if child.is_text_node and child.text_content]
+        if pseudo == 'attr':
+            return [node.attributes[name] or '' for node in nodes if name in node.attributes]
+        return nodes
+
+    @staticmethod
+    def value(result):
+        if isinstance(result, str):
+            return result
+        return result.html
+
+
+BACKENDS = {'lxml': LxmlDocument, 'lexbor': LexborDocument}
+
+
+def check_backend(backend):
+    """Raise ValueError unless backend names a usable parser backend."""
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown parser backend {backend!r}, expected one of {sorted(BACKENDS)}')
+    if backend == 'lexbor' and LexborHTMLParser is None:
+        raise ValueError('The lexbor parser backend needs selectolax (pip install selectolax)')
+    return backend
+
+
+def _names_in(tree):
+    """Classes and ids an element must carry to match this selector tree.
+
+    Only positive requirements are collected: negations and the arguments
+    of functional pseudo-classes are ignored, which can only make the
+    check more permissive.
+    """
+    names = set()
+    while tree is not None:
+        if isinstance(tree, cssselect.parser.CombinedSelector):
+            names |= _names_in(tree.subselector)
+        elif isinstance(tree, cssselect.parser.Class):
+            names.add(('class', tree.class_name))
+        elif isinstance(tree, cssselect.parser.Hash):
+            names.add(('id', tree.id))
+        tree = getattr(tree, 'selector', None)
+    return names
+
+
+def required_names(css):
+    """Per comma-separated alternative, the classes/ids it cannot match without."""
+    try:
+        return [frozenset(_names_in(sel.parsed_tree)) for sel in cssselect.parse(css)]
+    except cssselect.SelectorError:
+        return [frozenset()]
+
+
+class SelectorChain:
+    """A field's CSS fallback selectors, compiled once and tried in declared order.
+
+    Once warmup pages have been seen, selectors that have never matched are
+    moved behind the others: they are still consulted, just last.  Hit
+    counts never reorder the selectors that do match, so which of them
+    supplies a value does not depend on the pages crawled before.
+    """
+
+    def __init__(self, field, selectors, warmup=20, stats=None):
+        self.field = field
+        self.selectors = list(selectors)
+        # Compiled queries per document class, built on first use
+        self.queries = {}
+        self.requirements = [required_names(css) for css in self.selectors]
+        self.hits = [0] * len(self.selectors)
+        self.order = list(range(len(self.selectors)))
+        self.calls = 0
+        self.warmup = warmup
+        self.stats = stats
+
+    def _query(self, page, index):
+        """Run selectors[index], unless the document lacks a class/id it needs."""
+        requirements = self.requirements[index]
+        if not any(required <= page.names for required in requirements):
+            if self.stats is not None:
+                self.stats.inc_value('selectors/skipped')
+            return []
+        if self.stats is not None:
+            self.stats.inc_value('selectors/queries')
+        document = page.document
+        queries = self.queries.get(type(document))
+        if queries is None:
+            queries = self.queries[type(document)] = [document.compile(css) for css in self.selectors]
+        return document.query(queries[index])
+
+    def _record(self, index):
+        """Count a hit for selectors[index] (None: the whole chain missed)."""
+        self.calls += 1
+        if index is not None:
+            self.hits[index] += 1
+        if self.stats is not None:
+            if index is None:
+                self.stats.inc_value(f'selectors/{self.field}/miss')
+            else:
+                self.stats.inc_value(f'selectors/{self.field}/hit/{self.selectors[index]}')
+        if self.calls == self.warmup or (self.calls > self.warmup and index is not None
+                                         and self.hits[index] == 1):
+            # Declared order, with the selectors that never matched last
+            self.order = sorted(range(len(self.selectors)), key=lambda i: not self.hits[i])
+
+    def first(self, response):
+        """First non-blank value of the first selector that has one, stripped."""
+        page = ExtractionContext.of(response)
+        for index in self.order:
+            results = self._query(page, index)
+            if results:
+                text = page.document.value(results[0])
+                if text and text.strip():
+                    self._record(index)
+                    return text.strip()
+        self._record(None)
+        return None
+
+    def get(self, response):
+        """First value of the first selector that returns anything."""
+        page = ExtractionContext.of(response)
+        for index in self.order:
+            results = self._query(page, index)
+            if results:
+                value = page.document.value(results[0])
+                if value:
+                    self._record(index)
+                    return value
+        self._record(None)
+        return None
+
+    def getall(self, response):
+        """All values of the first selector that returns anything."""
+        page = ExtractionContext.of(response)
+        for index in self.order:
+            results = self._query(page, index)
+            if results:
+                self._record(index)
+                return [page.document.value(r) for r in results]
+        self._record(None)
+        return []
+
+    def report(self):
+        """Selectors with their hit counts, in the order they are tried."""
+        return [(self.selectors[i], self.hits[i]) for i in self.order]
+
+
+class SelectorEngine:
+    """Holds the compiled chain of every field, keyed by field name."""
+
+    def __init__(self, stats=None, warmup=20):
+        self.stats = stats
+        self.warmup = warmup
+        self.chains = {}
+
+    def chain(self, field, selectors):
+        chain = self.chains.get(field)
+        if chain is None:
+            chain = SelectorChain(field, selectors, self.warmup, self.stats)
+            self.chains[field] = chain
+        return chain
+
+    def first(self, response, field, selectors):
+        return self.chain(field, selectors).first(response)
+
+    def get(self, response, field, selectors):
+        return self.chain(field, selectors).get(response)
+
+    def getall(self, response, field, selectors):
+        return self.chain(field, selectors).getall(response)
@@ -0,0 +1,45 @@
+# Buffered, optionally compressed output files for the export pipelines.
+#
+# zstd comes from the standard library on Python 3.14+ (compression.zstd),
+# from the backports.zstd package before that, or from zstandard.
+
+import gzip
+import io
+
+SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def _open_zstd(path, level):
+    try:
+        from compression import zstd
+    except ImportError:
+        try:
+            from backports import zstd
+        except ImportError:
+            zstd = None
+    if zstd is not None:
+        return zstd.open(path, 'wb', level=level)
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('zstd output needs Python 3.14, backports.zstd or zstandard') from None
+    return zstandard.open(path, 'wb', cctx=zstandard.ZstdCompressor(level=level))
+
+
+def open_binary(path, compression=None, buffer_size=1024 * 1024, level=None):
+    """Open path for writing through a buffer_size write buffer and compressor."""
+    if compression not in SUFFIXES:
+        raise ValueError(f'Unknown compression {compression!r}, expected one of {sorted(filter(None, SUFFIXES))}')
+    if compression == 'gzip':
+        raw = gzip.open(path, 'wb', compresslevel=6 if level is None else level)
+    elif compression == 'zstd':
+        raw = _open_zstd(path, 3 if level is None else level)
+    else:
+        return open(path, 'wb', buffering=buffer_size)
+    # Hand the compressor large chunks instead of one call per row
+    return io.BufferedWriter(raw, buffer_size)
+
+
+def open_text(path, compression=None, buffer_size=1024 * 1024, level=None):
+    """Text version of open_binary, with newline='' as the csv module expects."""
+    return io.TextIOWrapper(open_binary(path, compression, buffer_size, level), encoding='utf-8', newline='')
@@ -0,0 +1,375 @@
+# Shared crawl frontier for running several carbon38 processes at once.
+#
+# With CARBON38_FRONTIER_URL set, FrontierScheduler keeps the request queue
+# and the dupefilter fingerprints in a shared store instead of in memory:
+#
+#   redis://host:6379/0     Redis, or anything speaking its protocol
+#                           (needs the redis package)
+#   sqlite:///frontier.db   a SQLite file standing in for Redis, for
+#                           workers on one machine and for local runs
+#
+# Requests are spread over CARBON38_FRONTIER_SHARDS queues by request
+# fingerprint.  Worker CARBON38_FRONTIER_WORKER of CARBON38_FRONTIER_WORKERS
+# owns every shard whose number modulo the worker count is its own.  It pops
+# from those first and takes work from the other shards only when its own
+# are empty.  Each queue is a sorted set scored by priority and then by
+# arrival, so product pages still go before listings and requests of equal
+# priority come out first in, first out.
+#
+# A request is only queued if its fingerprint is new to the shared set, so
+# no two workers fetch the same page.  Every worker writes to the same
+# CARBON38_DATABASE; the CSV, JSON and Parquet exports get a -w<N> suffix
+# per worker.  A worker whose queues run dry waits up to
+# CARBON38_FRONTIER_IDLE_TIMEOUT seconds for other workers to push more
+# before it closes.
+#
+# The queues and fingerprints outlive the processes, so a stopped crawl
+# resumes where it left off.  Clear them with `scrapy frontier reset` before
+# starting a new one.
+#
+# Without CARBON38_FRONTIER_URL the scheduler is Scrapy's own.
+
+import logging
+import pickle
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.core.scheduler import Scheduler
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.request import request_from_dict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class RedisBackend:
+    """The few Redis commands the frontier needs."""
+
+    def __init__(self, url):
+        if redis is None:
+            raise ValueError('A redis:// frontier needs the redis package')
+        self.client = redis.Redis.from_url(url)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def zadd(self, key, member, score):
+        self.client.zadd(key, {member: score})
+
+    def zpopmax(self, key):
+        popped = self.client.zpopmax(key)
+        return popped[0][0] if popped else None
+
+    def zcard(self, key):
+        return self.client.zcard(key)
+
+    def sadd(self, key, member):
+        return self.client.sadd(key, member) == 1
+
+    def scard(self, key):
+        return self.client.scard(key)
+
+    def keys(self, prefix):
+        pattern = ''.join('\\' + c if c in '*?[]\\' else c for c in prefix) + '*'
+        return [key.decode() for key in self.client.scan_iter(match=pattern)]
+
+    def delete_prefix(self, prefix):
+        keys = list(self.client.scan_iter(match=f'{prefix}:*'))
+        if keys:
+            self.client.delete(*keys)
+        return len(keys)
+
+    def close(self):
+        self.client.close()
+
+
+class SqliteBackend:
+    """Stand-in for RedisBackend on top of one SQLite file.
+
+    Every command is its own transaction, so several processes can share
+    the file; pops take the write lock first so no two get the same member.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS zsets (key TEXT NOT NULL, score REAL NOT NULL, member BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS zsets_key_score ON zsets (key, score);
+        CREATE TABLE IF NOT EXISTS sets (key TEXT NOT NULL, member BLOB NOT NULL, PRIMARY KEY (key, member))
+            WITHOUT ROWID;
+    '''
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(self.SCHEMA)
+
+    def incr(self, key):
+        return self.connection.execute(
+            'INSERT INTO counters VALUES (?, 1) ON CONFLICT (key) DO UPDATE SET value = value + 1 '
+            'RETURNING value', (key,)
+        ).fetchone()[0]
+
+    def zadd(self, key, member, score):
+        self.connection.execute('INSERT INTO zsets VALUES (?, ?, ?)', (key, score, member))
+
+    def zpopmax(self, key):
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute(
+                'SELECT rowid, member FROM zsets WHERE key = ? ORDER BY score DESC LIMIT 1', (key,)
+            ).fetchone()
+            if row is not None:
+                self.connection.execute('DELETE FROM zsets WHERE rowid = ?', (row[0],))
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return row[1] if row else None
+
+    def zcard(self, key):
+        return self.connection.execute('SELECT COUNT(*) FROM zsets WHERE key = ?', (key,)).fetchone()[0]
+
+    def sadd(self, key, member):
+        return self.connection.execute('INSERT OR IGNORE INTO sets VALUES (?, ?)', (key, member)).rowcount == 1
+
+    def scard(self, key):
+        return self.connection.execute('SELECT COUNT(*) FROM sets WHERE key = ?', (key,)).fetchone()[0]
+
+    @staticmethod
+    def _like(prefix):
+        return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+    def keys(self, prefix):
+        pattern = self._like(prefix)
+        return [row[0] for table in ('counters', 'zsets', 'sets') for row in self.connection.execute(
+            f"SELECT DISTINCT key FROM {table} WHERE key LIKE ? ESCAPE '\\'", (pattern,))]
+
+    def delete_prefix(self, prefix):
+        pattern = self._like(prefix + ':')
+        deleted = 0
+        for table in ('counters', 'zsets', 'sets'):
+            deleted += self.connection.execute(
+                f"DELETE FROM {table} WHERE key LIKE ? ESCAPE '\\'", (pattern,)
+            ).rowcount
+        return deleted
+
+    def close(self):
+        self.connection.close()
+
+
+def worker_tag(settings):
+    """'-w<N>' for output files of one of several frontier workers, else ''."""
+    if settings.get('CARBON38_FRONTIER_URL') and settings.getint('CARBON38_FRONTIER_WORKERS', 1) > 1:
+        return f"-w{settings.getint('CARBON38_FRONTIER_WORKER', 0)}"
+    return ''
+
+
+def open_backend(url):
+    """Backend for a redis:// or sqlite:/// frontier URL."""
+    parsed = urlparse(url)
+    if parsed.scheme in ('redis', 'rediss', 'unix'):
+        return RedisBackend(url)
+    if parsed.scheme == 'sqlite':
+        # sqlite:///relative.db, sqlite:////absolute.db
+        return SqliteBackend(parsed.path[1:])
+    raise ValueError(f'Unknown frontier URL {url!r}, expected redis:// or sqlite:///')
+
+
+class Frontier:
+    """Sharded priority queues and a fingerprint set under one key prefix."""
+
+    def __init__(self, backend, prefix, worker=0, workers=1, shards=None, steal=True):
+        if not 0 <= worker < workers:
+            raise ValueError(f'CARBON38_FRONTIER_WORKER must be in 0..{workers - 1}, got {worker}')
+        self.backend = backend
+        self.prefix = prefix
+        self.shards = shards or workers
+        own = [shard for shard in range(self.shards) if shard % workers == worker]
+        others = [shard for shard in range(self.shards) if shard % workers != worker] if steal else []
+        self.pull_order = [(self.queue_key(shard), False) for shard in own] + \
+                          [(self.queue_key(shard), True) for shard in others]
+        self.all_keys = [self.queue_key(shard) for shard in range(self.shards)]
+
+    @classmethod
+    def from_settings(cls, settings, spider_name):
+        url = settings.get('CARBON38_FRONTIER_URL')
+        if not url:
+            return None
+        return cls(
+            open_backend(url),
+            settings.get('CARBON38_FRONTIER_KEY') or spider_name,
+            settings.getint('CARBON38_FRONTIER_WORKER', 0),
+            settings.getint('CARBON38_FRONTIER_WORKERS', 1),
+            settings.getint('CARBON38_FRONTIER_SHARDS', 0),
+            settings.getbool('CARBON38_FRONTIER_STEAL', True),
+        )
+
+    def queue_key(self, shard):
+        return f'{self.prefix}:queue:{shard}'
+
+    @property
+    def seen_key(self):
+        return f'{self.prefix}:seen'
+
+    def shard_of(self, fingerprint):
+        return int.from_bytes(fingerprint[:4], 'big') % self.shards
+
+    def add_fingerprint(self, fingerprint):
+        """True if no worker has seen the fingerprint yet."""
+        return self.backend.sadd(self.seen_key, fingerprint)
+
+    def push(self, fingerprint, priority, data):
+        seq = self.backend.incr(f'{self.prefix}:seq')
+        # Higher priority first, then first in first out; the sequence also
+        # keeps identical dont_filter requests apart in the set
+        score = priority * 2.0 ** 32 - seq
+        self.backend.zadd(self.queue_key(self.shard_of(fingerprint)), seq.to_bytes(8, 'big') + data, score)
+
+    def pop(self):
+        """(request data, stolen) from the first non-empty queue, or (None, False)."""
+        for key, stolen in self.pull_order:
+            member = self.backend.zpopmax(key)
+            if member is not None:
+                return member[8:], stolen
+        return None, False
+
+    def pending(self, everywhere=False):
+        """Requests queued in the shards this worker pulls from, or in all of them."""
+        keys = self.all_keys if everywhere else [key for key, _ in self.pull_order]
+        return sum(self.backend.zcard(key) for key in keys)
+
+    def queue_keys(self):
+        """Queue keys of the configured shards and of every shard in the store."""
+        # Workers started with other CARBON38_FRONTIER_SHARDS/WORKERS settings
+        # may have left requests in shards this configuration does not have
+        stored = self.backend.keys(f'{self.prefix}:queue:')
+        keys = set(self.all_keys) | set(stored)
+
+        def shard(key):
+            number = key.rsplit(':', 1)[1]
+            return (0, int(number), '') if number.isdigit() else (1, 0, number)
+        return sorted(keys, key=shard)
+
+    def status(self):
+        return {
+            'queued': {key: self.backend.zcard(key) for key in self.queue_keys()},
+            'fingerprints': self.backend.scard(self.seen_key),
+        }
+
+    def reset(self):
+        return self.backend.delete_prefix(self.prefix)
+
+    def close(self):
+        self.backend.close()
+
+
+class SharedDupeFilter(BaseDupeFilter):
+    """Dupefilter backed by the frontier's shared fingerprint set."""
+
+    def __init__(self, frontier, fingerprinter, stats, debug=False):
+        self.frontier = frontier
+        self.fingerprinter = fingerprinter
+        self.stats = stats
+        self.debug = debug
+        self.logdupes = True
+
+    def request_seen(self, request):
+        return not self.frontier.add_fingerprint(self.fingerprinter.fingerprint(request))
+
+    def log(self, request, spider):
+        if self.debug:
+            logger.debug(f'Filtered duplicate request: {request}')
+        elif self.logdupes:
+            logger.debug(f'Filtered duplicate request: {request} - no more duplicates will be shown '
+                         f'(see DUPEFILTER_DEBUG to show all duplicates)')
+            self.logdupes = False
+        self.stats.inc_value('dupefilter/filtered')
+
+
+class FrontierScheduler(Scheduler):
+    """Scrapy's scheduler, or the shared frontier when CARBON38_FRONTIER_URL is set."""
+
+    frontier = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        scheduler = super().from_crawler(crawler)
+        settings = crawler.settings
+        scheduler.frontier = Frontier.from_settings(settings, crawler.spidercls.name)
+        if scheduler.frontier is not None:
+            scheduler.df = SharedDupeFilter(scheduler.frontier, crawler.request_fingerprinter,
+                                            crawler.stats, settings.getbool('DUPEFILTER_DEBUG'))
+            scheduler.idle_timeout = settings.getfloat('CARBON38_FRONTIER_IDLE_TIMEOUT', 30)
+            scheduler.idle_since = None
+            crawler.signals.connect(scheduler.spider_idle, signal=signals.spider_idle)
+        return scheduler
+
+    def open(self, spider):
+        if self.frontier is None:
+            return super().open(spider)
+        self.spider = spider
+        logger.info(f'Using the shared frontier {self.frontier.prefix!r} '
+                    f'({self.frontier.status()["fingerprints"]} fingerprints already seen)')
+        return None
+
+    def close(self, reason):
+        if self.frontier is None:
+            return super().close(reason)
+        self.frontier.close()
+        return None
+
+    def has_pending_requests(self):
+        if self.frontier is None:
+            return super().has_pending_requests()
+        return self.frontier.pending() > 0
+
+    def enqueue_request(self, request):
+        if self.frontier is None:
+            return super().enqueue_request(request)
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        fingerprint = self.crawler.request_fingerprinter.fingerprint(request)
+        data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        self.frontier.push(fingerprint, request.priority, data)
+        self.stats.inc_value('scheduler/enqueued')
+        self.stats.inc_value('frontier/pushed')
+        return True
+
+    def next_request(self):
+        if self.frontier is None:
+            return super().next_request()
+        data, stolen = self.frontier.pop()
+        if data is None:
+            return None
+        self.idle_since = None
+        self.stats.inc_value('scheduler/dequeued')
+        self.stats.inc_value('frontier/popped')
+        if stolen:
+            self.stats.inc_value('frontier/stolen')
+        return request_from_dict(pickle.loads(data), spider=self.spider)  # noqa: S301
+
+    def __len__(self):
+        if self.frontier is None:
+            return super().__len__()
+        return self.frontier.pending()
+
+    def spider_idle(self, spider):
+        """Keep the spider open while other workers may still push requests."""
+        if self.frontier.pending(everywhere=True):
+            self.idle_since = None
+            raise DontCloseSpider
+        now = time.monotonic()
+        if self.idle_since is None:
+            self.idle_since = now
+        if now - self.idle_since < self.idle_timeout:
+            self.stats.inc_value('frontier/idle_waits')
+            raise DontCloseSpider
@@ -0,0 +1,144 @@
+# Append-only price and availability history.
+#
+# INSERT OR REPLACE keeps only the latest price of a product.  A trigger on
+# variants (catalog.py) appends a row to price_history when a variant's
+# price or availability differs from the last one recorded, so a product
+# re-scraped at the same price adds nothing.  A series is one variant of one
+# product: (product_url, variant id, or size for variants without one),
+# because products.id changes with every REPLACE.
+#
+#   price_series   one row per series: current, lowest and last change
+#   price_history  (series, observed_at, price_cents, available, change_cents)
+#
+# Prices are integer cents and times unix seconds (from scraped_at, which
+# is local time).  price_history is a WITHOUT ROWID table clustered on
+# (series, observed_at), so a series' rows sit together in time order, and
+# change_cents holds the difference from the previous row (NULL for the
+# first observation, 0 when only the availability changed).  "What changed
+# in the last N days" is a range scan of idx_history_observed and "current
+# vs lowest" reads price_series only: neither reads older history.
+#
+# The trigger runs inside the statement that writes the variant, and SQLite
+# applies that statement's OR REPLACE to the trigger's statements too, so
+# they avoid conflicts with NOT EXISTS instead of OR IGNORE.
+
+HISTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS price_series (
+    id INTEGER PRIMARY KEY,
+    product_url TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    current_cents INTEGER,
+    current_available INTEGER,
+    lowest_cents INTEGER,
+    lowest_at INTEGER,
+    changed_at INTEGER,
+    UNIQUE (product_url, variant)
+);
+CREATE TABLE IF NOT EXISTS price_history (
+    series INTEGER NOT NULL REFERENCES price_series (id),
+    observed_at INTEGER NOT NULL,
+    price_cents INTEGER,
+    available INTEGER,
+    change_cents INTEGER,
+    PRIMARY KEY (series, observed_at)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_history_observed ON price_history (observed_at);
+CREATE TRIGGER IF NOT EXISTS price_history_series AFTER INSERT ON price_history BEGIN
+    UPDATE price_series SET
+        current_cents = new.price_cents,
+        current_available = new.available,
+        changed_at = new.observed_at,
+        lowest_at = CASE WHEN new.price_cents < coalesce(lowest_cents, new.price_cents + 1)
+                         THEN new.observed_at ELSE lowest_at END,
+        lowest_cents = CASE WHEN new.price_cents < coalesce(lowest_cents, new.price_cents + 1)
+                            THEN new.price_cents ELSE lowest_cents END
+    WHERE id = new.series;
+END;
+CREATE TRIGGER IF NOT EXISTS variants_price_history AFTER INSERT ON variants BEGIN
+    INSERT INTO price_series (product_url, variant)
+    SELECT p.product_url, coalesce(new.variant_id, new.size, '') FROM products p
+    WHERE p.id = new.product_rowid AND p.product_url IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM price_series s
+        WHERE s.product_url = p.product_url AND s.variant = coalesce(new.variant_id, new.size, ''));
+    INSERT INTO price_history (series, observed_at, price_cents, available, change_cents)
+    SELECT s.id, coalesce(CAST(strftime('%s', p.scraped_at, 'utc') AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER)),
+           CAST(round(new.price * 100) AS INTEGER), new.available,
+           CAST(round(new.price * 100) AS INTEGER) - s.current_cents
+    FROM products p JOIN price_series s
+        ON s.product_url = p.product_url AND s.variant = coalesce(new.variant_id, new.size, '')
+    WHERE p.id = new.product_rowid
+        AND (s.changed_at IS NULL
+             OR s.current_cents IS NOT CAST(round(new.price * 100) AS INTEGER)
+             OR s.current_available IS NOT new.available);
+END;
+'''
+
+SERIES_SQL = '''
+    INSERT INTO price_series (product_url, variant)
+    SELECT DISTINCT p.product_url, coalesce(v.variant_id, v.size, '')
+    FROM variants v JOIN products p ON p.id = v.product_rowid
+    WHERE p.product_url IS NOT NULL
+'''
+SEED_SQL = '''
+    INSERT INTO price_history (series, observed_at, price_cents, available)
+    SELECT s.id, coalesce(CAST(strftime('%s', p.scraped_at, 'utc') AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER)),
+           CAST(round(v.price * 100) AS INTEGER), v.available
+    FROM variants v
+        JOIN products p ON p.id = v.product_rowid
+        JOIN price_series s ON s.product_url = p.product_url AND s.variant = coalesce(v.variant_id, v.size, '')
+    GROUP BY s.id
+'''
+
+# Price and availability changes since a time, newest first
+CHANGES_SQL = '''
+    SELECT h.series, s.product_url, s.variant, h.observed_at, h.price_cents, h.available,
+           h.price_cents - h.change_cents AS previous_cents, p.product_name, p.brand
+    FROM price_history h
+        JOIN price_series s ON s.id = h.series
+        LEFT JOIN products p ON p.product_url = s.product_url
+    WHERE h.observed_at >= ? AND h.change_cents IS NOT NULL {after}
+    ORDER BY h.observed_at DESC, h.series DESC
+    LIMIT ?
+'''
+
+# Per product: cheapest variant now, lowest price ever recorded
+LOWEST_SQL = '''
+    SELECT s.product_url, MIN(s.current_cents) AS current_cents, MIN(s.lowest_cents) AS lowest_cents,
+           MAX(s.lowest_at) AS lowest_at, MAX(s.changed_at) AS changed_at,
+           MAX(s.current_available) AS available, p.product_name, p.brand
+    FROM price_series s LEFT JOIN products p ON p.product_url = s.product_url
+    {where}
+    GROUP BY s.product_url
+    {having}
+    ORDER BY s.product_url
+    LIMIT ?
+'''
+
+# One series' rows, oldest first
+SERIES_HISTORY_SQL = '''
+    SELECT s.variant, h.observed_at, h.price_cents, h.available, h.change_cents
+    FROM price_series s JOIN price_history h ON h.series = s.id
+    WHERE s.product_url = ?
+    ORDER BY s.variant, h.observed_at
+'''
+
+
+def has_history_tables(connection):
+    return connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'price_history'"
+    ).fetchone() is not None
+
+
+def ensure_history_tables(connection):
+    """Create the history tables and triggers; True if they are new.
+
+    Needs the variants table (catalog.ensure_catalog_tables).  New tables
+    start with one observation per stored variant.
+    """
+    created = not has_history_tables(connection)
+    connection.executescript(HISTORY_SCHEMA)
+    if created:
+        with connection:
+            connection.execute(SERIES_SQL)
+            connection.execute(SEED_SQL)
+    return created
@@ -0,0 +1,218 @@
+# HTTP cache storage in one SQLite file per spider.
+#
+# Scrapy's FilesystemCacheStorage writes six files per response into a
+# hashed directory tree and never deletes anything.  SqliteCacheStorage
+# keeps one row per request fingerprint in HTTPCACHE_DIR/<spider>.sqlite3:
+#
+#   fingerprint   20-byte request fingerprint (primary key)
+#   url, method   the request
+#   status, response_url, headers
+#   body          the response body, zlib-compressed unless the server
+#                 already sent it compressed (codec says which)
+#   extra         pickled remaining Response.to_dict() fields, if any
+#   size          bytes the row takes, counted against the size cap
+#   stored_at     when the response was stored (for HTTPCACHE_EXPIRATION_SECS)
+#   accessed_at   last store or hit, for LRU eviction
+#
+# When the rows outgrow CARBON38_HTTPCACHE_MAX_BYTES the least recently used
+# are deleted until the cache is back under 90% of the cap.  Hits only
+# update accessed_at in memory; the times are written with the next commit.
+#
+# `scrapy cachemigrate` imports an existing filesystem cache.
+
+import logging
+import pickle
+import sqlite3
+import zlib
+from pathlib import Path
+from time import time
+
+from scrapy.utils.project import data_path
+from scrapy.utils.response import response_from_dict
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    fingerprint BLOB PRIMARY KEY,
+    url TEXT NOT NULL,
+    method TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    response_url TEXT NOT NULL,
+    headers BLOB NOT NULL,
+    body BLOB NOT NULL,
+    codec TEXT NOT NULL,
+    extra BLOB,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+'''
+
+INSERT_SQL = '''
+INSERT OR REPLACE INTO responses
+    (fingerprint, url, method, status, response_url, headers, body, codec, extra, size, stored_at, accessed_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Bodies sent with one of these are not worth compressing again
+COMPRESSED_ENCODINGS = (b'gzip', b'x-gzip', b'deflate', b'br', b'zstd')
+
+
+def cache_path(settings, spider_name):
+    return Path(data_path(settings['HTTPCACHE_DIR'], createdir=True), f'{spider_name}.sqlite3')
+
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def encode_body(body, headers, level=6):
+    """(stored body, codec) for a raw response body."""
+    encodings = [encoding.strip().lower() for encoding in headers.getlist('Content-Encoding')]
+    if any(encoding in COMPRESSED_ENCODINGS for encoding in encodings) or len(body) < 256:
+        return body, ''
+    return zlib.compress(body, level), 'zlib'
+
+
+def decode_body(body, codec):
+    if codec == 'zlib':
+        return zlib.decompress(body)
+    if codec:
+        raise ValueError(f'Unknown cache codec {codec!r}')
+    return body
+
+
+def entry_row(fingerprint, url, method, status, response_url, headers, body, extra, stored_at, level=6):
+    """Row for INSERT_SQL from raw response parts; headers is a Headers object."""
+    stored_body, codec = encode_body(body, headers, level)
+    raw_headers = headers_dict_to_raw(headers)
+    extra = pickle.dumps(extra, protocol=4) if extra else None
+    size = len(stored_body) + len(raw_headers) + len(url) + len(response_url) + len(extra or b'') + 64
+    return (fingerprint, url, method, status, response_url, raw_headers, stored_body, codec, extra,
+            size, stored_at, stored_at)
+
+
+def iter_responses(path):
+    """Yield (metadata, headers, body) for every response in a cache file.
+
+    metadata has the keys of the filesystem cache's pickled_meta; the body
+    is the raw body as received, still Content-Encoded.
+    """
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = connection.execute(
+            'SELECT url, method, status, response_url, stored_at, headers, body, codec '
+            'FROM responses ORDER BY fingerprint'
+        )
+        for url, method, status, response_url, stored_at, headers, body, codec in rows:
+            meta = {'url': url, 'method': method, 'status': status,
+                    'response_url': response_url, 'timestamp': stored_at}
+            yield meta, headers, decode_body(body, codec)
+    finally:
+        connection.close()
+
+
+class SqliteCacheStorage:
+    """HTTPCACHE_STORAGE keeping compressed responses in one SQLite file."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.max_bytes = settings.getint('CARBON38_HTTPCACHE_MAX_BYTES', 0)
+        self.level = settings.getint('CARBON38_HTTPCACHE_COMPRESSION_LEVEL', 6)
+        self.commit_every = settings.getint('CARBON38_HTTPCACHE_COMMIT_EVERY', 50)
+        self.connection = None
+        self.accessed = {}
+        self.pending = 0
+        self.total_bytes = 0
+        self.stats = None
+
+    def open_spider(self, spider):
+        self.path = cache_path(self.settings, spider.name)
+        self.connection = connect(self.path)
+        self.total_bytes = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        self.stats = spider.crawler.stats
+        logger.debug(f'Using SQLite cache storage in {self.path} ({self.total_bytes} bytes)')
+
+    def close_spider(self, spider):
+        self.commit()
+        self.stats.set_value('httpcache/bytes', self.total_bytes)
+        self.connection.close()
+
+    def retrieve_response(self, spider, request):
+        fingerprint = self._fingerprinter.fingerprint(request)
+        row = self.connection.execute(
+            'SELECT status, response_url, headers, body, codec, extra, stored_at '
+            'FROM responses WHERE fingerprint = ?', (fingerprint,)
+        ).fetchone()
+        if row is None:
+            return None  # not cached
+        status, url, raw_headers, body, codec, extra, stored_at = row
+        if 0 < self.expiration_secs < time() - stored_at:
+            return None  # expired
+        self.accessed[fingerprint] = time()
+        data = {
+            'url': url,
+            'status': status,
+            'headers': headers_raw_to_dict(raw_headers),
+            'body': decode_body(body, codec),
+        }
+        if extra:
+            data.update(pickle.loads(extra))  # noqa: S301
+        request.meta['cache_timestamp'] = stored_at
+        return response_from_dict(data)
+
+    def store_response(self, spider, request, response):
+        fingerprint = self._fingerprinter.fingerprint(request)
+        extra = {key: value for key, value in response.to_dict().items()
+                 if key not in {'url', 'status', 'headers', 'body'}}
+        row = entry_row(fingerprint, request.url, request.method, response.status, response.url,
+                        response.headers, response.body, extra, time(), self.level)
+        old = self.connection.execute('SELECT size FROM responses WHERE fingerprint = ?', (fingerprint,)).fetchone()
+        self.connection.execute(INSERT_SQL, row)
+        self.accessed.pop(fingerprint, None)
+        self.total_bytes += row[9] - (old[0] if old else 0)
+        self.pending += 1
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            self.evict()
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        if self.accessed:
+            self.connection.executemany('UPDATE responses SET accessed_at = ? WHERE fingerprint = ?',
+                                        [(accessed, fingerprint) for fingerprint, accessed in self.accessed.items()])
+            self.accessed.clear()
+        self.connection.commit()
+        self.pending = 0
+
+    def evict(self):
+        """Delete least recently used responses until 90% of the cap is left."""
+        # Pending hit times must count before choosing what to drop
+        self.commit()
+        target = self.max_bytes * 0.9
+        evicted = 0
+        while self.total_bytes > target:
+            rows = self.connection.execute(
+                'SELECT fingerprint, size FROM responses ORDER BY accessed_at LIMIT 100'
+            ).fetchall()
+            if not rows:
+                break
+            doomed = []
+            for fingerprint, size in rows:
+                doomed.append((fingerprint,))
+                self.total_bytes -= size
+                if self.total_bytes <= target:
+                    break
+            self.connection.executemany('DELETE FROM responses WHERE fingerprint = ?', doomed)
+            evicted += len(doomed)
+        self.connection.commit()
+        self.stats.inc_value('httpcache/evicted', evicted)
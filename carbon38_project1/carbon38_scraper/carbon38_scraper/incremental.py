@@ -0,0 +1,100 @@
+# Change signals for incremental crawls.
+#
+# A change signal is a cheap string that changes whenever a product does.
+# It is stored next to the product in products.db.  With CARBON38_INCREMENTAL
+# on, a product whose current signal equals the stored one is not requested.
+#
+#   json catalog mode   the product's updated_at from products.json
+#   html listing pages  a digest of the product card's embedded
+#                       data-product-data JSON (title, variants, prices,
+#                       availability), or of the card text without it
+#
+# The two kinds never compare equal, so switching catalog_mode re-fetches
+# each product once.
+#
+# Once a product is fetched and cleaned, its content hash tells whether
+# anything we store actually changed.  It covers every cleaned field except
+# the ones below, which differ on every run or are derived from elsewhere.
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from carbon38_scraper import shopify
+
+
+def digest(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+HASH_IGNORED = frozenset({'scraped_at', 'change_signal', 'content_hash', 'change', 'images'})
+
+# Change detection bookkeeping, left out of the exported products
+INTERNAL_FIELDS = frozenset({'change_signal', 'content_hash', 'change'})
+
+# Changes that leave the stored product as it is; 'touched' only has a new
+# change signal
+UNCHANGED = frozenset({'unchanged', 'touched'})
+
+
+def content_hash(adapter):
+    """Stable digest of a cleaned item's content."""
+    content = {key: value for key, value in adapter.items() if key not in HASH_IGNORED}
+    return digest(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str))
+
+
+def catalog_signal(product):
+    """Change signal of a products.json entry."""
+    updated_at = product.get('updated_at')
+    return f'updated_at:{updated_at}' if updated_at else None
+
+
+def listing_signals(response):
+    """Change signal of every product card on a listing page, by handle."""
+    signals = {}
+    for card in response.css('.ProductItem[data-handle]'):
+        data = card.css('script[data-product-data]::text').get()
+        if not data:
+            data = ' '.join(' '.join(card.css('::text').getall()).split())
+        signals[card.attrib['data-handle']] = f'card:{digest(data)}'
+    return signals
+
+
+def load_signals(path):
+    """Stored change signals by product handle; empty if there is no database yet."""
+    if not path or not os.path.exists(path):
+        return {}
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = connection.execute(
+            'SELECT product_url, change_signal FROM products WHERE change_signal IS NOT NULL'
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # Database from before change signals were stored
+        return {}
+    finally:
+        connection.close()
+    signals = {}
+    for url, signal in rows:
+        handle = shopify.product_handle(url or '')
+        if handle:
+            signals[handle] = signal
+    return signals
+
+
+def load_hashes(path):
+    """Stored (content_hash, change_signal) by product URL; empty without a database."""
+    if not path or not os.path.exists(path):
+        return {}
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = connection.execute(
+            'SELECT product_url, content_hash, change_signal FROM products WHERE product_url IS NOT NULL'
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # Database from before content hashes were stored
+        return {}
+    finally:
+        connection.close()
+    return {url: (content, signal) for url, content, signal in rows}
@@ -3,6 +3,9 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
+import sys
+from dataclasses import dataclass, fields
+
 import scrapy
 
 
@@ -22,4 +25,81 @@ class ProductItem(scrapy.Item):
     product_id = scrapy.Field()
     image_urls = scrapy.Field()
     scraped_at = scrapy.Field()
-    
+    change_signal = scrapy.Field()
+    # Digest of the cleaned fields (see incremental.content_hash) and, with
+    # ChangeDetectionPipeline, 'new', 'changed', 'unchanged' or 'touched'
+    content_hash = scrapy.Field()
+    change = scrapy.Field()
+    # Filled by ProductImagesPipeline: url, path, checksum, status per image
+    images = scrapy.Field()
+    # One dict per variant: variant_id, sku, size, colour, price, available
+    # (see shopify.variants_from_product)
+    variants = scrapy.Field()
+
+
+# Interned on assignment: a few hundred distinct values across the catalog
+INTERNED_FIELDS = frozenset({'brand', 'colour', 'primary_image_url'})
+INTERNED_LIST_FIELDS = frozenset({'sizes', 'breadcrumbs', 'image_urls'})
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+@dataclass(slots=True)
+class CompactProductItem:
+    """ProductItem with fixed slots instead of a dict (CARBON38_COMPACT_ITEMS).
+
+    brand, colour, size labels and breadcrumbs are interned, so every item
+    shares one string object per distinct value; image URLs are interned
+    too, which makes primary_image_url the same object as the first of
+    image_urls.  Supports item['field'] like ProductItem; pipelines and
+    exporters see it through ItemAdapter like any dataclass item.
+    """
+
+    breadcrumbs: list = None
+    primary_image_url: str = None
+    brand: str = None
+    product_name: str = None
+    price: object = None
+    reviews: object = None
+    colour: str = None
+    sizes: list = None
+    description: str = None
+    sku: str = None
+    product_url: str = None
+    product_id: str = None
+    image_urls: list = None
+    scraped_at: str = None
+    change_signal: str = None
+    content_hash: str = None
+    change: str = None
+    images: list = None
+    variants: list = None
+
+    def __setattr__(self, name, value):
+        if name in INTERNED_FIELDS:
+            value = _intern(value)
+        elif name in INTERNED_LIST_FIELDS and type(value) is list:
+            value = [_intern(element) for element in value]
+        object.__setattr__(self, name, value)
+
+    def __getitem__(self, name):
+        if name not in COMPACT_FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        if name not in COMPACT_FIELDS:
+            raise KeyError(f'CompactProductItem does not support field: {name}')
+        setattr(self, name, value)
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None) if name in COMPACT_FIELDS else None
+        return default if value is None else value
+
+    def keys(self):
+        return COMPACT_FIELDS
+
+
+COMPACT_FIELDS = tuple(field.name for field in fields(CompactProductItem))
@@ -0,0 +1,166 @@
+# Stage timings kept as histograms in the Scrapy stats, and a Prometheus
+# endpoint for watching them during a crawl.
+#
+# A histogram for stage S lives in the stats as
+#
+#   timing/S/count       observations
+#   timing/S/sum         total seconds
+#   timing/S/le/<bound>  observations that fell in the bucket ending at bound
+#
+# Buckets are stored per bucket and made cumulative when rendered, so an
+# observation costs three dict updates.  Stages: download, callback/<name>,
+# extract/<method> and pipeline/<class>.
+
+import functools
+import inspect
+import logging
+import re
+import time
+from bisect import bisect_left
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.pipelines import ItemPipelineManager
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import defer
+from twisted.web import resource, server
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKET_KEYS = tuple(f'{bound:g}' for bound in BUCKETS) + ('+Inf',)
+
+
+def observe(stats, stage, seconds):
+    """Add one timing to the stage's histogram."""
+    stats.inc_value(f'timing/{stage}/count')
+    stats.inc_value(f'timing/{stage}/sum', seconds, start=0.0)
+    stats.inc_value(f'timing/{stage}/le/{BUCKET_KEYS[bisect_left(BUCKETS, seconds)]}')
+
+
+def timed(crawler, stage, func):
+    """Wrap func so every call is observed under stage.
+
+    Coroutine functions and methods returning a Deferred are timed until
+    they finish, not until they return.
+    """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def timed_coroutine(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observe(crawler.stats, stage, time.perf_counter() - start)
+        return timed_coroutine
+
+    @functools.wraps(func)
+    def timed_call(*args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        if isinstance(result, defer.Deferred):
+            def done(outcome):
+                observe(crawler.stats, stage, time.perf_counter() - start)
+                return outcome
+            return result.addBoth(done)
+        observe(crawler.stats, stage, time.perf_counter() - start)
+        return result
+    return timed_call
+
+
+def instrument_extractors(spider, crawler):
+    """Time every extract_* method of the spider."""
+    for name in dir(spider):
+        if name.startswith('extract_'):
+            method = getattr(spider, name)
+            if callable(method):
+                setattr(spider, name, timed(crawler, f'extract/{name}', method))
+
+
+class TimedItemPipelineManager(ItemPipelineManager):
+    """ITEM_PROCESSOR that times each pipeline's process_item."""
+
+    def _add_middleware(self, pipe):
+        if hasattr(pipe, 'process_item') and self.crawler is not None and \
+                self.crawler.settings.getbool('CARBON38_TIMING', True):
+            pipe.process_item = timed(self.crawler, f'pipeline/{type(pipe).__name__}', pipe.process_item)
+        super()._add_middleware(pipe)
+
+
+def _metric_name(key):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', key).strip('_')
+
+
+def render_prometheus(stats, prefix='carbon38'):
+    """Prometheus text exposition of the timing histograms and numeric stats."""
+    histograms = {}
+    lines = []
+    for key, value in sorted(stats.items()):
+        if key.startswith('timing/'):
+            stage, _, field = key[len('timing/'):].rpartition('/')
+            if stage.endswith('/le'):
+                stage = stage[:-len('/le')]
+                histograms.setdefault(stage, {}).setdefault('buckets', {})[field] = value
+            else:
+                histograms.setdefault(stage, {})[field] = value
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f'{prefix}_{_metric_name(key)} {value}')
+
+    out = [f'# TYPE {prefix}_stage_seconds histogram']
+    for stage, histogram in sorted(histograms.items()):
+        label = stage.replace('\\', '\\\\').replace('"', '\\"')
+        cumulative = 0
+        for bound in BUCKET_KEYS:
+            cumulative += histogram.get('buckets', {}).get(bound, 0)
+            out.append(f'{prefix}_stage_seconds_bucket{{stage="{label}",le="{bound}"}} {cumulative}')
+        out.append(f'{prefix}_stage_seconds_sum{{stage="{label}"}} {histogram.get("sum", 0.0)}')
+        out.append(f'{prefix}_stage_seconds_count{{stage="{label}"}} {histogram.get("count", 0)}')
+    return '\n'.join(out + lines) + '\n'
+
+
+class _MetricsResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, crawler):
+        super().__init__()
+        self.crawler = crawler
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return render_prometheus(self.crawler.stats.get_stats()).encode('utf-8')
+
+
+class MetricsServer:
+    """Extension serving the crawl stats at http://<host>:<port>/metrics.
+
+    Listens on the reactor, so reading the stats needs no locking.  Enabled
+    by setting CARBON38_METRICS_PORT.
+    """
+
+    def __init__(self, crawler, port, host='127.0.0.1'):
+        self.crawler = crawler
+        self.port = port
+        self.host = host
+        self.listener = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        port = crawler.settings.getint('CARBON38_METRICS_PORT', 0)
+        if not port:
+            raise NotConfigured
+        extension = cls(crawler, port, crawler.settings.get('CARBON38_METRICS_HOST', '127.0.0.1'))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        from twisted.internet import reactor
+
+        root = resource.Resource()
+        root.putChild(b'metrics', _MetricsResource(self.crawler))
+        self.listener = reactor.listenTCP(self.port, server.Site(root), interface=self.host)
+        logger.info(f'Serving metrics on http://{self.host}:{self.port}/metrics')
+
+    async def spider_closed(self, spider):
+        if self.listener is not None:
+            await maybe_deferred_to_future(self.listener.stopListening())
@@ -2,50 +2,74 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
+#
+# Both middlewares record stage timings in the crawl stats (see metrics.py);
+# the downloader middleware also paces downloads (see throttle.py).
+# BodyTrimMiddleware cuts unused markup out of HTML pages (see trimming.py).
+
+import logging
+import time
 
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse
+
+from carbon38_scraper import metrics, throttle, trimming
 
-# useful for handling different item types with a single interface
-from itemadapter import ItemAdapter
+logger = logging.getLogger(__name__)
 
 
 class Carbon38ScraperSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    """Times spider callbacks as callback/<name>.
+
+    Callbacks are generators, so the time is what the spider spends
+    producing its output, summed over the whole iteration.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        if not crawler.settings.getbool('CARBON38_TIMING', True):
+            raise NotConfigured
+        s = cls(crawler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
-    def process_spider_input(self, response, spider):
-        # Called for each response that goes through the spider
-        # middleware and into the spider.
-
-        # Should return None or raise an exception.
-        return None
+    def stage(self, response):
+        callback = response.request.callback if response.request is not None else None
+        return f'callback/{getattr(callback, "__name__", "parse")}'
 
     def process_spider_output(self, response, result, spider):
-        # Called with the results returned from the Spider, after
-        # it has processed the response.
-
-        # Must return an iterable of Request, or item objects.
-        for i in result:
-            yield i
-
-    def process_spider_exception(self, response, exception, spider):
-        # Called when a spider or process_spider_input() method
-        # (from other spider middleware) raises an exception.
-
-        # Should return either None or an iterable of Request or item objects.
-        pass
+        elapsed = 0.0
+        iterator = iter(result)
+        while True:
+            start = time.perf_counter()
+            try:
+                output = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield output
+        metrics.observe(self.crawler.stats, self.stage(response), elapsed)
+
+    async def process_spider_output_async(self, response, result, spider):
+        elapsed = 0.0
+        iterator = result.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                output = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield output
+        metrics.observe(self.crawler.stats, self.stage(response), elapsed)
 
     async def process_start(self, start):
-        # Called with an async iterator over the spider start() method or the
-        # maching method of an earlier spider middleware.
         async for item_or_request in start:
             yield item_or_request
 
@@ -54,47 +78,153 @@ class Carbon38ScraperSpiderMiddleware:
 
 
 class Carbon38ScraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """Times downloads and adapts each slot's concurrency and delay.
+
+    download is the network latency Scrapy measures for each response
+    (absent for cache hits), downloader the time from this middleware to
+    the response coming back, including slot delays and the HTTP cache.
+
+    With CARBON38_ADAPTIVE on, every slot is driven by a
+    throttle.SlotController fed with latencies, 429/503 responses,
+    Retry-After headers and download errors.  Decisions are counted under
+    adaptive/decisions/ and each slot's current pace is kept in
+    adaptive/<slot>/ in the stats.  Runs before RetryMiddleware so it sees
+    the responses that get retried.
+    """
+
+    def __init__(self, crawler, timing=True, adaptive=False):
+        self.crawler = crawler
+        self.timing = timing
+        self.adaptive = adaptive
+        self.controllers = {}
+        settings = crawler.settings
+        self.controller_settings = dict(
+            max_concurrency=settings.getint('CARBON38_ADAPTIVE_MAX_CONCURRENCY', 16),
+            min_delay=settings.getfloat('CARBON38_ADAPTIVE_MIN_DELAY', 0.0),
+            max_delay=settings.getfloat('CARBON38_ADAPTIVE_MAX_DELAY', 60.0),
+            target_latency=settings.getfloat('CARBON38_ADAPTIVE_TARGET_LATENCY', 1.0),
+            target_rps=settings.getfloat('CARBON38_ADAPTIVE_TARGET_RPS', 0.0),
+            error_budget=settings.getfloat('CARBON38_ADAPTIVE_ERROR_BUDGET', 0.02),
+            window_size=settings.getint('CARBON38_ADAPTIVE_WINDOW', 20),
+        )
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        timing = crawler.settings.getbool('CARBON38_TIMING', True)
+        adaptive = crawler.settings.getbool('CARBON38_ADAPTIVE', False)
+        if not timing and not adaptive:
+            raise NotConfigured
+        if adaptive and crawler.settings.getbool('AUTOTHROTTLE_ENABLED'):
+            logger.warning('CARBON38_ADAPTIVE and AUTOTHROTTLE_ENABLED both set download delays; '
+                           'disable one of them')
+        s = cls(crawler, timing, adaptive)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
+        if self.timing:
+            request.meta.setdefault('carbon38_sent', time.perf_counter())
         return None
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        stats = self.crawler.stats
+        sent = request.meta.pop('carbon38_sent', None)
+        if sent is not None:
+            metrics.observe(stats, 'downloader', time.perf_counter() - sent)
+        if 'cached' in response.flags:
+            return response
+        latency = request.meta.get('download_latency')
+        if self.timing and latency is not None:
+            metrics.observe(stats, 'download', latency)
+        if self.adaptive:
+            error = response.status in throttle.ERROR_STATUSES
+            retry_after = throttle.retry_after_seconds(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                stats.inc_value('adaptive/retry_after')
+            self.record(request, None if error else latency, error, retry_after)
         return response
 
     def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+        sent = request.meta.pop('carbon38_sent', None)
+        if sent is not None:
+            metrics.observe(self.crawler.stats, 'downloader/failed', time.perf_counter() - sent)
+        if self.adaptive and not isinstance(exception, IgnoreRequest):
+            self.record(request, None, True, None)
+        return None
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+    def record(self, request, latency, error, retry_after):
+        downloader = self.crawler.engine.downloader
+        key = downloader.get_slot_key(request)
+        slot = downloader.slots.get(key)
+        controller = self.controllers.get(key)
+        if controller is None:
+            if slot is None:
+                return
+            controller = self.controllers[key] = throttle.SlotController(
+                slot.concurrency, slot.delay, **self.controller_settings)
+        stats = self.crawler.stats
+        if error:
+            stats.inc_value(f'adaptive/{key}/errors')
+        decision = controller.record(latency, error, retry_after)
+        if decision is not None:
+            stats.inc_value(f'adaptive/decisions/{decision}')
+            stats.set_value(f'adaptive/{key}/rps', round(controller.rps, 3))
+            if decision != 'hold':
+                logger.debug(f'Slot {key}: {decision} to concurrency {controller.concurrency}, '
+                             f'delay {controller.delay:.2f}s')
+        stats.set_value(f'adaptive/{key}/concurrency', controller.concurrency)
+        stats.set_value(f'adaptive/{key}/delay', round(controller.delay, 3))
+        # Slots are dropped when idle and recreated with the default pace
+        if slot is not None:
+            controller.apply(slot)
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class BodyTrimMiddleware:
+    """Trims HTML bodies to what the spider reads, before caching and parsing.
+
+    Runs next to the downloader (950, after HttpCacheMiddleware at 900 on
+    the way out), so the cache stores the trimmed page.  The body is decoded
+    first and stored without Content-Encoding; set HTTPCACHE_GZIP or use the
+    SQLite cache storage to keep cached pages compressed.  Pages cached
+    before trimming was enabled are trimmed when they are read back.
+
+    The original size goes into the X-Carbon38-Trimmed header, which also
+    keeps a page from being trimmed twice; trim/ in the stats has the bytes
+    before and after over all responses.
+    """
+
+    header = 'X-Carbon38-Trimmed'
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CARBON38_TRIM_BODIES'):
+            raise NotConfigured
+        return cls(crawler.stats)
+
+    def process_response(self, request, response, spider):
+        if not isinstance(response, HtmlResponse) or self.header in response.headers:
+            return response
+        headers = response.headers.copy()
+        try:
+            body = trimming.decode_body(response.body, headers)
+        except (OSError, ValueError, ImportError) as e:
+            logger.warning(f'Not trimming {response.url}: cannot decode body ({e})')
+            return response
+        if not body:
+            return response
+        trimmed = trimming.trim_html(body)
+        headers[self.header] = str(len(body))
+        headers.pop('Content-Length', None)
+        saved = len(body) - len(trimmed)
+        self.stats.inc_value('trim/responses')
+        self.stats.inc_value('trim/bytes_before', len(body))
+        self.stats.inc_value('trim/bytes_after', len(trimmed))
+        self.stats.max_value('trim/max_saved', saved)
+        logger.debug(f'Trimmed {response.url} from {len(body)} to {len(trimmed)} bytes ({saved / len(body):.0%} saved)')
+        return response.replace(headers=headers, body=trimmed)
@@ -0,0 +1,110 @@
+# Process pool for product page parsing.
+#
+# lxml tree building and the extract_* methods are CPU bound and hold the
+# GIL, so on the reactor thread they cap the crawl at one core.  With
+# CARBON38_PARSE_WORKERS > 0 the spider hands product response bodies to a
+# pool of worker processes, each running its own Carbon38Spider, and gets
+# plain item dicts back.
+#
+# Backpressure: at most CARBON38_PARSE_MAX_PENDING bodies are in the pool at
+# once.  Responses waiting for a slot stay in Scrapy's scraper slot, and once
+# SCRAPER_SLOT_MAX_ACTIVE_SIZE is exceeded the engine stops feeding the
+# downloader, so downloads cannot outrun the workers.
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy.http import HtmlResponse
+from scrapy.utils.reactor import is_asyncio_reactor_installed
+
+_worker_spider = None
+
+
+class _CounterStats:
+    """Collects inc_value() calls in a worker so they can be sent back."""
+
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, count=1, start=0):
+        self.values[key] = self.values.get(key, start) + count
+
+    def pop(self):
+        values, self.values = self.values, {}
+        return values
+
+
+def _init_worker(selector_warmup, parser_backend):
+    global _worker_spider
+    from carbon38_scraper.extraction import SelectorEngine
+    from carbon38_scraper.spiders.carbon38 import Carbon38Spider
+
+    _worker_spider = Carbon38Spider()
+    _worker_spider.selector_engine = SelectorEngine(_CounterStats(), selector_warmup)
+    _worker_spider.parser_backend = parser_backend
+
+
+def parse_product_body(url, body, encoding):
+    """Run parse_product in a worker; returns (item dicts, stats increments)."""
+    response = HtmlResponse(url=url, body=body, encoding=encoding)
+    items = [dict(item) for item in _worker_spider.parse_product(response)]
+    return items, _worker_spider.selector_engine.stats.pop()
+
+
+class ParsePool:
+    """Runs parse_product in worker processes with bounded in-flight work."""
+
+    def __init__(self, workers, max_pending=None, stats=None, selector_warmup=20, parser_backend='lxml'):
+        if not is_asyncio_reactor_installed():
+            raise RuntimeError('CARBON38_PARSE_WORKERS needs the asyncio Twisted reactor')
+        self.workers = workers
+        self.max_pending = max_pending or workers * 2
+        self.stats = stats
+        # spawn: forking a process that runs the reactor is not safe
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(selector_warmup, parser_backend),
+        )
+        self._slots = None
+        self.pending = 0
+
+    @classmethod
+    def from_settings(cls, settings, stats=None):
+        workers = settings.getint('CARBON38_PARSE_WORKERS', 0)
+        if workers <= 0:
+            return None
+        return cls(
+            workers,
+            settings.getint('CARBON38_PARSE_MAX_PENDING', 0) or None,
+            stats,
+            settings.getint('CARBON38_SELECTOR_WARMUP', 20),
+            settings.get('CARBON38_PARSER_BACKEND', 'lxml'),
+        )
+
+    async def parse(self, response):
+        """Parse one product response in the pool and return its item dicts."""
+        if self._slots is None:
+            # Created lazily so it binds to the reactor's running loop
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            self.pending += 1
+            if self.stats is not None:
+                self.stats.max_value('parse_pool/max_pending', self.pending)
+            try:
+                loop = asyncio.get_running_loop()
+                items, increments = await loop.run_in_executor(
+                    self.executor, parse_product_body, response.url, response.body, response.encoding,
+                )
+            finally:
+                self.pending -= 1
+        if self.stats is not None:
+            self.stats.inc_value('parse_pool/parsed')
+            for key, count in increments.items():
+                self.stats.inc_value(key, count)
+        return items
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
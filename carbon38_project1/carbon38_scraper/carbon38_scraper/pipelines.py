@@ -1,9 +1,32 @@
 import csv
+import gzip
+import hashlib
 import json
+import re
 import sqlite3
 import os
 from datetime import datetime
+import scrapy
 from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.exporters import JsonItemExporter, JsonLinesItemExporter
+from scrapy.pipelines.files import FilesPipeline, FSFilesStore
+from scrapy.http.request import NO_CALLBACK
+from scrapy.utils.defer import deferred_from_coro
+
+from carbon38_scraper import catalog, fileio, frontier, history, incremental, query, shopify
+from carbon38_scraper.dbwriter import BatchWriter, WriterStopped
+from carbon38_scraper.items import COMPACT_FIELDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Product fields in declaration order, without change detection bookkeeping
+EXPORT_FIELDS = [name for name in COMPACT_FIELDS if name not in incremental.INTERNAL_FIELDS]
 
 class ProductCleanerPipeline:
     def process_item(self, item, spider):
@@ -45,6 +68,9 @@ class ProductCleanerPipeline:
                     adapter[field] = [str(adapter[field])]
             else:
                 adapter[field] = []
+        # Variants are cleaned by shopify.variants_from_product; drop anything else
+        variants = adapter.get('variants')
+        adapter['variants'] = [v for v in variants if isinstance(v, dict)] if isinstance(variants, list) else []
         
          # Clean text fields
         text_fields = ['product_name', 'brand', 'description', 'colour', 'sku', 'product_id']
@@ -72,50 +98,279 @@ class ProductCleanerPipeline:
         
         # Add timestamp
         adapter['scraped_at'] = datetime.now().isoformat()
+        adapter['content_hash'] = incremental.content_hash(adapter)
         
         return item
+
+
+class ChangeDetectionPipeline:
+    """Compare each item's content hash with the one in CARBON38_DATABASE.
+
+    Sets item['change'] to 'new', 'changed', 'unchanged', or 'touched' (same
+    content, new change signal).  With CARBON38_SKIP_UNCHANGED the image
+    and database pipelines leave unchanged and touched items alone, apart
+    from storing a touched item's change signal; the exports always get
+    every item, so each crawl's files hold the full catalog.
+
+    With CARBON38_DELTA_DIR set, new and changed products are also written
+    to <dir>/delta-<time>.jsonl as {"op": ..., "product_url": ...,
+    "content_hash": ..., "item": {...}} lines.  After a complete crawl
+    (finished, not incremental, no item budget or seen file skips) the
+    stored products that were not scraped follow as "removed".  Their rows
+    stay in the database, so each complete crawl reports them again.
+    """
+
+    def __init__(self, database, skip_unchanged=False, delta_dir=None):
+        self.database = database
+        self.skip_unchanged = skip_unchanged
+        self.delta_dir = delta_dir
+        self.stored = {}
+        self.scraped = set()
+        self.delta_path = None
+        self.delta_file = None
+        self.worker_tag = ''
+        self.stats = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(
+            settings.get('CARBON38_DATABASE', 'database/products.db'),
+            settings.getbool('CARBON38_SKIP_UNCHANGED', False),
+            settings.get('CARBON38_DELTA_DIR') or None,
+        )
+        if not pipeline.skip_unchanged and not pipeline.delta_dir:
+            raise NotConfigured('Neither CARBON38_SKIP_UNCHANGED nor CARBON38_DELTA_DIR is set')
+        pipeline.worker_tag = frontier.worker_tag(settings)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.stats = spider.crawler.stats
+        self.stored = incremental.load_hashes(self.database)
+        if self.delta_dir:
+            os.makedirs(self.delta_dir, exist_ok=True)
+            name = f"delta-{datetime.now().strftime('%Y%m%d-%H%M%S')}{self.worker_tag}.jsonl"
+            self.delta_path = os.path.join(self.delta_dir, name)
+            self.delta_file = open(self.delta_path, 'w', encoding='utf-8', buffering=1024 * 1024)
+        spider.logger.info(f'Change detection against {len(self.stored)} stored products')
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        url = adapter.get('product_url')
+        self.scraped.add(url)
+        stored = self.stored.get(url)
+        if stored is None:
+            change = 'new'
+        elif stored[0] != adapter.get('content_hash'):
+            change = 'changed'
+        elif adapter.get('change_signal') in (None, stored[1]):
+            change = 'unchanged'
+        else:
+            change = 'touched'
+        self.stats.inc_value(f'changes/{change}')
+        if change not in incremental.UNCHANGED or self.skip_unchanged:
+            adapter['change'] = change
+        if self.delta_file and change not in incremental.UNCHANGED:
+            self.write_delta(change, url, adapter.get('content_hash'), adapter.asdict())
+        return item
+
+    def write_delta(self, op, url, content_hash, item=None):
+        if item is not None:
+            item.pop('change', None)
+        self.delta_file.write(json.dumps({'op': op, 'product_url': url, 'content_hash': content_hash,
+                                          'item': item}, ensure_ascii=False, default=str) + '\n')
+
+    def spider_closed(self, spider, reason):
+        """Add the removed products to the delta feed once the crawl is over."""
+        if not self.delta_file:
+            return
+        complete = (reason == 'finished' and not getattr(spider, 'incremental', False)
+                    and not getattr(spider, 'budget_spent', False)
+                    and not self.stats.get_value('seen/loaded') and not self.worker_tag)
+        if complete:
+            for url, (content_hash, _) in self.stored.items():
+                if url not in self.scraped:
+                    self.write_delta('removed', url, content_hash)
+                    self.stats.inc_value('changes/removed')
+        else:
+            spider.logger.info('Partial crawl, removed products are not added to the delta feed')
+        self.delta_file.close()
+        spider.logger.info(f'Delta feed written to {self.delta_path}')
+
+
+class ProductImagesPipeline(FilesPipeline):
+    """Download product images once, into content-addressed files.
+
+    image_urls are reduced to their CDN asset and requested at
+    CARBON38_IMAGE_WIDTH, so the size variants of one image are a single
+    download; Scrapy's media pipeline already downloads each URL once per
+    crawl.  Files are stored as full/<sha256[:2]>/<sha256>.<ext>, so the
+    same picture under two URLs is written once.  index.json in the store
+    maps each URL to its file, which lets later crawls skip assets they
+    already have.  Downloads use the 'images' download slot
+    (see DOWNLOAD_SLOTS) so they do not share the product pages' delay.
+    """
+
+    FILES_URLS_FIELD = 'image_urls'
+    FILES_RESULT_FIELD = 'images'
+    DOWNLOAD_SLOT = 'images'
+
+    def __init__(self, store_uri, download_func=None, *, crawler, width=None):
+        super().__init__(store_uri, download_func, crawler=crawler)
+        self.width = width
+        self.index = {}
+        self.index_path = None
+        if isinstance(self.store, FSFilesStore):
+            self.index_path = os.path.join(self.store.basedir, 'index.json')
+            if os.path.exists(self.index_path):
+                with open(self.index_path, encoding='utf-8') as f:
+                    self.index = json.load(f)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        cls._update_stores(settings)
+        return cls(settings.get('CARBON38_IMAGES_STORE'), crawler=crawler,
+                   width=settings.getint('CARBON38_IMAGE_WIDTH', 1200) or None)
+
+    def get_media_requests(self, item, info):
+        if ItemAdapter(item).get('change') in incremental.UNCHANGED:
+            # Stored by the crawl that saw this content
+            return []
+        requests = []
+        seen = set()
+        for src in ItemAdapter(item).get(self.files_urls_field) or []:
+            url = shopify.sized_image_url(shopify.image_asset_url(src), self.width)
+            if url and url not in seen:
+                seen.add(url)
+                # The file store already keeps the image; the HTTP cache would be a second copy
+                requests.append(scrapy.Request(url, callback=NO_CALLBACK,
+                                               meta={'download_slot': self.DOWNLOAD_SLOT, 'dont_cache': True}))
+        return requests
+
+    def file_path(self, request, response=None, info=None, *, item=None):
+        if response is None:
+            # Before downloading: where this URL was stored by an earlier crawl
+            known = self.index.get(request.url)
+            return known or super().file_path(request, info=info, item=item)
+        digest = hashlib.sha256(response.body).hexdigest()
+        extension = os.path.splitext(super().file_path(request, info=info, item=item))[1]
+        return f'full/{digest[:2]}/{digest}{extension}'
+
+    def file_downloaded(self, response, request, info, *, item=None):
+        path = self.file_path(request, response=response, info=info, item=item)
+        self.index[request.url] = path
+        if self.index_path and os.path.exists(os.path.join(self.store.basedir, path)):
+            # Same bytes as an image stored under another URL
+            self.crawler.stats.inc_value('images/duplicate_content')
+            return hashlib.md5(response.body).hexdigest()
+        return super().file_downloaded(response, request, info, item=item)
+
+    def close_spider(self, spider):
+        if self.index_path:
+            tmp_path = f'{self.index_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f)
+            os.replace(tmp_path, self.index_path)
+
+
 class CSVExportPipeline:
     #Export items to CSV file.
+    #
+    # With rotation on (CARBON38_CSV_ROTATE_ROWS / CARBON38_CSV_ROTATE_BYTES)
+    # items go to numbered shards data/products-00001.csv, -00002.csv, ...
+    # each with its own header.  The byte limit counts uncompressed CSV.
     
-    def __init__(self):
+    def __init__(self, compression=None, rotate_rows=0, rotate_bytes=0,
+                 buffer_size=1024 * 1024, flush_every=100):
+        if compression not in fileio.SUFFIXES:
+            raise ValueError(f'Unknown CARBON38_CSV_COMPRESSION {compression!r}')
+        self.compression = compression
+        self.rotate_rows = rotate_rows
+        self.rotate_bytes = rotate_bytes
+        self.buffer_size = buffer_size
+        self.flush_every = flush_every
         self.file = None
         self.writer = None
         self.items_count = 0
+        self.shard = 0
+        self.shard_rows = 0
+        self.shard_bytes = 0
+        self.paths = []
+        # '-w<N>' when several frontier workers share data/
+        self.worker_tag = ''
         self.fieldnames = [
             'product_name', 'brand', 'price', 'sku', 'product_id',
             'description', 'reviews', 'colour', 'sizes', 'breadcrumbs',
             'primary_image_url', 'image_urls', 'product_url', 'scraped_at'
         ]
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(
+            settings.get('CARBON38_CSV_COMPRESSION') or None,
+            settings.getint('CARBON38_CSV_ROTATE_ROWS', 0),
+            settings.getint('CARBON38_CSV_ROTATE_BYTES', 0),
+            settings.getint('CARBON38_CSV_BUFFER_SIZE', 1024 * 1024),
+            settings.getint('CARBON38_CSV_FLUSH_ITEMS', 100),
+        )
+        pipeline.worker_tag = frontier.worker_tag(settings)
+        return pipeline
+
+    @property
+    def rotating(self):
+        return bool(self.rotate_rows or self.rotate_bytes)
+
     def open_spider(self, spider):
         os.makedirs('data', exist_ok=True)
-        self.file = open('data/products.csv', 'w', newline='', encoding='utf-8')
-        self.writer = csv.DictWriter(self.file,fieldnames=self.fieldnames)
-        self.writer.writeheader()
+        self.open_shard()
         spider.logger.info("CSV export pipeline opened")
+
+    def open_shard(self):
+        """Start the next output file and write its header."""
+        if self.file:
+            self.file.close()
+        self.shard += 1
+        name = f'products{self.worker_tag}-{self.shard:05d}.csv' if self.rotating else f'products{self.worker_tag}.csv'
+        path = os.path.join('data', name + fileio.SUFFIXES[self.compression])
+        self.file = fileio.open_text(path, self.compression, self.buffer_size)
+        self.writer = csv.writer(self.file)
+        self.shard_bytes = self.writer.writerow(self.fieldnames)
+        self.shard_rows = 0
+        self.paths.append(path)
+
     def close_spider(self, spider):
         if self.file:
             self.file.close()
-        spider.logger.info(f'Exported {self.items_count} items to CSV')
+        spider.logger.info(f'Exported {self.items_count} items to CSV in {len(self.paths)} file(s)')
     
     def process_item(self, item, spider):
         try:
             adapter = ItemAdapter(item)
             
             # Convert lists to pipe-separated strings for CSV
-            row = {}
+            row = []
             for key in self.fieldnames:
                 value = adapter.get(key)
                 if isinstance(value, list):
-                    row[key] = '|'.join(str(v) for v in value if v)
+                    row.append('|'.join(str(v) for v in value if v))
                 elif value is not None:
-                    row[key] = str(value)
+                    row.append(str(value))
                 else:
-                    row[key] = ''
-            
-            self.writer.writerow(row)
+                    row.append('')
+
+            if self.rotating and self.shard_rows and (
+                    (self.rotate_rows and self.shard_rows >= self.rotate_rows) or
+                    (self.rotate_bytes and self.shard_bytes >= self.rotate_bytes)):
+                self.open_shard()
+            self.shard_bytes += self.writer.writerow(row)
+            self.shard_rows += 1
             self.items_count += 1
             
-            if self.items_count % 10 == 0:
+            if self.items_count % self.flush_every == 0:
+                self.file.flush()
                 spider.logger.info(f"Exported {self.items_count} items to CSV")
                 
         except Exception as e:
@@ -123,58 +378,230 @@ class CSVExportPipeline:
             
         return item   
 class JSONExportPipeline:
-    def __init__(self):
+    """Stream items to data/products.json as they are scraped.
+
+    'json' writes the same indented array as before, one item at a time;
+    'jsonlines' writes one object per line to data/products.jsonl, which
+    stays readable if the crawl dies.  With compression 'gzip' the file
+    gets a .gz suffix.  Only the write buffer is held in memory.
+    """
+
+    EXPORTERS = {
+        'json': ('data/products.json', JsonItemExporter),
+        'jsonlines': ('data/products.jsonl', JsonLinesItemExporter),
+    }
+
+    def __init__(self, format='json', compression=None, flush_every=100):
+        if format not in self.EXPORTERS:
+            raise ValueError(f'Unknown CARBON38_JSON_FORMAT {format!r}')
+        if compression not in (None, 'gzip'):
+            raise ValueError(f'Unknown CARBON38_JSON_COMPRESSION {compression!r}')
+        self.format = format
+        self.compression = compression
+        self.flush_every = flush_every
+        self.path = self.EXPORTERS[format][0] + ('.gz' if compression else '')
         self.file = None
-        self.items = [] 
+        self.exporter = None
+        self.items_count = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(
+            settings.get('CARBON38_JSON_FORMAT', 'json'),
+            settings.get('CARBON38_JSON_COMPRESSION') or None,
+            settings.getint('CARBON38_JSON_FLUSH_ITEMS', 100),
+        )
+        tag = frontier.worker_tag(settings)
+        if tag:
+            base, ext = os.path.splitext(pipeline.EXPORTERS[pipeline.format][0])
+            pipeline.path = base + tag + ext + ('.gz' if pipeline.compression else '')
+        return pipeline
+
     def open_spider(self, spider):
         os.makedirs('data', exist_ok=True)
-        self.file = open('data/products.json', 'w', encoding='utf-8')
-        spider.logger.info("JSON export pipeline opened")
-    
+        if self.compression == 'gzip':
+            self.file = gzip.open(self.path, 'wb', compresslevel=6)
+        else:
+            self.file = open(self.path, 'wb', buffering=1024 * 1024)
+        exporter_cls = self.EXPORTERS[self.format][1]
+        indent = 2 if self.format == 'json' else None
+        self.exporter = exporter_cls(self.file, fields_to_export=EXPORT_FIELDS, indent=indent,
+                                     ensure_ascii=False, encoding='utf-8')
+        self.exporter.start_exporting()
+        spider.logger.info(f"JSON export pipeline opened, writing {self.path}")
 
     def close_spider(self, spider):
         if self.file:
             try:
-                json.dump(self.items, self.file, indent=2, ensure_ascii=False)
+                self.exporter.finish_exporting()
                 self.file.close()
-                spider.logger.info(f'Exported {len(self.items)} items to JSON')
+                spider.logger.info(f'Exported {self.items_count} items to {self.path}')
             except Exception as e:
                 spider.logger.error(f"Error writing JSON file: {e}")
+
     def process_item(self, item, spider):
         try:
-            # Convert item to dict and clean it
-            item_dict = ItemAdapter(item).asdict()
-            
-            # Ensure all values are JSON serializable
-            cleaned_item = {}
-            for key, value in item_dict.items():
-                if value is not None:
-                    cleaned_item[key] = value
-                else:
-                    cleaned_item[key] = None
-            
-            self.items.append(cleaned_item)
-            
-            if len(self.items) % 10 == 0:
-                spider.logger.info(f"Collected {len(self.items)} items for JSON export")
-                
+            self.exporter.export_item(item)
+            self.items_count += 1
+
+            # Push completed items to disk so a crash loses at most flush_every
+            if self.items_count % self.flush_every == 0:
+                self.file.flush()
+                spider.logger.info(f"Exported {self.items_count} items to JSON")
+
         except Exception as e:
             spider.logger.error(f"Error processing item for JSON: {e}")
-            
+
         return item
 
     
+class ParquetExportPipeline:
+    """Write items to Parquet, partitioned by crawl date.
+
+    Items are buffered into record batches of batch_rows and written as row
+    groups of data/parquet/crawl_date=YYYY-MM-DD/products-<time>.parquet,
+    one file per crawl.  brand and colour are dictionary encoded; sizes,
+    breadcrumbs and image_urls are list<string> columns.  Needs pyarrow.
+    """
+
+    def __init__(self, directory='data/parquet', batch_rows=10000, compression='zstd'):
+        if pa is None:
+            raise NotConfigured('ParquetExportPipeline needs pyarrow')
+        self.directory = directory
+        self.batch_rows = batch_rows
+        self.compression = compression
+        self.schema = pa.schema([
+            ('product_name', pa.string()),
+            ('brand', pa.dictionary(pa.int32(), pa.string())),
+            ('price', pa.float64()),
+            ('sku', pa.string()),
+            ('product_id', pa.string()),
+            ('description', pa.string()),
+            ('reviews', pa.int64()),
+            ('colour', pa.dictionary(pa.int32(), pa.string())),
+            ('sizes', pa.list_(pa.string())),
+            ('breadcrumbs', pa.list_(pa.string())),
+            ('primary_image_url', pa.string()),
+            ('image_urls', pa.list_(pa.string())),
+            ('product_url', pa.string()),
+            ('scraped_at', pa.timestamp('us')),
+        ])
+        self.columns = {name: [] for name in self.schema.names}
+        self.rows = 0
+        self.items_count = 0
+        self.path = None
+        self.writer = None
+        self.worker_tag = ''
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(
+            settings.get('CARBON38_PARQUET_DIR', 'data/parquet'),
+            settings.getint('CARBON38_PARQUET_BATCH_ROWS', 10000),
+            settings.get('CARBON38_PARQUET_COMPRESSION', 'zstd'),
+        )
+        pipeline.worker_tag = frontier.worker_tag(settings)
+        return pipeline
+
+    def open_spider(self, spider):
+        started = datetime.now()
+        partition = os.path.join(self.directory, f'crawl_date={started.date().isoformat()}')
+        os.makedirs(partition, exist_ok=True)
+        self.path = os.path.join(partition, f"products-{started.strftime('%H%M%S')}{self.worker_tag}.parquet")
+        spider.logger.info(f"Parquet export pipeline opened, writing {self.path}")
+
+    def close_spider(self, spider):
+        try:
+            self.flush()
+            if self.writer:
+                self.writer.close()
+            spider.logger.info(f'Exported {self.items_count} items to {self.path}')
+        except Exception as e:
+            spider.logger.error(f"Error writing Parquet file: {e}")
+
+    def flush(self):
+        """Write the buffered rows as one row group."""
+        if not self.rows:
+            return
+        batch = pa.RecordBatch.from_pydict(self.columns, schema=self.schema)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression=self.compression)
+        self.writer.write_batch(batch)
+        self.columns = {name: [] for name in self.schema.names}
+        self.rows = 0
+
+    def process_item(self, item, spider):
+        try:
+            adapter = ItemAdapter(item)
+            # Convert the whole row first so a bad value cannot misalign the columns
+            row = {}
+            for name in self.schema.names:
+                value = adapter.get(name)
+                if value is None:
+                    pass
+                elif name in ('sizes', 'breadcrumbs', 'image_urls'):
+                    value = [str(v) for v in value] if isinstance(value, list) else [str(value)]
+                elif name == 'price':
+                    value = float(value)
+                elif name == 'reviews':
+                    value = int(value)
+                elif name == 'scraped_at':
+                    value = datetime.fromisoformat(value) if isinstance(value, str) else value
+                else:
+                    value = str(value)
+                row[name] = value
+            for name, value in row.items():
+                self.columns[name].append(value)
+            self.rows += 1
+            self.items_count += 1
+            if self.rows >= self.batch_rows:
+                self.flush()
+        except Exception as e:
+            spider.logger.error(f"Error processing item for Parquet: {e}")
+
+        return item
+
+
 class DatabasePipeline:
     """Store items in SQLite database."""
     
-    def __init__(self):
+    INSERT_SQL = '''
+            INSERT OR REPLACE INTO products ( 
+                    product_name, brand, price, sku, product_id,
+                    description, reviews, colour, sizes, breadcrumbs,
+                    primary_image_url, image_urls, product_url, scraped_at, change_signal,
+                    content_hash
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            '''
+    SIGNAL_SQL = 'UPDATE products SET change_signal = ? WHERE product_url = ?'
+
+    def __init__(self, path='database/products.db', batch_size=500, flush_interval=2.0, max_queue=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
         self.connection = None
         self.cursor = None
+        self.writer = None
         self.items_count = 0
+        self.failed = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get('CARBON38_DATABASE', 'database/products.db'),
+            settings.getint('CARBON38_DB_BATCH_SIZE', 500),
+            settings.getfloat('CARBON38_DB_FLUSH_INTERVAL', 2.0),
+            settings.getint('CARBON38_DB_QUEUE_SIZE', 10000),
+        )
+
     def open_spider(self, spider):
         try:
-            os.makedirs('database', exist_ok=True)
-            self.connection = sqlite3.connect('database/products.db')
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=30)
             self.cursor = self.connection.cursor()
             
             # Create table with better schema
@@ -195,14 +622,38 @@ class DatabasePipeline:
                     image_urls TEXT,
                     product_url TEXT UNIQUE,
                     scraped_at TEXT,
+                    change_signal TEXT,
+                    content_hash TEXT,
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            # Databases created before incremental crawls lack change_signal
+            columns = [row[1] for row in self.cursor.execute('PRAGMA table_info(products)')]
+            if 'change_signal' not in columns:
+                self.cursor.execute('ALTER TABLE products ADD COLUMN change_signal TEXT')
+            if 'content_hash' not in columns:
+                self.cursor.execute('ALTER TABLE products ADD COLUMN content_hash TEXT')
             self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_id ON products(product_id)')
             self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_brand ON products(brand)')
             self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_price ON products(price)')
+            self.connection.commit()
+            # Full-text index for `scrapy query`, kept in sync by triggers
+            if query.ensure_search_index(self.connection):
+                spider.logger.info(f'Built the search index of {self.path}')
+            # variants, images and categories, written next to the flat columns
+            if catalog.ensure_catalog_tables(self.connection):
+                spider.logger.info(f'Created the variants, images and categories tables in {self.path}')
+            # Price and availability changes, appended by a trigger on variants
+            if history.ensure_history_tables(self.connection):
+                spider.logger.info(f'Created the price history tables in {self.path}')
             
             self.connection.commit()
+            self.connection.close()
+            self.connection = self.cursor = None
+
+            # Rows are written in batches on the writer thread
+            self.writer = BatchWriter(self.path, self.batch_size, self.flush_interval, self.max_queue)
+            self.writer.start()
             spider.logger.info("Database pipeline opened and tables created")
             
         except Exception as e:
@@ -210,12 +661,30 @@ class DatabasePipeline:
     
               
     def close_spider(self, spider):
-        if self.connection:
-            self.connection.close()
-            spider.logger.info(f'Database pipeline closed. Stored {self.items_count} items')
+        if self.writer:
+            # Blocks until the partial batch is committed
+            try:
+                self.writer.close()
+            except WriterStopped as e:
+                spider.logger.error(f'Database writes were lost: {e}')
+            stats = spider.crawler.stats
+            stats.set_value('database/failed', self.writer.error is not None)
+            stats.set_value('database/rows_written', self.writer.written)
+            stats.set_value('database/batches', self.writer.batches)
+            stats.set_value('database/errors', self.writer.errors)
+            stats.set_value('database/max_queued', self.writer.max_queued)
+            spider.logger.info(f'Database pipeline closed. Stored {self.items_count} items '
+                               f'({self.writer.written} rows) in {self.writer.batches} transactions')
+
     def process_item(self, item, spider):
         try:
             adapter = ItemAdapter(item)
+            change = adapter.get('change')
+            if change == 'touched':
+                self.writer.put(self.SIGNAL_SQL, (adapter.get('change_signal'), adapter.get('product_url')))
+                return item
+            if change == 'unchanged':
+                return item
             
             # Convert lists to JSON strings for database storage
             data = {}
@@ -224,27 +693,28 @@ class DatabasePipeline:
                     data[key] = json.dumps(value) if value else '[]'
                 else:
                     data[key] = value
-                        
-            self.cursor.execute('''
-            INSERT OR REPLACE INTO products ( 
-                    product_name, brand, price, sku, product_id,
-                    description, reviews, colour, sizes, breadcrumbs,
-                    primary_image_url, image_urls, product_url, scraped_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+
+            self.writer.put(self.INSERT_SQL, (
                 data.get('product_name'), data.get('brand'), data.get('price'),
                 data.get('sku'), data.get('product_id'), data.get('description'),
                 data.get('reviews'), data.get('colour'), data.get('sizes'),
                 data.get('breadcrumbs'), data.get('primary_image_url'),
-                data.get('image_urls'), data.get('product_url'), data.get('scraped_at')
+                data.get('image_urls'), data.get('product_url'), data.get('scraped_at'),
+                data.get('change_signal'), data.get('content_hash')
             ))
-        
-            self.connection.commit()
+            for sql, params in catalog.statements(adapter):
+                self.writer.put(sql, params)
             self.items_count += 1
             
             if self.items_count % 10 == 0:
-                spider.logger.info(f"Stored {self.items_count} items in database")
-                
+                spider.logger.info(f"Queued {self.items_count} items for the database")
+
+        except WriterStopped as e:
+            # Nothing more can be stored; stop instead of scraping into the void
+            if not self.failed:
+                self.failed = True
+                spider.logger.error(f'Error storing item in database, closing spider: {e}')
+                deferred_from_coro(spider.crawler.engine.close_spider_async(reason='database_error'))
         except Exception as e:
             spider.logger.error(f"Error storing item in database: {e}")
             
@@ -0,0 +1,271 @@
+# Read-side queries over products.db.
+#
+# products_fts is an FTS5 index on product_name, brand and description.
+# It stores no text of its own (content='products'); triggers on products
+# keep it in step with every write, in the same transaction.  INSERT OR
+# REPLACE removes the old row without firing delete triggers unless
+# recursive_triggers is on, so every connection that writes products must
+# turn it on (BatchWriter does), or the index keeps entries for rows that
+# are gone.
+#
+# Results are keyset-paginated: a page ends with a cursor holding the sort
+# key of its last row and the next page starts strictly after that key, so
+# page 100 costs what page 1 costs, where OFFSET reads and throws away
+# every earlier row.  The SQL of a search depends only on which filters are
+# set, so the connection's statement cache reuses one prepared statement
+# for all searches of the same shape.
+#
+#   scrapy query "crop top" --brand ALO --max-price 120 --order price
+
+import base64
+import json
+import os
+import re
+import sqlite3
+import time
+from functools import lru_cache
+
+from carbon38_scraper import catalog, history
+
+SEARCH_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    product_name, brand, description,
+    content='products', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts (rowid, product_name, brand, description)
+    VALUES (new.id, new.product_name, new.brand, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, product_name, brand, description)
+    VALUES ('delete', old.id, old.product_name, old.brand, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF product_name, brand, description ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, product_name, brand, description)
+    VALUES ('delete', old.id, old.product_name, old.brand, old.description);
+    INSERT INTO products_fts (rowid, product_name, brand, description)
+    VALUES (new.id, new.product_name, new.brand, new.description);
+END;
+CREATE INDEX IF NOT EXISTS idx_brand_price ON products (brand COLLATE NOCASE, price);
+'''
+
+# Sort orders: the key columns (the last one unique) and the direction
+ORDERS = {
+    'relevance': (('products_fts.rank', 'p.id'), 'ASC'),
+    'newest': (('p.id',), 'DESC'),
+    'price': (('p.price', 'p.id'), 'ASC'),
+    '-price': (('p.price', 'p.id'), 'DESC'),
+}
+
+# Stored as JSON text by DatabasePipeline
+LIST_COLUMNS = ('sizes', 'breadcrumbs', 'image_urls')
+
+COLUMNS = ('id', 'product_name', 'brand', 'price', 'sku', 'product_id', 'description', 'reviews',
+           'colour', 'sizes', 'breadcrumbs', 'primary_image_url', 'image_urls', 'product_url',
+           'scraped_at')
+
+
+def has_search_index(connection):
+    return connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+    ).fetchone() is not None
+
+
+def ensure_search_index(connection):
+    """Create the FTS index, its triggers and the filter index; True if the index is new.
+
+    A new index is filled from the rows already in products.
+    """
+    created = not has_search_index(connection)
+    connection.executescript(SEARCH_SCHEMA)
+    if created:
+        rebuild_search_index(connection)
+    return created
+
+
+def rebuild_search_index(connection):
+    with connection:
+        connection.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+        connection.execute("INSERT INTO products_fts (products_fts) VALUES ('optimize')")
+
+
+def fts_query(text):
+    """An FTS5 query matching every word of text, the last one as a prefix.
+
+    Words are quoted, so user input cannot inject FTS5 operators.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError(f'Invalid cursor {cursor!r}') from None
+    if not isinstance(key, list):
+        raise ValueError(f'Invalid cursor {cursor!r}')
+    return key
+
+
+@lru_cache(maxsize=None)
+def search_sql(text, brand, size, min_price, max_price, in_stock, order, after):
+    """SELECT for one combination of filters; the arguments say which are set."""
+    keys, direction = ORDERS[order]
+    if text:
+        # FTS5 returns matches in rowid order and applies rowid bounds
+        # itself, so the id key is read from the index, not the join
+        keys = tuple('products_fts.rowid' if key == 'p.id' else key for key in keys)
+    selected = ', '.join(f'p.{column}' for column in COLUMNS)
+    selected += ''.join(f', {key} AS _key{i}' for i, key in enumerate(keys))
+    if text:
+        sql = f'SELECT {selected} FROM products_fts JOIN products p ON p.id = products_fts.rowid'
+        conditions = ['products_fts MATCH ?']
+    else:
+        sql = f'SELECT {selected} FROM products p'
+        conditions = []
+    if brand:
+        conditions.append('p.brand = ? COLLATE NOCASE')
+    prices = []
+    if min_price:
+        prices.append('price >= ?')
+    if max_price:
+        prices.append('price <= ?')
+    if size or in_stock:
+        # Some variant must match on its own, price included (catalog.py).
+        # Not correlated, so the variants are found through idx_variants_size
+        variant = []
+        if size:
+            variant.append('size = ? COLLATE NOCASE')
+        if in_stock:
+            variant.append('available = 1')
+        variant += prices
+        conditions.append(f'p.id IN (SELECT product_rowid FROM variants WHERE {" AND ".join(variant)})')
+    else:
+        conditions += [f'p.{price}' for price in prices]
+    if after:
+        comparison = '>' if direction == 'ASC' else '<'
+        conditions.append(f'({", ".join(keys)}) {comparison} ({", ".join("?" * len(keys))})')
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY ' + ', '.join(f'{key} {direction}' for key in keys) + ' LIMIT ?'
+    return sql
+
+
+class ProductQuery:
+    """Searches a products.db read-only; one instance per thread."""
+
+    def __init__(self, path, cached_statements=128):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'No database at {path}')
+        self.connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, cached_statements=cached_statements)
+        self.connection.row_factory = sqlite3.Row
+        if not has_search_index(self.connection):
+            self.connection.close()
+            raise ValueError(f'{path} has no search index yet; run `scrapy query --reindex`')
+
+    def close(self):
+        self.connection.close()
+
+    def search(self, text=None, brand=None, min_price=None, max_price=None, order=None, limit=20, after=None,
+               size=None, in_stock=False):
+        """One page of products as (rows, cursor for the next page or None).
+
+        text is matched against name, brand and description; order is one
+        of ORDERS, by default relevance for text searches and newest first
+        otherwise.  after is the cursor returned with the previous page.
+        With size or in_stock, a product matches if one of its variants has
+        that size, is available and has a price within the bounds.
+        """
+        match = fts_query(text) if text else None
+        if text and match is None:
+            return [], None
+        order = order or ('relevance' if match else 'newest')
+        if order not in ORDERS:
+            raise ValueError(f'Unknown order {order!r}, expected one of {sorted(ORDERS)}')
+        if order == 'relevance' and not match:
+            raise ValueError('Ordering by relevance needs search text')
+        key = decode_cursor(after) if after else None
+        if key is not None and len(key) != len(ORDERS[order][0]):
+            raise ValueError('Cursor does not belong to this sort order')
+
+        if (size or in_stock) and not catalog.has_catalog_tables(self.connection):
+            raise ValueError('This database has no variants table yet; run `scrapy query --reindex`')
+
+        filters = (match or None, brand or None, size or None, min_price, max_price)
+        params = [value for value in filters if value is not None]
+        params += key or []
+        params.append(limit)
+        sql = search_sql(*(value is not None for value in filters), bool(in_stock), order, key is not None)
+        rows = self.connection.execute(sql, params).fetchall()
+
+        results = []
+        for row in rows:
+            product = {column: row[column] for column in COLUMNS}
+            for column in LIST_COLUMNS:
+                if product[column]:
+                    product[column] = json.loads(product[column])
+            results.append(product)
+        cursor = None
+        if len(rows) == limit:
+            last = rows[-1]
+            cursor = encode_cursor([last[f'_key{i}'] for i in range(len(ORDERS[order][0]))])
+        return results, cursor
+
+    def _check_history(self):
+        if not history.has_history_tables(self.connection):
+            raise ValueError('This database has no price history yet; run `scrapy query --reindex`')
+
+    def price_changes(self, days=7, limit=50, after=None):
+        """Price and availability changes of the last days, newest first, as (rows, cursor).
+
+        Each row has the variant's price_cents, previous_cents and
+        available; first observations are not changes and are left out.
+        """
+        self._check_history()
+        key = decode_cursor(after) if after else None
+        if key is not None and len(key) != 2:
+            raise ValueError('Cursor does not belong to price changes')
+        since = int(time.time() - days * 86400)
+        sql = history.CHANGES_SQL.format(after='AND (h.observed_at, h.series) < (?, ?)' if key else '')
+        rows = [dict(row) for row in self.connection.execute(sql, [since, *(key or []), limit])]
+        cursor = encode_cursor([rows[-1]['observed_at'], rows[-1]['series']]) if len(rows) == limit else None
+        return rows, cursor
+
+    def lowest_prices(self, product_url=None, at_lowest=False, limit=50, after=None):
+        """Current and lowest recorded price per product, by URL, as (rows, cursor).
+
+        current_cents is the cheapest variant now, lowest_cents the lowest
+        price any variant had.  at_lowest keeps the products that are at
+        their lowest price now.
+        """
+        self._check_history()
+        conditions, params = [], []
+        if product_url:
+            conditions.append('s.product_url = ?')
+            params.append(product_url)
+        if after:
+            key = decode_cursor(after)
+            if len(key) != 1:
+                raise ValueError('Cursor does not belong to lowest prices')
+            conditions.append('s.product_url > ?')
+            params.append(key[0])
+        sql = history.LOWEST_SQL.format(
+            where='WHERE ' + ' AND '.join(conditions) if conditions else '',
+            having='HAVING MIN(s.current_cents) <= MIN(s.lowest_cents)' if at_lowest else '',
+        )
+        rows = [dict(row) for row in self.connection.execute(sql, [*params, limit])]
+        cursor = encode_cursor([rows[-1]['product_url']]) if len(rows) == limit else None
+        return rows, cursor
+
+    def price_history(self, product_url):
+        """Every recorded price and availability of a product's variants, oldest first."""
+        self._check_history()
+        return [dict(row) for row in self.connection.execute(history.SERIES_HISTORY_SQL, [product_url])]
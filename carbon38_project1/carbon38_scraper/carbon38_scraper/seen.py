@@ -0,0 +1,70 @@
+# Product handles already scheduled in this crawl, and optionally those
+# scraped by earlier runs.
+#
+# Handles are kept as 64-bit blake2b digests.  The file named by
+# CARBON38_SEEN_FILE is a sorted array of little-endian uint64 digests, 8
+# bytes per product, searched with bisect so earlier runs cost no per-handle
+# Python objects.  Only handles whose item was actually scraped are written
+# back, so a product that failed is retried next run.
+
+import hashlib
+import os
+import sys
+from array import array
+from bisect import bisect_left
+
+
+def handle_digest(handle):
+    return int.from_bytes(hashlib.blake2b(handle.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class SeenSet:
+    """Handles scheduled this crawl plus the sorted digests of earlier runs."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.stored = array('Q')
+        self.scheduled = set()
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.stored.frombytes(f.read())
+            if sys.byteorder == 'big':
+                self.stored.byteswap()
+
+    def __len__(self):
+        return len(self.stored) + len(self.scheduled)
+
+    def _stored_contains(self, digest):
+        index = bisect_left(self.stored, digest)
+        return index < len(self.stored) and self.stored[index] == digest
+
+    def __contains__(self, handle):
+        digest = handle_digest(handle)
+        return digest in self.scheduled or self._stored_contains(digest)
+
+    def add(self, handle):
+        """Record handle as scheduled; False if it was already seen."""
+        digest = handle_digest(handle)
+        if digest in self.scheduled or self._stored_contains(digest):
+            return False
+        self.scheduled.add(digest)
+        return True
+
+    def mark_done(self, handle):
+        """Record that handle was scraped, so later runs skip it."""
+        self.done.add(handle_digest(handle))
+
+    def save(self):
+        """Merge this run's scraped handles into the file, atomically."""
+        if not self.path or not self.done:
+            return
+        merged = array('Q', sorted(set(self.stored) | self.done))
+        if sys.byteorder == 'big':
+            merged.byteswap()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(merged.tobytes())
+        os.replace(tmp_path, self.path)
@@ -11,6 +11,7 @@ BOT_NAME = "carbon38_scraper"
 
 SPIDER_MODULES = ["carbon38_scraper.spiders"]
 NEWSPIDER_MODULE = "carbon38_scraper.spiders"
+COMMANDS_MODULE = "carbon38_scraper.commands"
 
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = False
@@ -26,13 +27,71 @@ USER_AGENT = 'carbon38_scraper (+http://www.yourdomain.com)'
 # Pipelines
 ITEM_PIPELINES = {
     'carbon38_scraper.pipelines.ProductCleanerPipeline': 300,
+    'carbon38_scraper.pipelines.ChangeDetectionPipeline': 320,
+    'carbon38_scraper.pipelines.ProductImagesPipeline': 350,
      'carbon38_scraper.pipelines.CSVExportPipeline': 400,
     'carbon38_scraper.pipelines.JSONExportPipeline': 500,
+    'carbon38_scraper.pipelines.ParquetExportPipeline': 550,
     'carbon38_scraper.pipelines.DatabasePipeline': 600,
 }
 
-# Enable autothrottling
-AUTOTHROTTLE_ENABLED = True
+# Stage timings (download, callbacks, extract_* methods, pipelines) are kept
+# as histograms under timing/ in the crawl stats.  Set CARBON38_METRICS_PORT
+# to serve them in Prometheus text format at http://127.0.0.1:<port>/metrics.
+CARBON38_TIMING = True
+CARBON38_METRICS_PORT = 0
+ITEM_PROCESSOR = 'carbon38_scraper.metrics.TimedItemPipelineManager'
+SPIDER_MIDDLEWARES = {
+    'carbon38_scraper.middlewares.Carbon38ScraperSpiderMiddleware': 543,
+}
+DOWNLOADER_MIDDLEWARES = {
+    # After RetryMiddleware (550) on the way in, so it sees 429/503 first
+    'carbon38_scraper.middlewares.Carbon38ScraperDownloaderMiddleware': 560,
+    # Next to the downloader, so the HTTP cache stores trimmed pages
+    'carbon38_scraper.middlewares.BodyTrimMiddleware': 950,
+}
+EXTENSIONS = {
+    'carbon38_scraper.metrics.MetricsServer': 500,
+}
+
+# Shared frontier (see frontier.py): set CARBON38_FRONTIER_URL to
+# redis://host:6379/0 or sqlite:///frontier.db and start each process with
+# its own CARBON38_FRONTIER_WORKER (0 .. CARBON38_FRONTIER_WORKERS - 1).
+# They share the request queue, the dupefilter and CARBON38_DATABASE;
+# `scrapy frontier reset` clears the queue for a new crawl.  Unset, the
+# scheduler is Scrapy's own.  The item budget and seen file are per worker.
+SCHEDULER = 'carbon38_scraper.frontier.FrontierScheduler'
+CARBON38_FRONTIER_URL = None
+CARBON38_FRONTIER_KEY = None
+CARBON38_FRONTIER_WORKER = 0
+CARBON38_FRONTIER_WORKERS = 1
+CARBON38_FRONTIER_SHARDS = 0
+CARBON38_FRONTIER_STEAL = True
+CARBON38_FRONTIER_IDLE_TIMEOUT = 30
+
+# Adaptive pacing: each download slot starts at DOWNLOAD_DELAY and
+# CONCURRENT_REQUESTS_PER_DOMAIN and is sped up while responses stay under
+# CARBON38_ADAPTIVE_TARGET_LATENCY seconds and errors (429, 503, timeouts)
+# stay within CARBON38_ADAPTIVE_ERROR_BUDGET of each window of
+# CARBON38_ADAPTIVE_WINDOW responses; it backs off otherwise, and for at
+# least as long as any Retry-After header asks.  CARBON38_ADAPTIVE_TARGET_RPS
+# stops speeding up at that many responses per second (0: no target).
+# Speeding up shortens the delay to CARBON38_ADAPTIVE_MIN_DELAY, then adds
+# concurrency.  While a slot has a delay Scrapy sends one request per delay
+# whatever its concurrency, so added concurrency only takes effect with a
+# minimum delay of 0; a higher minimum caps the slot at one request per that
+# many seconds.  Replaces AutoThrottle, which would fight over the same delays.
+CARBON38_ADAPTIVE = True
+CARBON38_ADAPTIVE_TARGET_LATENCY = 1.0
+CARBON38_ADAPTIVE_TARGET_RPS = 0
+CARBON38_ADAPTIVE_ERROR_BUDGET = 0.02
+CARBON38_ADAPTIVE_WINDOW = 20
+CARBON38_ADAPTIVE_MIN_DELAY = 0
+CARBON38_ADAPTIVE_MAX_DELAY = 60
+CARBON38_ADAPTIVE_MAX_CONCURRENCY = 8
+
+# Enable autothrottling (when CARBON38_ADAPTIVE is off)
+AUTOTHROTTLE_ENABLED = False
 AUTOTHROTTLE_START_DELAY = 1
 AUTOTHROTTLE_MAX_DELAY = 10
 AUTOTHROTTLE_TARGET_CONCURRENCY = 2.0
@@ -40,6 +99,119 @@ AUTOTHROTTLE_TARGET_CONCURRENCY = 2.0
 # Cache settings
 HTTPCACHE_ENABLED = True
 HTTPCACHE_EXPIRATION_SECS = 3600
+# Set HTTPCACHE_STORAGE = 'carbon38_scraper.httpcache.SqliteCacheStorage' to
+# keep the cache in one compressed SQLite file per spider instead of a
+# directory tree (`scrapy cachemigrate` imports the existing tree).  Past
+# CARBON38_HTTPCACHE_MAX_BYTES (0 = no cap) the least recently used
+# responses are evicted.
+CARBON38_HTTPCACHE_MAX_BYTES = 0
+CARBON38_HTTPCACHE_COMPRESSION_LEVEL = 6
 
 # Logging
-LOG_LEVEL = 'INFO'
\ No newline at end of file
+LOG_LEVEL = 'INFO'
+
+# Catalog mode: 'json' reads the Shopify products.json endpoints (hundreds of
+# products per request), 'html' scrapes listing and product pages.  Both
+# build the same item: breadcrumbs are the collection's trail (product pages
+# show none) and reviews come from the review metafields or script.
+CARBON38_CATALOG_MODE = 'json'
+CARBON38_CATALOG_PAGE_SIZE = 250
+# Point the spider at a local fixture server instead of the live store
+CARBON38_BASE_URL = 'https://carbon38.com'
+
+# After this many pages, selectors that never matched are tried last (the
+# others keep their declared order);
+# per-field hit/miss counts are reported under selectors/ in the crawl stats
+CARBON38_SELECTOR_WARMUP = 20
+
+# HTML parser behind the product page selectors: 'lxml' (parsel, the
+# default) or 'lexbor' (selectolax, pip install selectolax).  Check a switch
+# with `scrapy replay --parity` first; it compares both on the HTTP cache.
+CARBON38_PARSER_BACKEND = 'lxml'
+
+# Drop scripts, styles, inline SVG, <link> tags and comments that no
+# extractor reads from HTML pages before they are cached and parsed
+# (about 56% of a product page).  `scrapy replay --trim-parity` checks that
+# the items stay the same.
+CARBON38_TRIM_BODIES = True
+
+# Parse product pages in this many worker processes (0 = on the reactor
+# thread).  At most CARBON38_PARSE_MAX_PENDING pages (default 2 per worker)
+# are queued in the pool; raise SCRAPER_SLOT_MAX_ACTIVE_SIZE so enough
+# ~2 MB product pages can wait for a worker before downloads are paused.
+CARBON38_PARSE_WORKERS = 0
+CARBON38_PARSE_MAX_PENDING = 0
+
+# Sorted file of product handle digests shared between runs.  When set,
+# products scraped by any earlier run are not requested again; delete the
+# file to start over.  Unset: duplicates are only skipped within a crawl.
+CARBON38_SEEN_FILE = None
+
+# SQLite database written by DatabasePipeline, with a full-text index for
+# `scrapy query` (see query.py), per-variant tables (catalog.py) and the
+# price and availability history (history.py)
+CARBON38_DATABASE = 'database/products.db'
+
+# Incremental crawls (or -a incremental=1): products whose change signal
+# (products.json updated_at, or a digest of the listing card) matches the
+# one stored in CARBON38_DATABASE are not requested again.  Skips are
+# counted in the incremental/unchanged stat.
+CARBON38_INCREMENTAL = False
+
+# Every cleaned item carries a content_hash of its fields (scraped_at and
+# change_signal excluded), stored in CARBON38_DATABASE.  With
+# CARBON38_SKIP_UNCHANGED, products whose hash matches the stored one are not
+# written to the database or have their images fetched again (changes/*
+# stats count them); the CSV, JSON and Parquet exports still get every
+# product.  Set CARBON38_DELTA_DIR to also write a feed of new, changed and
+# removed products per crawl.
+CARBON38_SKIP_UNCHANGED = False
+CARBON38_DELTA_DIR = None
+
+# Build CompactProductItem (slots, interned brand/colour/size/category
+# strings) instead of ProductItem; cuts per-item memory when many items are
+# alive at once, e.g. queued behind a slow pipeline.
+CARBON38_COMPACT_ITEMS = False
+
+# DatabasePipeline commits once per CARBON38_DB_BATCH_SIZE rows or
+# CARBON38_DB_FLUSH_INTERVAL seconds, from a writer thread fed by a queue of
+# at most CARBON38_DB_QUEUE_SIZE rows (a full queue blocks the crawl).
+CARBON38_DB_BATCH_SIZE = 500
+CARBON38_DB_FLUSH_INTERVAL = 2.0
+CARBON38_DB_QUEUE_SIZE = 10000
+
+# JSONExportPipeline streams items as they arrive: 'json' writes an indented
+# array to data/products.json, 'jsonlines' one item per line to
+# data/products.jsonl.  CARBON38_JSON_COMPRESSION = 'gzip' adds a .gz file.
+CARBON38_JSON_FORMAT = 'json'
+CARBON38_JSON_COMPRESSION = None
+CARBON38_JSON_FLUSH_ITEMS = 100
+
+# CSVExportPipeline output: compression None, 'gzip' or 'zstd'; rotate into
+# numbered shards after this many rows or uncompressed bytes (0 = one file).
+CARBON38_CSV_COMPRESSION = None
+CARBON38_CSV_ROTATE_ROWS = 0
+CARBON38_CSV_ROTATE_BYTES = 0
+CARBON38_CSV_BUFFER_SIZE = 1024 * 1024
+CARBON38_CSV_FLUSH_ITEMS = 100
+
+# ParquetExportPipeline (disabled when pyarrow is not installed): one file
+# per crawl under CARBON38_PARQUET_DIR/crawl_date=YYYY-MM-DD/, one row group
+# per CARBON38_PARQUET_BATCH_ROWS items.
+CARBON38_PARQUET_DIR = 'data/parquet'
+CARBON38_PARQUET_BATCH_ROWS = 10000
+CARBON38_PARQUET_COMPRESSION = 'zstd'
+
+# Item budget (or -a max_items=N): no more products are requested once this
+# many have been scheduled, and the spider closes when they are scraped.
+# 0 means no limit.
+CARBON38_MAX_ITEMS = 5000
+
+# ProductImagesPipeline is off until CARBON38_IMAGES_STORE names a directory
+# (or s3:// / gs:// URI).  Images are fetched CARBON38_IMAGE_WIDTH pixels wide
+# (0: original size) through their own download slot.
+CARBON38_IMAGES_STORE = None
+CARBON38_IMAGE_WIDTH = 1200
+DOWNLOAD_SLOTS = {
+    'images': {'concurrency': 8, 'delay': 0, 'randomize_delay': False},
+}
@@ -0,0 +1,276 @@
+# Helpers for the structured JSON endpoints every Shopify storefront exposes.
+#
+#   /collections/<handle>/products.json?limit=250&page=N  -> {"products": [...]}
+#   /products/<handle>.json                               -> {"product": {...}}
+#
+# These return the full product (variants, images, options, vendor) without any
+# theme markup, so a single catalog page replaces hundreds of HTML requests.
+
+import re
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+from w3lib.html import remove_tags, replace_entities
+
+from carbon38_scraper.items import ProductItem
+
+# Shopify refuses anything above 250 products per page
+MAX_PAGE_SIZE = 250
+
+COLOUR_OPTION_NAMES = ('color', 'colour')
+SIZE_OPTION_NAMES = ('size',)
+
+# Metafields holding a product's review count: Shopify's standard reviews
+# metafield, then the review apps' own
+REVIEW_COUNT_METAFIELDS = ('reviews.rating_count', 'judgeme.review_count', 'yotpo.reviews_count',
+                           'stamped.reviews_count', 'okendo.ReviewCount')
+
+# Shopify Markets prefixes paths with the shopper's locale, e.g. /en-in
+LOCALE_PREFIX = re.compile(r'^[a-z]{2}(-[a-z]{2})?$')
+
+# Legacy CDN size suffixes: name_800x.jpg, name_800x1200_crop_center@2x.jpg,
+# name_grande.jpg.  Current themes pass ?width= / ?height= / ?crop= instead.
+IMAGE_SIZE_SUFFIX = re.compile(
+    r'_(?:\d+x\d*|x\d+|pico|icon|thumb|small|compact|medium|large|grande|original|master)'
+    r'(?:_crop_[a-z]+)?(?:@\d+x)?(?=\.[A-Za-z0-9]+$)'
+)
+IMAGE_SIZE_PARAMS = ('width', 'height', 'crop', 'format', 'pad_color')
+
+
+def collection_handle(url):
+    """Return the collection handle from a /collections/<handle> URL."""
+    parts = [p for p in urlparse(url).path.split('/') if p]
+    if 'collections' in parts:
+        index = parts.index('collections')
+        if index + 1 < len(parts):
+            return parts[index + 1]
+    return None
+
+
+def product_handle(url):
+    """Return the product handle from any /products/<handle> style URL."""
+    parts = [p for p in urlparse(url).path.split('/') if p]
+    if 'products' in parts:
+        index = parts.index('products')
+        if index + 1 < len(parts):
+            handle = parts[index + 1]
+            for suffix in ('.json', '.js'):
+                if handle.endswith(suffix):
+                    handle = handle[:-len(suffix)]
+            return handle
+    return None
+
+
+def canonical_product_url(url):
+    """Reduce any product link to <origin>[/<locale>]/products/<handle>.
+
+    Collection prefixes, variant queries and fragments are dropped, so every
+    link to a product maps to one URL.
+    """
+    handle = product_handle(url)
+    if not handle:
+        return url
+    parsed = urlparse(url)
+    parts = [p for p in parsed.path.split('/') if p]
+    locale = f'/{parts[0]}' if parts and LOCALE_PREFIX.match(parts[0]) else ''
+    origin = f'{parsed.scheme}://{parsed.netloc}' if parsed.netloc else ''
+    return f'{origin}{locale}/products/{handle}'
+
+
+def collection_products_url(base_url, handle, page=1, limit=MAX_PAGE_SIZE):
+    """Build the products.json URL for one page of a collection."""
+    query = urlencode({'limit': min(limit, MAX_PAGE_SIZE), 'page': page})
+    return f"{base_url.rstrip('/')}/collections/{handle}/products.json?{query}"
+
+
+def collection_url(base_url, handle):
+    """Build the HTML listing URL of a collection."""
+    return f"{base_url.rstrip('/')}/collections/{handle}"
+
+
+def product_json_url(base_url, handle):
+    """Build the per-product .json URL."""
+    return f"{base_url.rstrip('/')}/products/{handle}.json"
+
+
+def product_url(base_url, handle):
+    """Build the HTML product page URL."""
+    return f"{base_url.rstrip('/')}/products/{handle}"
+
+
+def collection_breadcrumbs(handle):
+    """Breadcrumb trail of a product reached through collection handle.
+
+    Product pages on carbon38.com carry no breadcrumb markup, so both the
+    JSON and the HTML path fall back to this trail and build the same item.
+    """
+    if not handle:
+        return []
+    return ['Home', ' '.join(word.capitalize() for word in handle.split('-') if word)]
+
+
+def reviews_text(count):
+    """The reviews field as the product page shows it: '12 Reviews', '0 Reviews'."""
+    return f'{count or 0} Reviews'
+
+
+def review_count(product):
+    """Review count from the product's metafields, or None if it has none.
+
+    Storefronts expose metafields in product JSON either as a list of
+    {namespace, key, value} entries or as a {"namespace.key": value} map.
+    """
+    metafields = product.get('metafields') or {}
+    if isinstance(metafields, list):
+        metafields = {f"{field.get('namespace')}.{field.get('key')}": field.get('value')
+                      for field in metafields if isinstance(field, dict)}
+    for name in REVIEW_COUNT_METAFIELDS:
+        value = metafields.get(name)
+        if isinstance(value, dict):
+            # rating_count metafields can be {"value": N, ...}
+            value = value.get('value')
+        try:
+            return int(str(value).strip())
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def option_values(product, names):
+    """Return the values of the first product option whose name is in names."""
+    for option in product.get('options') or []:
+        if isinstance(option, dict):
+            name = option.get('name') or ''
+            values = option.get('values') or []
+        else:
+            # /products/<handle>.js lists options as plain names
+            name, values = str(option), []
+        if name.strip().lower() in names:
+            return [str(v) for v in values]
+    return []
+
+
+def option_key(product, names):
+    """The variant key (option1..option3) of the first product option whose name is in names."""
+    for position, option in enumerate(product.get('options') or []):
+        name = option.get('name') if isinstance(option, dict) else option
+        if str(name or '').strip().lower() in names:
+            return f'option{position + 1}'
+    return None
+
+
+def variant_price(value):
+    """.json endpoints give prices as decimal strings, .js and the theme's product JSON as cents."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value / 100
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def variants_from_product(product):
+    """One dict per variant: variant_id, sku, size, colour, price and available.
+
+    available is None where the endpoint does not say (/products/<handle>.json).
+    """
+    size_key = option_key(product, SIZE_OPTION_NAMES)
+    colour_key = option_key(product, COLOUR_OPTION_NAMES)
+    variants = []
+    for variant in product.get('variants') or []:
+        if not isinstance(variant, dict):
+            continue
+        available = variant.get('available')
+        variants.append({
+            'variant_id': str(variant['id']) if variant.get('id') else None,
+            'sku': variant.get('sku') or None,
+            'size': variant.get(size_key) if size_key else None,
+            'colour': variant.get(colour_key) if colour_key else None,
+            'price': variant_price(variant.get('price')),
+            'available': None if available is None else bool(available),
+        })
+    return variants
+
+
+def image_src(image):
+    """Image entries are dicts in .json endpoints and plain URLs in .js."""
+    if isinstance(image, dict):
+        return image.get('src')
+    return image
+
+
+def clean_html(html):
+    """Flatten body_html to plain text."""
+    if not html:
+        return None
+    text = replace_entities(remove_tags(html))
+    text = ' '.join(text.split())
+    return text or None
+
+
+def item_from_product(product, base_url, item_class=ProductItem, collection=None):
+    """Build a ProductItem (or item_class) from a Shopify product JSON object.
+
+    reviews and breadcrumbs are filled the way Carbon38Spider.parse_product
+    fills them for the same product reached through collection.
+    """
+    item = item_class()
+    variants = product.get('variants') or []
+    # Prefer the first purchasable variant, same as the product page shows
+    variant = next((v for v in variants if v.get('available', True)), None)
+    if variant is None and variants:
+        variant = variants[0]
+
+    images = [image_src(img) for img in product.get('images') or []]
+    images = [src for src in images if src]
+
+    item['product_name'] = product.get('title')
+    item['brand'] = product.get('vendor')
+    item['price'] = variant.get('price') if variant else None
+    item['sku'] = variant.get('sku') if variant else None
+    item['product_id'] = str(product['id']) if product.get('id') else None
+    item['description'] = clean_html(product.get('body_html') or product.get('description'))
+    item['reviews'] = reviews_text(review_count(product))
+    colours = option_values(product, COLOUR_OPTION_NAMES)
+    item['colour'] = colours[0] if colours else None
+    item['sizes'] = option_values(product, SIZE_OPTION_NAMES)
+    item['breadcrumbs'] = collection_breadcrumbs(collection)
+    item['primary_image_url'] = clean_image_src(images[0]) if images else None
+    item['image_urls'] = [clean_image_src(src) for src in images]
+    item['product_url'] = product_url(base_url, product.get('handle'))
+    item['variants'] = variants_from_product(product)
+    return item
+
+
+def clean_image_src(src):
+    """Shopify returns protocol-relative CDN URLs in some endpoints."""
+    if src and src.startswith('//'):
+        return 'https:' + src
+    return src
+
+
+def is_cdn_image(url):
+    parsed = urlparse(url)
+    return parsed.hostname == 'cdn.shopify.com' or parsed.path.startswith('/cdn/shop/')
+
+
+def image_asset_url(src):
+    """The CDN asset behind an image URL, without size suffixes or size parameters.
+
+    The ?v= version is kept: it changes when the image file is replaced.
+    Non-CDN URLs are returned unchanged.
+    """
+    url = clean_image_src(src)
+    if not url or not is_cdn_image(url):
+        return url
+    parsed = urlparse(url)
+    path = IMAGE_SIZE_SUFFIX.sub('', parsed.path)
+    query = urlencode([(k, v) for k, v in parse_qsl(parsed.query) if k not in IMAGE_SIZE_PARAMS])
+    return f"{parsed.scheme}://{parsed.netloc}{path}{'?' + query if query else ''}"
+
+
+def sized_image_url(asset_url, width=None):
+    """Ask the CDN for asset_url scaled to width pixels (None: the original)."""
+    if not width or not is_cdn_image(asset_url):
+        return asset_url
+    separator = '&' if '?' in asset_url else '?'
+    return f'{asset_url}{separator}width={int(width)}'
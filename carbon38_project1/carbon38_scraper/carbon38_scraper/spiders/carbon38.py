@@ -1,8 +1,28 @@
 import scrapy
-import re
+from scrapy import signals
+from scrapy.utils.defer import deferred_from_coro
 import json
-from carbon38_scraper.items import ProductItem
+from carbon38_scraper.items import CompactProductItem, ProductItem
+from carbon38_scraper import incremental, metrics, shopify
+from carbon38_scraper.extraction import ExtractionContext, SelectorEngine, check_backend
+from carbon38_scraper.parsepool import ParsePool
+from carbon38_scraper.seen import SeenSet
 from urllib.parse import urljoin, urlparse, parse_qs
+from w3lib.url import add_or_replace_parameter
+
+
+# Product pages are fetched before further listing pages, so the queue holds
+# roughly one listing page worth of products instead of the whole catalog
+PRODUCT_PRIORITY = 10
+
+# Never guess listing pages beyond this when a collection has no pagination links
+MAX_LISTING_PAGES = 50
+
+
+def listing_page_number(url):
+    """The ?page= number of a listing URL, 1 when absent."""
+    page = parse_qs(urlparse(url).query).get('page', ['1'])[0]
+    return int(page) if page.isdigit() else 1
 
 
 class Carbon38Spider(scrapy.Spider):
@@ -35,78 +55,333 @@ class Carbon38Spider(scrapy.Spider):
     #             "price": product.css(".ProductItem__Price::text").get()
     #         }
     #         yield data
-    #slows down the spider by waiting 2 seconds between requests and limits 
-    # it to 4 requests at a time to avoid overloading the website or getting blocked.
+    # json: build items from the Shopify catalog endpoints, html: scrape pages
+    catalog_mode = 'json'
+    base_url = 'https://carbon38.com'
+    catalog_page_size = shopify.MAX_PAGE_SIZE
+    # Set when CARBON38_PARSE_WORKERS > 0
+    parse_pool = None
+    # Skip products whose change signal matches products.db
+    incremental = False
+    known_signals = {}
+    # CompactProductItem when CARBON38_COMPACT_ITEMS is set
+    item_class = ProductItem
+    # HTML parser the extract_* methods query (CARBON38_PARSER_BACKEND)
+    parser_backend = 'lxml'
+
+    # Download pace comes from the project settings: DOWNLOAD_DELAY is only
+    # the starting point, the downloader middleware adapts it per slot.
     custom_settings=   {
-        'DOWNLOAD_DELAY': 2,
         'RANDOMIZE_DOWNLOAD_DELAY': 0.5,
-        'CONCURRENT_REQUESTS': 4,
     }
     def __init__(self, *args, **kwargs):
         super(Carbon38Spider, self).__init__(*args, **kwargs)
-        self.scraped_urls = set()
+        # Product handles already scheduled; see from_crawler for the file
+        self.seen_handles = SeenSet()
         self.item_count = 0
         self.max_items = 5000  # Target around 4000-5000 items
+        # Products requested or emitted so far, counted against max_items
+        self.products_scheduled = 0
+        self.budget_spent = False
+        self.selector_engine = SelectorEngine()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        spider.selector_engine = SelectorEngine(warmup=settings.getint('CARBON38_SELECTOR_WARMUP', 20))
+        spider.parser_backend = check_backend(settings.get('CARBON38_PARSER_BACKEND', cls.parser_backend))
+        # Spider arguments (-a catalog_mode=html) win over project settings
+        spider.catalog_mode = kwargs.get('catalog_mode') or \
+            settings.get('CARBON38_CATALOG_MODE', cls.catalog_mode)
+        spider.base_url = (kwargs.get('base_url') or
+                           settings.get('CARBON38_BASE_URL', cls.base_url)).rstrip('/')
+        spider.catalog_page_size = int(kwargs.get('catalog_page_size') or
+                                       settings.getint('CARBON38_CATALOG_PAGE_SIZE', cls.catalog_page_size))
+        # Product pages are parsed in worker processes when enabled
+        spider.parse_pool = ParsePool.from_settings(settings)
+        if settings.getbool('CARBON38_COMPACT_ITEMS'):
+            spider.item_class = CompactProductItem
+        # 0 lifts the item budget
+        spider.max_items = int(kwargs.get('max_items') or
+                               settings.getint('CARBON38_MAX_ITEMS', spider.max_items))
+        spider.incremental = str(kwargs.get('incremental') or
+                                 settings.getbool('CARBON38_INCREMENTAL')).lower() in ('1', 'true', 'yes')
+        if spider.incremental:
+            spider.known_signals = incremental.load_signals(settings.get('CARBON38_DATABASE'))
+        # Handles scraped by earlier runs are skipped when a seen file is set
+        spider.seen_handles = SeenSet(settings.get('CARBON38_SEEN_FILE'))
+        # extract/<method> timings (not for pages parsed in the pool)
+        if settings.getbool('CARBON38_TIMING', True):
+            metrics.instrument_extractors(spider, crawler)
+        crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+        # crawler.stats only exists once the crawl starts
+        crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
+        # A local fixture server can stand in for the store
+        host = urlparse(spider.base_url).hostname
+        if host and host not in spider.allowed_domains:
+            spider.allowed_domains = [host]
+        return spider
+
+    async def start(self):
+        """Start from the catalog JSON endpoints, or the HTML listings in html mode."""
+        for url in self.start_urls:
+            handle = shopify.collection_handle(url)
+            if self.catalog_mode == 'json' and handle:
+                yield self.catalog_request(handle, 1)
+            else:
+                yield scrapy.Request(self.rebase_url(url), self.parse)
+
+    def rebase_url(self, url):
+        """Point a carbon38.com URL at the configured base URL."""
+        parsed = urlparse(url)
+        return self.base_url + parsed.path + (f'?{parsed.query}' if parsed.query else '')
+
+    def catalog_request(self, handle, page):
+        return scrapy.Request(
+            shopify.collection_products_url(self.base_url, handle, page, self.catalog_page_size),
+            callback=self.parse_catalog,
+            errback=self.catalog_failed,
+            headers={'Accept': 'application/json'},
+            cb_kwargs={'handle': handle, 'page': page},
+        )
+
+    def parse_catalog(self, response, handle, page):
+        """Build items straight from one page of a collection's products.json."""
+        try:
+            products = json.loads(response.text)['products']
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.logger.warning(f'No catalog JSON at {response.url}, falling back to HTML listing')
+            if page == 1:
+                yield scrapy.Request(shopify.collection_url(self.base_url, handle), self.parse)
+            return
+
+        self.logger.info(f'Catalog page {page} of {handle}: {len(products)} products')
+        for product in products:
+            if not self.mark_seen(product.get('handle')):
+                continue
+            signal = incremental.catalog_signal(product)
+            if self.is_unchanged(product.get('handle'), signal):
+                continue
+            if not self.take_budget():
+                return
+            item = shopify.item_from_product(product, self.base_url, self.item_class, handle)
+            item['change_signal'] = signal
+            yield item
+
+        # A short page means the collection is exhausted
+        if len(products) >= min(self.catalog_page_size, shopify.MAX_PAGE_SIZE) and not self.budget_spent:
+            yield self.catalog_request(handle, page + 1)
+
+    def catalog_failed(self, failure):
+        """The JSON endpoint is unavailable - crawl the HTML listing instead."""
+        handle = failure.request.cb_kwargs['handle']
+        self.logger.warning(f'Catalog request failed for {handle} ({failure.value!r}), falling back to HTML listing')
+        if failure.request.cb_kwargs['page'] == 1:
+            yield scrapy.Request(shopify.collection_url(self.base_url, handle), self.parse)
+
+    def is_unchanged(self, handle, signal):
+        """True if incremental mode is on and the product has not changed since it was stored."""
+        if not self.incremental or not handle or not signal:
+            return False
+        if self.known_signals.get(handle) == signal:
+            self.crawler.stats.inc_value('incremental/unchanged')
+            return True
+        self.crawler.stats.inc_value('incremental/changed')
+        return False
+
+    def take_budget(self):
+        """Count one more product against max_items; False once the budget is spent."""
+        if self.max_items and self.products_scheduled >= self.max_items:
+            if not self.budget_spent:
+                self.budget_spent = True
+                self.logger.info(f'Item budget of {self.max_items} reached, not discovering more products')
+            self.crawler.stats.inc_value('budget/refused')
+            return False
+        self.products_scheduled += 1
+        self.crawler.stats.set_value('budget/scheduled', self.products_scheduled)
+        return True
+
+    def record_queue_depth(self):
+        """Track the deepest the scheduler queue got."""
+        stats = self.crawler.stats
+        depth = stats.get_value('scheduler/enqueued', 0) - stats.get_value('scheduler/dequeued', 0)
+        stats.max_value('scheduler/max_depth', depth)
+
+    def mark_seen(self, handle):
+        """Record a product handle; False if this or an earlier run already had it."""
+        if not handle:
+            return True
+        if self.seen_handles.add(handle):
+            return True
+        self.crawler.stats.inc_value('seen/skipped')
+        return False
+
+    def product_request(self, url, change_signal=None, collection=None):
+        """Request a product, through its .json endpoint in json mode.
+
+        collection is the handle of the listing that linked the product, for
+        its breadcrumbs.  Returns None for a product that was already seen,
+        or that is unchanged in incremental mode.
+        """
+        url = shopify.canonical_product_url(url)
+        handle = shopify.product_handle(url)
+        if not self.mark_seen(handle):
+            return None
+        if self.is_unchanged(handle, change_signal):
+            return None
+        if not self.take_budget():
+            return None
+        if self.catalog_mode == 'json' and handle:
+            return scrapy.Request(
+                shopify.product_json_url(self.base_url, handle),
+                callback=self.parse_product_json,
+                errback=self.product_json_failed,
+                headers={'Accept': 'application/json'},
+                priority=PRODUCT_PRIORITY,
+                cb_kwargs={'html_url': url, 'change_signal': change_signal, 'collection': collection},
+            )
+        return self.product_page_request(url, change_signal, collection)
+
+    def product_page_request(self, url, change_signal=None, collection=None):
+        """Request an HTML product page, parsed in the worker pool if there is one."""
+        callback = self.parse_product if self.parse_pool is None else self.parse_product_in_pool
+        return scrapy.Request(url, callback, cb_kwargs={'change_signal': change_signal, 'collection': collection},
+                              priority=PRODUCT_PRIORITY)
+
+    async def parse_product_in_pool(self, response, change_signal=None, collection=None):
+        """Hand the page to the parse pool; the workers run parse_product."""
+        for data in await self.parse_pool.parse(response):
+            item = self.item_class(**data)
+            item['breadcrumbs'] = item.get('breadcrumbs') or shopify.collection_breadcrumbs(collection)
+            item['change_signal'] = change_signal
+            yield item
+
+    def parse_product_json(self, response, html_url, change_signal=None, collection=None):
+        """Build an item from /products/<handle>.json."""
+        try:
+            product = json.loads(response.text)['product']
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.logger.warning(f'No product JSON at {response.url}, falling back to HTML page')
+            yield self.product_page_request(html_url, change_signal, collection)
+            return
+        item = shopify.item_from_product(product, self.base_url, self.item_class, collection)
+        item['change_signal'] = change_signal
+        yield item
+
+    def product_json_failed(self, failure):
+        html_url = failure.request.cb_kwargs['html_url']
+        self.logger.warning(f'Product JSON failed for {html_url} ({failure.value!r}), falling back to HTML page')
+        yield self.product_page_request(html_url, failure.request.cb_kwargs.get('change_signal'),
+                                        failure.request.cb_kwargs.get('collection'))
     #This part of the code looks at the shopping category page finds all the product links on it, and 
     # then shows how many products it found    
-    def parse(self, response):
+    def parse(self, response, page_count=None):
+        """Parse a collection listing page.
+
+        Page 1 reads the page count from the numbered pagination and
+        schedules every remaining page at once; those pages pass page_count
+        and do not paginate further.  Without a page count the next link is
+        followed, and pagination stops at the first page without products.
+        """
         self.logger.info(f'Parsing listing page: {response.url}')
-        product_links = response.css('a[href*="/products/"]::attr(href)').getall()
-        # self.logger.info(f'Found {len(product_links)} product links on page')
-    #    Stop spider if no products are found (end of pagination)
-        if not product_links:
-            product_links = response.css('.ProductItem a::attr(href)').getall()
-        if not product_links:
-            product_links = response.css('.product-item a::attr(href)').getall()
-        if not product_links:
-            product_links = response.css('[data-product-handle] a::attr(href)').getall()
+        self.record_queue_depth()
+        if self.budget_spent:
+            return
+        page = ExtractionContext.of(response)
+        product_links = self.selector_engine.getall(page, 'listing_links', [
+            'a[href*="/products/"]::attr(href)',
+            '.ProductItem a::attr(href)',
+            '.product-item a::attr(href)',
+            '[data-product-handle] a::attr(href)'
+        ])
             
         self.logger.info(f'Found {len(product_links)} product links on page')
         
+        # Change signals from the product cards, for incremental mode
+        signals = incremental.listing_signals(page) if self.incremental else {}
         for link in product_links:
             full_url = urljoin(response.url, link)
-            yield response.follow(full_url, self.parse_product)
-        
+            request = self.product_request(full_url, signals.get(shopify.product_handle(full_url)),
+                                           shopify.collection_handle(response.url))
+            if request is not None:
+                yield request
+
+        # Navigation and the recently viewed carousel ([data-product-handle])
+        # link to products on every page, so only the product grid tells
+        # whether the collection ran out
+        grid_links = self.selector_engine.getall(page, 'listing_grid_links', [
+            '.ProductItem a::attr(href)',
+            '.product-item a::attr(href)'
+        ])
+        if not grid_links:
+            self.logger.info(f'No products on {response.url}, stopping pagination')
+            self.crawler.stats.inc_value('pagination/empty_pages')
+            return
+        if page_count is not None or self.budget_spent:
+            return
+
+        page_links = self.get_page_links(page)
+        if listing_page_number(response.url) == 1 and page_links:
+            page_count = max(page_links)
+            self.logger.info(f'{response.url} has {page_count} pages, scheduling them all')
+            self.crawler.stats.inc_value('pagination/fanned_out', page_count - 1)
+            for number in range(2, page_count + 1):
+                url = page_links.get(number) or add_or_replace_parameter(response.url, 'page', str(number))
+                yield scrapy.Request(url, self.parse, cb_kwargs={'page_count': page_count})
+            return
+
         # Handle pagination for Shopify collections
-        next_page = self.get_next_page_url(response)
+        next_page = self.get_next_page_url(page)
         if next_page:
             self.logger.info(f'Following pagination to: {next_page}')
             yield response.follow(next_page, self.parse)
+
+    def get_page_links(self, response):
+        """Map page number to URL from the numbered pagination links."""
+        links = {}
+        for item in response.css('.Pagination__NavItem, .pagination a, .pagination__item'):
+            text = ''.join(item.css('::text').getall()).strip()
+            if not text.isdigit():
+                continue
+            href = item.attrib.get('href')
+            links[int(text)] = urljoin(response.url, href) if href else None
+        return links
+
     def get_next_page_url(self, response):
         """Extract the next page URL for Shopify pagination."""
         
         # Look for Shopify pagination
-        next_link = response.css('a[aria-label="Next"]::attr(href)').get() or \
-                   response.css('a.pagination__next::attr(href)').get() or \
-                   response.css('a[rel="next"]::attr(href)').get() or \
-                   response.css('.pagination a:contains("Next")::attr(href)').get()
+        next_link = self.selector_engine.get(response, 'next_page', [
+            'a[aria-label="Next"]::attr(href)',
+            'a.pagination__next::attr(href)',
+            'a[rel="next"]::attr(href)',
+            '.pagination a:contains("Next")::attr(href)'
+        ])
         if next_link:
          return urljoin(response.url, next_link)
-        # Alternative: Look for numbered pagination
-        current_url = response.url
-        if '?page=' in current_url:
-            page_num = int(re.search(r'page=(\d+)', current_url).group(1))
-            next_page_num = page_num + 1
-        else:
-            next_page_num = 2
-        # Check if we can construct next page URL
-        base_url = current_url.split('?')[0]
-        next_url = f"{base_url}?page={next_page_num}"
-        
-        # Only return if we haven't tried too many pages
-        if next_page_num <= 50:  # Reasonable limit
-            return next_url
+        # Alternative: Look for numbered pagination.  parse() stops at the
+        # first empty page, so this costs at most one extra request
+        next_page_num = listing_page_number(response.url) + 1
+        if next_page_num <= MAX_LISTING_PAGES:
+            return add_or_replace_parameter(response.url, 'page', str(next_page_num))
         
         return None
-    def parse_product(self, response):
-        """Parse individual product pages and extract data."""
+    def parse_product(self, response, change_signal=None, collection=None):
+        """Parse individual product pages and extract data.
+
+        collection is the handle of the listing that linked the page; its
+        trail stands in for breadcrumbs the page does not show.
+        """
         
         self.logger.info(f'Parsing product: {response.url}')
         
-        item = ProductItem()
+        # Scripts, JSON-LD and product JSON are indexed once for all extractors
+        response = ExtractionContext.of(response, self.parser_backend)
+        item = self.item_class()
         
        # Extract product name with multiple selectors
-        product_name = self.extract_text_with_fallbacks(response, [
+        product_name = self.extract_text_with_fallbacks(response, 'product_name', [
             'h1.product__title::text',
             '.product-meta__title::text',
             'h1[class*="product"]::text',
@@ -120,7 +395,7 @@ class Carbon38Spider(scrapy.Spider):
         item['brand'] = brand
         
         # Extract price with multiple selectors
-        price_text = self.extract_text_with_fallbacks(response, [
+        price_text = self.extract_text_with_fallbacks(response, 'price', [
             '.price__current .money::text',
             '.product__price .money::text',
             '[data-price]::text',
@@ -149,7 +424,7 @@ class Carbon38Spider(scrapy.Spider):
         
         # Extract breadcrumbs
         breadcrumbs = self.extract_breadcrumbs(response)
-        item['breadcrumbs'] = breadcrumbs
+        item['breadcrumbs'] = breadcrumbs or shopify.collection_breadcrumbs(collection)
         
         # Extract primary image
         primary_image = self.extract_primary_image(response)
@@ -167,22 +442,22 @@ class Carbon38Spider(scrapy.Spider):
         product_id = self.extract_product_id(response)
         item['product_id'] = product_id
         
+        # Extract variants (size, colour, SKU, price, availability)
+        item['variants'] = self.extract_variants(response)
+        
         # Set product URL
         item['product_url'] = response.url
+        item['change_signal'] = change_signal
         
         yield item
-    def extract_text_with_fallbacks(self, response, selectors):
+    def extract_text_with_fallbacks(self, response, field, selectors):
          """Try multiple selectors and return the first non-empty result."""
-         for selector in selectors:
-            text = response.css(selector).get()
-            if text and text.strip():
-                return text.strip()
-         return None
+         return self.selector_engine.first(response, field, selectors)
     def extract_brand(self, response):
         """Extract brand from various sources."""
         
         # Try multiple selectors
-        brand = self.extract_text_with_fallbacks(response, [
+        brand = self.extract_text_with_fallbacks(response, 'brand', [
             '.product__vendor::text',
             '[data-vendor]::text',
             '.product-meta__vendor::text',
@@ -194,18 +469,13 @@ class Carbon38Spider(scrapy.Spider):
             return brand
         
         # Try JSON-LD structured data
-        json_ld_scripts = response.css('script[type="application/ld+json"]::text').getall()
-        for script in json_ld_scripts:
-            try:
-                data = json.loads(script)
-                if isinstance(data, dict) and 'brand' in data:
-                    brand_data = data['brand']
-                    if isinstance(brand_data, dict):
-                        return brand_data.get('name', '')
-                    else:
-                        return str(brand_data)
-            except (json.JSONDecodeError, KeyError):
-                continue
+        for data in ExtractionContext.of(response).json_ld:
+            if isinstance(data, dict) and 'brand' in data:
+                brand_data = data['brand']
+                if isinstance(brand_data, dict):
+                    return brand_data.get('name', '')
+                else:
+                    return str(brand_data)
         
         # Try to extract from breadcrumbs
         breadcrumbs = self.extract_breadcrumbs(response)
@@ -217,16 +487,18 @@ class Carbon38Spider(scrapy.Spider):
         """Extract product description with multiple approaches."""
         
         # Try getting paragraphs first
-        description_parts = response.css('.product__description p::text').getall() or \
-                           response.css('.product-single__description p::text').getall() or \
-                           response.css('.rte p::text').getall() or \
-                           response.css('.product-description p::text').getall()
+        description_parts = self.selector_engine.getall(response, 'description_parts', [
+            '.product__description p::text',
+            '.product-single__description p::text',
+            '.rte p::text',
+            '.product-description p::text'
+        ])
         
         if description_parts:
             return ' '.join(part.strip() for part in description_parts if part.strip())
         
         # Try getting full text content
-        description = self.extract_text_with_fallbacks(response, [
+        description = self.extract_text_with_fallbacks(response, 'description', [
             '.product__description::text',
             '.product-single__description::text',
             '.product-description::text',
@@ -238,13 +510,15 @@ class Carbon38Spider(scrapy.Spider):
             return description
         
         # Try meta description as fallback
-        meta_desc = response.css('meta[name="description"]::attr(content)').get()
+        meta_desc = self.selector_engine.get(response, 'meta_description', [
+            'meta[name="description"]::attr(content)',
+        ])
         return meta_desc if meta_desc else None
 
     def extract_reviews(self, response):
         """Extract review count and rating."""
         
-        reviews_text = self.extract_text_with_fallbacks(response, [
+        reviews_text = self.extract_text_with_fallbacks(response, 'reviews', [
             '.reviews-summary::text',
             '[data-reviews-count]::text',
             '.product-reviews__summary::text',
@@ -256,19 +530,12 @@ class Carbon38Spider(scrapy.Spider):
             return reviews_text
         
         # Try to find review count in scripts
-        scripts = response.css('script::text').getall()
-        for script in scripts:
-            if 'review' in script.lower():
-                review_match = re.search(r'"review_count":\s*(\d+)', script)
-                if review_match:
-                    return f"{review_match.group(1)} Reviews"
-        
-        return "0 Reviews"
+        return shopify.reviews_text(ExtractionContext.of(response).lookup('reviews'))
     def extract_colour(self, response):
         """Extract color/colour information."""
         
         # Try multiple approaches for color
-        color = self.extract_text_with_fallbacks(response, [
+        color = self.extract_text_with_fallbacks(response, 'colour', [
             '.product-form__input input[name*="Color"] + label::text',
             '.product-form__input input[name*="color"] + label::text',
             '.color-swatch.selected::attr(data-value)',
@@ -281,43 +548,41 @@ class Carbon38Spider(scrapy.Spider):
             return color
         
         # Try to extract from variant data
-        scripts = response.css('script::text').getall()
-        for script in scripts:
-            if 'color' in script.lower() or 'colour' in script.lower():
-                color_match = re.search(r'"color":\s*"([^"]+)"', script, re.IGNORECASE)
-                if color_match:
-                    return color_match.group(1)
-        
-        return None
+        return ExtractionContext.of(response).lookup('colour')
     def extract_sizes(self, response):
         """Extract available sizes."""
         
         # Try multiple selectors for sizes
-        sizes = response.css('.product-form__input input[name*="Size"] + label::text').getall() or \
-               response.css('.product-form__input input[name*="size"] + label::text').getall() or \
-               response.css('.size-selector .variant-input__radio + label::text').getall() or \
-               response.css('.product-option-size label::text').getall() or \
-               response.css('[data-size]::text').getall()
+        sizes = self.selector_engine.getall(response, 'sizes', [
+            '.product-form__input input[name*="Size"] + label::text',
+            '.product-form__input input[name*="size"] + label::text',
+            '.size-selector .variant-input__radio + label::text',
+            '.product-option-size label::text',
+            '[data-size]::text'
+        ])
         
         if sizes:
             return [s.strip() for s in sizes if s.strip()]
         
         # Try to extract from scripts
-        scripts = response.css('script::text').getall()
-        for script in scripts:
-            if 'size' in script.lower():
-                size_matches = re.findall(r'"size":\s*"([^"]+)"', script, re.IGNORECASE)
-                if size_matches:
-                    return list(set(size_matches))  # Remove duplicates
+        size_matches = ExtractionContext.of(response).lookup_all('sizes')
+        if size_matches:
+            return list(set(size_matches))  # Remove duplicates
         
         return []
+    def extract_variants(self, response):
+        """Extract every variant from the theme's product JSON."""
+        product = ExtractionContext.of(response).product_json
+        return shopify.variants_from_product(product) if product else []
     def extract_breadcrumbs(self, response):
         """Extract breadcrumbs navigation."""
         
-        breadcrumbs = response.css('.breadcrumb a::text, .breadcrumb span::text').getall() or \
-                     response.css('nav[aria-label="breadcrumb"] a::text').getall() or \
-                     response.css('.breadcrumbs a::text, .breadcrumbs span::text').getall() or \
-                     response.css('[data-breadcrumb] a::text').getall()
+        breadcrumbs = self.selector_engine.getall(response, 'breadcrumbs', [
+            '.breadcrumb a::text, .breadcrumb span::text',
+            'nav[aria-label="breadcrumb"] a::text',
+            '.breadcrumbs a::text, .breadcrumbs span::text',
+            '[data-breadcrumb] a::text'
+        ])
         
         if breadcrumbs:
             return [b.strip() for b in breadcrumbs if b.strip()]
@@ -326,11 +591,13 @@ class Carbon38Spider(scrapy.Spider):
     def extract_primary_image(self, response):
         """Extract primary product image."""
         
-        primary_image = response.css('.product__media img::attr(src)').get() or \
-                       response.css('.product-form__media img::attr(src)').get() or \
-                       response.css('img[class*="product"]::attr(src)').get() or \
-                       response.css('.product-photos img::attr(src)').get() or \
-                       response.css('.product-image img::attr(src)').get()
+        primary_image = self.selector_engine.get(response, 'primary_image', [
+            '.product__media img::attr(src)',
+            '.product-form__media img::attr(src)',
+            'img[class*="product"]::attr(src)',
+            '.product-photos img::attr(src)',
+            '.product-image img::attr(src)'
+        ])
         
         if primary_image:
             return self.clean_image_url(primary_image, response.url)
@@ -339,10 +606,12 @@ class Carbon38Spider(scrapy.Spider):
     def extract_all_images(self, response):
         """Extract all product images."""
         
-        all_images = response.css('.product__media img::attr(src)').getall() or \
-                    response.css('.product-single__photos img::attr(src)').getall() or \
-                    response.css('.product-photos img::attr(src)').getall() or \
-                    response.css('.product-images img::attr(src)').getall()
+        all_images = self.selector_engine.getall(response, 'image_urls', [
+            '.product__media img::attr(src)',
+            '.product-single__photos img::attr(src)',
+            '.product-photos img::attr(src)',
+            '.product-images img::attr(src)'
+        ])
         
         processed_images = []
         for img in all_images:
@@ -368,7 +637,7 @@ class Carbon38Spider(scrapy.Spider):
     def extract_sku(self, response):
         """Extract SKU from various sources."""
         
-        sku = self.extract_text_with_fallbacks(response, [
+        sku = self.extract_text_with_fallbacks(response, 'sku', [
             '.product__sku::text',
             '[data-sku]::text',
             '.variant-sku::text',
@@ -383,21 +652,14 @@ class Carbon38Spider(scrapy.Spider):
     def extract_sku_from_json(self, response):
         """Extract SKU from JSON product data."""
         
-        scripts = response.css('script::text').getall()
-        for script in scripts:
-            if 'sku' in script.lower():
-                try:
-                    sku_match = re.search(r'"sku":\s*"([^"]+)"', script, re.IGNORECASE)
-                    if sku_match:
-                        return sku_match.group(1)
-                except:
-                    continue
-        return None
+        return ExtractionContext.of(response).lookup('sku')
     def extract_product_id(self, response):
         """Extract product ID from various sources."""
         
         # Try data attributes first
-        product_id = response.css('[data-product-id]::attr(data-product-id)').get()
+        product_id = self.selector_engine.get(response, 'product_id', [
+            '[data-product-id]::attr(data-product-id)',
+        ])
         if product_id:
             return product_id
         
@@ -413,22 +675,7 @@ class Carbon38Spider(scrapy.Spider):
                 pass
         
         # Try to extract from script tags
-        scripts = response.css('script::text').getall()
-        for script in scripts:
-            # Look for various ID patterns
-            id_patterns = [
-                r'"product_id":\s*(\d+)',
-                r'"id":\s*(\d+)',
-                r'"productId":\s*"([^"]+)"',
-                r'"handle":\s*"([^"]+)"'
-            ]
-            
-            for pattern in id_patterns:
-                id_match = re.search(pattern, script)
-                if id_match:
-                    return id_match.group(1)
-        
-        return None
+        return ExtractionContext.of(response).lookup('product_id')
     def extract_brand_from_breadcrumbs(self, breadcrumbs):
         """Extract brand name from breadcrumbs if available."""
         
@@ -446,4 +693,34 @@ class Carbon38Spider(scrapy.Spider):
         if len(breadcrumbs) > 1:
             return breadcrumbs[-2]  # Usually brand is second to last
         
-        return None
\ No newline at end of file
+        return None
+    def spider_opened(self, spider):
+        """Send selector hit/miss counts and parse pool counters to the crawl stats."""
+        self.selector_engine.stats = self.crawler.stats
+        self.crawler.stats.set_value('seen/loaded', len(self.seen_handles.stored))
+        if self.incremental:
+            self.crawler.stats.set_value('incremental/known', len(self.known_signals))
+        if self.parse_pool is not None:
+            self.parse_pool.stats = self.crawler.stats
+
+    def item_scraped(self, item, response, spider):
+        """Count the item against the budget and remember it for the next run."""
+        self.item_count += 1
+        self.crawler.stats.set_value('budget/items', self.item_count)
+        if self.max_items and self.item_count == self.max_items:
+            # Drop listing pages still queued; they cannot add anything
+            self.logger.info(f'Scraped {self.item_count} items, closing spider')
+            deferred_from_coro(self.crawler.engine.close_spider_async(reason='item_budget'))
+        handle = shopify.product_handle(item.get('product_url') or '')
+        if handle:
+            self.seen_handles.mark_done(handle)
+
+    def closed(self, reason):
+        """Save the seen-set, shut down the parse pool and log dead selectors."""
+        self.seen_handles.save()
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+        for field, chain in self.selector_engine.chains.items():
+            dead = [selector for selector, hits in chain.report() if not hits]
+            if dead and chain.calls:
+                self.logger.info(f'Selectors for {field} that never matched in {chain.calls} pages: {dead}')
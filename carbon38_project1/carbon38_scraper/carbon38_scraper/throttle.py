@@ -0,0 +1,119 @@
+# Adaptive per-slot concurrency and delay.
+#
+# Every downloader slot (one per host, plus the images slot) gets a
+# SlotController.  Responses are gathered into windows of window_size
+# responses or window_seconds, whichever ends first, and each window ends
+# in one decision:
+#
+#   backoff   errors (429, 503, timeouts, connection failures) above the
+#             error budget: halve concurrency, double the delay
+#   slow      mean latency above target_latency: one request less, or at
+#             min_concurrency a delay of at least the latency
+#   speed up  healthy and below target_rps (0: no target): shorten the delay
+#             by a quarter, then once it reaches min_delay add a request
+#   hold      healthy and at target_rps
+#
+# A Retry-After header applies at once: the delay becomes at least the
+# requested wait and nothing speeds up again until it has passed.  This is
+# additive increase, multiplicative decrease, so a slot converges on the
+# fastest pace the server tolerates.
+
+import time
+from email.utils import parsedate_to_datetime
+
+ERROR_STATUSES = frozenset({429, 503})
+
+
+def retry_after_seconds(value, now=None):
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode('latin-1')
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - (time.time() if now is None else now))
+
+
+class SlotController:
+    """Concurrency and delay of one downloader slot."""
+
+    def __init__(self, concurrency, delay, min_concurrency=1, max_concurrency=16,
+                 min_delay=0.0, max_delay=60.0, target_latency=1.0, target_rps=0.0,
+                 error_budget=0.02, window_size=20, window_seconds=10.0):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.target_latency = target_latency
+        self.target_rps = target_rps
+        self.error_budget = error_budget
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.hold_until = 0.0
+        self.rps = 0.0
+        self.start_window(time.monotonic())
+
+    def start_window(self, now):
+        self.window_start = now
+        self.window_delay = self.delay
+        self.responses = 0
+        self.errors = 0
+        self.latency = 0.0
+
+    def record(self, latency=None, error=False, retry_after=None, now=None):
+        """Count one response; return the decision if it closed a window."""
+        now = time.monotonic() if now is None else now
+        self.responses += 1
+        self.errors += bool(error)
+        if latency is not None:
+            self.latency += latency
+        if retry_after is not None:
+            self.delay = min(self.max_delay, max(self.delay, retry_after))
+            self.hold_until = max(self.hold_until, now + retry_after)
+        if self.responses < self.window_size and now - self.window_start < self.window_seconds:
+            return None
+        return self.decide(now)
+
+    def decide(self, now):
+        elapsed = max(now - self.window_start, 1e-6)
+        self.rps = self.responses / elapsed
+        error_rate = self.errors / self.responses
+        latency = self.latency / max(self.responses - self.errors, 1)
+        if error_rate > self.error_budget:
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+            # Double the pace of the window; a Retry-After may already ask for more
+            self.delay = min(self.max_delay, max(self.window_delay * 2, self.delay, self.min_delay, 0.25))
+            decision = 'backoff'
+        elif latency > self.target_latency:
+            if self.concurrency > self.min_concurrency:
+                self.concurrency -= 1
+            else:
+                # Already one at a time: no faster than one request per latency
+                self.delay = min(self.max_delay, max(self.delay, latency))
+            decision = 'slow'
+        elif now < self.hold_until or (self.target_rps and self.rps >= self.target_rps):
+            decision = 'hold'
+        elif self.delay > self.min_delay:
+            self.delay = max(self.min_delay, self.delay * 0.75)
+            if self.delay < 0.05:
+                self.delay = self.min_delay
+            decision = 'speed_up'
+        elif self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+            decision = 'speed_up'
+        else:
+            decision = 'hold'
+        self.start_window(now)
+        return decision
+
+    def apply(self, slot):
+        slot.concurrency = self.concurrency
+        slot.delay = self.delay
@@ -0,0 +1,104 @@
+# Cuts what no extractor reads out of HTML pages.
+#
+# A carbon38.com product page is ~1.7 MB: 950 KB of inline scripts (one of
+# them a 650 KB copy of the whole collection), 200 KB of inline SVG icons,
+# stylesheets and <link> preloads.  The spider reads markup, JSON-LD, the
+# product JSON and a handful of regex lookups in scripts, so trim_html()
+# drops
+#
+#   <script> blocks, except JSON-LD, product JSON, card data and the first
+#            script each of the extractors' script lookups would match
+#   <style>, <svg>, <link> and comments
+#
+# and keeps everything else byte for byte, including <template> contents
+# and whitespace, so every selector sees the same elements and text nodes.
+# `scrapy replay --trim-parity` checks that trimmed and untrimmed pages give
+# the same items and requests.
+
+import gzip
+import re
+import zlib
+
+from carbon38_scraper.extraction import SCRIPT_LOOKUPS
+
+# Scripts the spider reads as a whole: JSON-LD and the theme's product JSON
+# (ExtractionContext), the product card data (incremental.listing_signals)
+KEPT_SCRIPTS = (b'application/ld+json', b'data-product-json', b'data-product-data')
+
+# extraction.SCRIPT_LOOKUPS as bytes, with each needle lower-cased for the
+# lower-cased page.  Each lookup uses the first script that matches, so
+# only that script has to survive.
+_LOOKUPS = tuple(
+    tuple((needle.lower().encode(), re.compile(pattern.encode(), flags)) for pattern, needle, flags in patterns)
+    for patterns in SCRIPT_LOOKUPS.values()
+)
+
+# Matched against the lower-cased page; the end of each element is found
+# with bytes.find, which is much cheaper than a lazy regex over the ~1 MB
+# of script text
+_OPENING = re.compile(rb'<(script|style|svg)\b[^>]*>|<!--|<link\b[^>]*>')
+_CLOSING = {b'script': b'</script', b'style': b'</style', b'svg': b'</svg'}
+
+
+def _script_wanted(body, lowered, opening, start, end, pending):
+    """Whether the script body[start:end] must be kept; updates pending."""
+    if any(marker in opening for marker in KEPT_SCRIPTS):
+        return True
+    matched = [lookup for lookup in pending
+               if any(lowered.find(needle, start, end) >= 0 and regex.search(body, start, end)
+                      for needle, regex in lookup)]
+    for lookup in matched:
+        pending.remove(lookup)
+    return bool(matched)
+
+
+def trim_html(body):
+    """body without the scripts, styles, SVG, links and comments nothing reads."""
+    lowered = body.lower()
+    pending = list(_LOOKUPS)
+    parts = []
+    position = 0
+    match = _OPENING.search(lowered)
+    while match:
+        start = match.start()
+        tag = match.group(1)
+        if tag is None and match.group(0) == b'<!--':
+            close = lowered.find(b'-->', match.end())
+            end = len(body) if close < 0 else close + 3
+        elif tag is None:  # <link>
+            end = match.end()
+        else:
+            close = lowered.find(_CLOSING[tag], match.end())
+            if close < 0:
+                # Unclosed element: leave the rest of the page alone
+                break
+            end = lowered.find(b'>', close)
+            end = len(body) if end < 0 else end + 1
+            if tag == b'script' and _script_wanted(body, lowered, match.group(0), match.end(), close, pending):
+                match = _OPENING.search(lowered, end)
+                continue
+        parts.append(body[position:start])
+        position = end
+        match = _OPENING.search(lowered, end)
+    parts.append(body[position:])
+    return b''.join(parts)
+
+
+def decode_body(body, headers):
+    """Undo Content-Encoding the way HttpCompressionMiddleware would."""
+    for encoding in reversed(headers.getlist('Content-Encoding')):
+        encoding = encoding.strip().lower()
+        if encoding in (b'gzip', b'x-gzip'):
+            body = gzip.decompress(body)
+        elif encoding == b'deflate':
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+        elif encoding == b'br':
+            import brotli
+            body = brotli.decompress(body)
+        elif encoding != b'identity':
+            raise ValueError(f'unsupported Content-Encoding {encoding!r}')
+    headers.pop('Content-Encoding', None)
+    return body
@@ -0,0 +1,36 @@
+import gzip
+from pathlib import Path
+
+import pytest
+from itemadapter import ItemAdapter, is_item
+from scrapy.http import HtmlResponse
+
+from carbon38_scraper.spiders.carbon38 import Carbon38Spider
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+# carbon38.com product pages, cut down to what the extractors read plus some
+# of the scripts, styles and SVG trimming drops; named after their handle
+PAGES = sorted((FIXTURES / 'pages').glob('*.html.gz'))
+
+
+def load_page(path):
+    handle = path.name.split('.')[0]
+    return HtmlResponse(f'https://carbon38.com/products/{handle}',
+                        body=gzip.decompress(path.read_bytes()), encoding='utf-8')
+
+
+def parse_product(response, backend='lxml', collection=None):
+    """Items of Carbon38Spider.parse_product as dicts, without scraped_at."""
+    spider = Carbon38Spider()
+    spider.parser_backend = backend
+    items = [ItemAdapter(result).asdict() for result in spider.parse_product(response, collection=collection)
+             if is_item(result)]
+    for item in items:
+        item.pop('scraped_at', None)
+    return items
+
+
+@pytest.fixture(params=PAGES, ids=lambda path: path.name.split('.')[0])
+def product_page(request):
+    return load_page(request.param)
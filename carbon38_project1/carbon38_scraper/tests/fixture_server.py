@@ -0,0 +1,121 @@
+"""A stand-in for the carbon38.com storefront, for tests and local crawls.
+
+    python tests/fixture_server.py [PORT] [PRODUCTS]
+    scrapy crawl carbon38 -s CARBON38_BASE_URL=http://127.0.0.1:8765 -s HTTPCACHE_ENABLED=0
+
+Every collection lists the same PRODUCTS generated products through
+/collections/<handle>/products.json and /products/<handle>.json, like
+Shopify's JSON endpoints.  Collections named in `missing` answer 404 on
+products.json and list the pages in fixtures/pages in HTML instead; those
+products have no .json endpoint either, so they are scraped from HTML.
+"""
+
+import gzip
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+PAGES = Path(__file__).parent / 'fixtures' / 'pages'
+
+
+def product(number):
+    """products.json entry of generated product number: two sizes, one sold out."""
+    return {
+        'id': 1000 + number,
+        'title': f'Item {number} - Black',
+        'handle': f'item-{number}',
+        'body_html': '<p>Soft &amp; light</p>',
+        'vendor': 'ALO',
+        'product_type': 'TOPS',
+        'updated_at': '2025-06-01T00:00:00-07:00',
+        'variants': [
+            {'id': 1, 'sku': f'SKU-{number}-XS', 'price': '57.00', 'available': False,
+             'option1': 'Black', 'option2': 'XS'},
+            {'id': 2, 'sku': f'SKU-{number}-S', 'price': '57.00', 'available': True,
+             'option1': 'Black', 'option2': 'S'},
+        ],
+        'options': [{'name': 'Color', 'values': ['Black']}, {'name': 'Size', 'values': ['XS', 'S']}],
+        'images': [{'src': f'//cdn.shopify.com/s/files/item-{number}.jpg?v=1'}],
+    }
+
+
+def page_handles():
+    return sorted(path.name.split('.')[0] for path in PAGES.glob('*.html.gz'))
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        store = self.server.store
+        if len(parts) == 3 and parts[0] == 'collections' and parts[2] == 'products.json':
+            if parts[1] in store.missing:
+                return self.send(404)
+            limit = int(query.get('limit', ['30'])[0])
+            page = int(query.get('page', ['1'])[0])
+            numbers = range((page - 1) * limit, min(page * limit, store.products))
+            return self.send(200, json.dumps({'products': [product(n) for n in numbers]}), 'application/json')
+        if len(parts) == 2 and parts[0] == 'collections':
+            # Only the first page lists products, so pagination stops at page 2
+            handles = page_handles() if query.get('page', ['1']) == ['1'] else []
+            cards = ''.join(f'<div class="ProductItem"><a href="/products/{handle}">{handle}</a></div>'
+                            for handle in handles)
+            return self.send(200, f'<html><body>{cards}</body></html>', 'text/html; charset=utf-8')
+        if len(parts) == 2 and parts[0] == 'products' and parts[1].endswith('.json'):
+            handle = parts[1][:-5]
+            if not handle.startswith('item-') or not handle[5:].isdigit():
+                return self.send(404)
+            return self.send(200, json.dumps({'product': product(int(handle[5:]))}), 'application/json')
+        if len(parts) == 2 and parts[0] == 'products' and (PAGES / f'{parts[1]}.html.gz').exists():
+            body = gzip.decompress((PAGES / f'{parts[1]}.html.gz').read_bytes())
+            return self.send(200, body, 'text/html; charset=utf-8')
+        self.send(404)
+
+    def send(self, status, body=b'', content_type='text/plain'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """The fixture store on 127.0.0.1, served from a background thread."""
+
+    def __init__(self, port=0, products=600, missing=()):
+        self.products = products
+        self.missing = set(missing)
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.store = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fixture-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    products = int(sys.argv[2]) if len(sys.argv) > 2 else 600
+    server = FixtureServer(port, products)
+    print(f'Serving {products} products on {server.url}', flush=True)
+    server.httpd.serve_forever()
@@ -0,0 +1,82 @@
+import sqlite3
+import time
+
+import pytest
+
+from carbon38_scraper.dbwriter import BatchWriter, WriterStopped
+
+INSERT_SQL = 'INSERT INTO rows (name, value) VALUES (?, ?)'
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'rows.db'
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE rows (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+    connection.close()
+    return str(path)
+
+
+def stored(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute('SELECT name, value FROM rows ORDER BY name').fetchall()
+    finally:
+        connection.close()
+
+
+def test_close_flushes_the_partial_batch(path):
+    # Neither the batch size nor the flush interval is reached before close()
+    writer = BatchWriter(path, batch_size=500, flush_interval=60)
+    writer.start()
+    for number in range(3):
+        writer.put(INSERT_SQL, (f'row-{number}', number))
+    writer.close()
+    assert stored(path) == [('row-0', 0), ('row-1', 1), ('row-2', 2)]
+    assert (writer.written, writer.batches, writer.errors) == (3, 1, 0)
+    assert not writer.is_alive()
+
+
+def test_failed_row_does_not_lose_the_rest_of_its_batch(path):
+    writer = BatchWriter(path, batch_size=500, flush_interval=60)
+    writer.start()
+    writer.put(INSERT_SQL, ('a', 1))
+    # NOT NULL violation fails the executemany, then this row alone
+    writer.put(INSERT_SQL, ('b', None))
+    writer.put(INSERT_SQL, ('c', 3))
+    writer.put('UPDATE rows SET value = ? WHERE name = ?', (30, 'c'))
+    writer.close()
+    assert stored(path) == [('a', 1), ('c', 30)]
+    assert (writer.written, writer.errors) == (3, 1)
+    assert writer.error is None
+
+
+def test_put_raises_once_the_thread_has_died(tmp_path):
+    writer = BatchWriter(str(tmp_path / 'missing' / 'rows.db'), max_queue=1)
+    writer.start()
+    writer.join(timeout=10)
+    assert not writer.is_alive()
+    assert isinstance(writer.error, sqlite3.OperationalError)
+    start = time.monotonic()
+    for _ in range(3):
+        with pytest.raises(WriterStopped):
+            writer.put(INSERT_SQL, ('a', 1))
+    # Raised straight away, not after waiting on the full queue
+    assert time.monotonic() - start < 1
+    with pytest.raises(WriterStopped):
+        writer.close()
+
+
+def test_put_raises_when_the_thread_dies_with_a_full_queue(path):
+    class FailingWriter(BatchWriter):
+        def _write(self, connection, batch):
+            raise MemoryError('simulated')
+
+    writer = FailingWriter(path, batch_size=1, flush_interval=0, max_queue=2)
+    writer.start()
+    with pytest.raises(WriterStopped) as raised:
+        for number in range(100):
+            writer.put(INSERT_SQL, (f'row-{number}', number))
+    assert isinstance(raised.value.__cause__, MemoryError)
+    with pytest.raises(WriterStopped):
+        writer.close()
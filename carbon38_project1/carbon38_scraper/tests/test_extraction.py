@@ -0,0 +1,38 @@
+from scrapy.http import HtmlResponse
+
+from carbon38_scraper.extraction import SelectorChain
+
+
+def page(body):
+    return HtmlResponse('https://carbon38.com/products/test', body=body.encode(), encoding='utf-8')
+
+
+def test_hit_counts_do_not_reorder_matching_selectors():
+    chain = SelectorChain('brand', ['.vendor-a::text', '.vendor-b::text'], warmup=3)
+    for _ in range(10):
+        assert chain.first(page('<p class="vendor-b">B</p>')) == 'B'
+    chain.first(page('<p class="vendor-a">A</p>'))
+    # The second selector hit ten times more often, the first still wins
+    assert chain.first(page('<p class="vendor-a">A</p><p class="vendor-b">B</p>')) == 'A'
+
+
+def test_never_matching_selectors_are_tried_last():
+    chain = SelectorChain('brand', ['.dead::text', '.vendor::text', '.other::text'], warmup=3)
+    for _ in range(3):
+        chain.first(page('<p class="vendor">V</p>'))
+    assert [css for css, _ in chain.report()] == ['.vendor::text', '.dead::text', '.other::text']
+    # Still consulted when nothing else matches
+    assert chain.first(page('<p class="dead">D</p>')) == 'D'
+    # and back in declared order once it has matched
+    assert [css for css, _ in chain.report()] == ['.dead::text', '.vendor::text', '.other::text']
+
+
+def test_same_output_whatever_the_hit_counts():
+    selectors = ['.title-a::text', '.title-b::text', '.title-c::text']
+    pages = [page(f'<h1 class="title-{a}">{a}</h1><h1 class="title-{b}">{b}</h1>')
+             for a, b in [('a', 'b'), ('b', 'c'), ('a', 'c')]]
+    fresh = SelectorChain('title', selectors, warmup=1)
+    seasoned = SelectorChain('title', selectors, warmup=1)
+    for name in 'cbacccccccccc':
+        seasoned.first(page(f'<h1 class="title-{name}">{name}</h1>'))
+    assert [seasoned.first(p) for p in pages] == [fresh.first(p) for p in pages] == ['a', 'b', 'a']
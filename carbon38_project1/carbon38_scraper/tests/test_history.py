@@ -0,0 +1,160 @@
+import logging
+import sqlite3
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from carbon38_scraper import catalog, history
+from carbon38_scraper.pipelines import DatabasePipeline
+
+A = 'https://carbon38.com/products/a'
+B = 'https://carbon38.com/products/b'
+T1, T2, T3, T4 = '2025-06-01T10:00:00', '2025-06-02T10:00:00', '2025-06-03T10:00:00', '2025-06-04T10:00:00'
+
+
+def unix(scraped_at):
+    # scraped_at is local time, as DatabasePipeline stores it
+    return int(datetime.fromisoformat(scraped_at).timestamp())
+
+
+def create_database(path):
+    """The tables and triggers as the crawl creates them."""
+    pipeline = DatabasePipeline(str(path))
+    pipeline.open_spider(SimpleNamespace(logger=logging.getLogger('test')))
+    pipeline.writer.close()
+    connection = sqlite3.connect(path)
+    # As BatchWriter sets it: REPLACE must fire the delete triggers
+    connection.execute('PRAGMA recursive_triggers=ON')
+    return connection
+
+
+def scrape(connection, url, scraped_at, *variants):
+    """Store a product the way DatabasePipeline does; variants are (size, price, available)."""
+    item = {
+        'product_url': url,
+        'variants': [{'variant_id': f'{url}#{size}', 'size': size, 'price': price, 'available': available}
+                     for size, price, available in variants],
+    }
+    with connection:
+        connection.execute(DatabasePipeline.INSERT_SQL, (
+            url.rsplit('/', 1)[1], 'ALO', variants[0][1], None, url, None, 0, None, '[]', '[]', None, '[]',
+            url, scraped_at, None, None))
+        for sql, params in catalog.statements(item):
+            connection.execute(sql, params)
+
+
+def rows(connection):
+    return connection.execute('''
+        SELECT s.product_url, s.variant, h.observed_at, h.price_cents, h.available, h.change_cents
+        FROM price_history h JOIN price_series s ON s.id = h.series
+        ORDER BY h.observed_at, s.id
+    ''').fetchall()
+
+
+def series(connection, url, size):
+    return connection.execute(
+        'SELECT current_cents, current_available, lowest_cents, lowest_at, changed_at FROM price_series '
+        'WHERE product_url = ? AND variant = ?', (url, f'{url}#{size}')).fetchone()
+
+
+@pytest.fixture
+def connection(tmp_path):
+    connection = create_database(tmp_path / 'products.db')
+    yield connection
+    connection.close()
+
+
+def test_first_scrape_records_one_row_per_variant(connection):
+    scrape(connection, A, T1, ('S', 100.0, True), ('M', 100.0, True))
+    assert rows(connection) == [
+        (A, f'{A}#S', unix(T1), 10000, 1, None),
+        (A, f'{A}#M', unix(T1), 10000, 1, None),
+    ]
+
+
+def test_unchanged_rescrape_adds_no_rows(connection):
+    scrape(connection, A, T1, ('S', 100.0, True), ('M', 100.0, True))
+    scrape(connection, A, T2, ('S', 100.0, True), ('M', 100.0, True))
+    assert len(rows(connection)) == 2
+    # The REPLACE still swapped the variant rows over to the new products row
+    assert connection.execute('SELECT COUNT(*) FROM variants').fetchone()[0] == 2
+
+
+def test_price_change_adds_one_row_with_the_difference(connection):
+    scrape(connection, A, T1, ('S', 100.0, True), ('M', 100.0, True))
+    scrape(connection, A, T2, ('S', 79.99, True), ('M', 100.0, True))
+    assert rows(connection)[2:] == [(A, f'{A}#S', unix(T2), 7999, 1, -2001)]
+
+
+def test_availability_change_adds_a_row_without_price_difference(connection):
+    scrape(connection, A, T1, ('S', 100.0, True))
+    scrape(connection, A, T2, ('S', 100.0, False))
+    assert rows(connection)[1:] == [(A, f'{A}#S', unix(T2), 10000, 0, 0)]
+
+
+def test_lowest_price_follows_the_minimum(connection):
+    scrape(connection, A, T1, ('S', 100.0, True))
+    assert series(connection, A, 'S') == (10000, 1, 10000, unix(T1), unix(T1))
+    scrape(connection, A, T2, ('S', 80.0, True))
+    assert series(connection, A, 'S') == (8000, 1, 8000, unix(T2), unix(T2))
+    # Back up: the lowest stays where it was
+    scrape(connection, A, T3, ('S', 90.0, True))
+    assert series(connection, A, 'S') == (9000, 1, 8000, unix(T2), unix(T3))
+    # Equal to the lowest is not a new lowest
+    scrape(connection, A, T4, ('S', 80.0, True))
+    assert series(connection, A, 'S') == (8000, 1, 8000, unix(T2), unix(T4))
+
+
+def several_scrapes(connection):
+    scrape(connection, A, T1, ('S', 100.0, True), ('M', 100.0, True))
+    scrape(connection, B, T1, ('S', 50.0, True))
+    scrape(connection, A, T2, ('S', 100.0, True), ('M', 100.0, True))
+    scrape(connection, A, T3, ('S', 80.0, True), ('M', 100.0, True))
+    scrape(connection, A, T4, ('S', 90.0, True), ('M', 100.0, False))
+    scrape(connection, B, T4, ('S', 50.0, True))
+
+
+def test_changes_query(connection):
+    several_scrapes(connection)
+    sql = history.CHANGES_SQL.format(after='')
+    changes = [row[1:7] for row in connection.execute(sql, (unix(T1), 10))]
+    assert changes == [
+        # Newest first; first observations are not changes
+        (A, f'{A}#M', unix(T4), 10000, 0, 10000),
+        (A, f'{A}#S', unix(T4), 9000, 1, 8000),
+        (A, f'{A}#S', unix(T3), 8000, 1, 10000),
+    ]
+    assert [row[3] for row in connection.execute(sql, (unix(T4), 10))] == [unix(T4), unix(T4)]
+
+
+def test_lowest_query(connection):
+    several_scrapes(connection)
+    sql = history.LOWEST_SQL.format(where='', having='')
+    lowest = [row[:6] for row in connection.execute(sql, (10,))]
+    assert lowest == [
+        # Cheapest variant now, lowest of any variant, when that was
+        (A, 9000, 8000, unix(T3), unix(T4), 1),
+        (B, 5000, 5000, unix(T1), unix(T1), 1),
+    ]
+    at_lowest = history.LOWEST_SQL.format(where='', having='HAVING MIN(s.current_cents) <= MIN(s.lowest_cents)')
+    assert [row[0] for row in connection.execute(at_lowest, (10,))] == [B]
+
+
+def test_new_tables_are_seeded_from_the_stored_variants(tmp_path, monkeypatch):
+    # A database from before the history tables
+    with monkeypatch.context() as patch:
+        patch.setattr(history, 'ensure_history_tables', lambda connection: False)
+        connection = create_database(tmp_path / 'products.db')
+    scrape(connection, A, T1, ('S', 100.0, True), ('M', 120.0, None))
+    assert not history.has_history_tables(connection)
+    assert history.ensure_history_tables(connection)
+    assert rows(connection) == [
+        (A, f'{A}#S', unix(T1), 10000, 1, None),
+        (A, f'{A}#M', unix(T1), 12000, None, None),
+    ]
+    assert not history.ensure_history_tables(connection)
+    # The trigger takes over from the seed
+    scrape(connection, A, T2, ('S', 100.0, True), ('M', 110.0, None))
+    assert rows(connection)[2:] == [(A, f'{A}#M', unix(T2), 11000, None, -1000)]
+    connection.close()
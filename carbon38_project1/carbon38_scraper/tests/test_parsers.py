@@ -0,0 +1,48 @@
+import pytest
+from scrapy.http import HtmlResponse
+
+from carbon38_scraper.extraction import BACKENDS, ExtractionContext
+
+from conftest import parse_product
+
+pytest.importorskip('selectolax.lexbor')
+
+# Markup the two parsers could read differently: entities, nested and
+# stray text, attribute values, unclosed tags
+EDGE_PAGE = HtmlResponse('https://carbon38.com/products/edge', encoding='utf-8', body='''<html><head>
+<meta name="description" content="Soft &amp; light &mdash; 4-way stretch">
+<script type="application/ld+json">{"@type": "Product", "name": "Edge Tee", "brand": {"name": "ALO"}}</script>
+</head><body>
+<h1 class="product__title">  Edge &amp; Tee <span>Top</span>  </h1>
+<div class="product__vendor">ALO</div>
+<p class="product__description">Line one<br>Line two<li>stray item</p>
+<div class="product-form__input"><input name="Size" id="s"><label for="s">XS</label>
+<input name="Size" id="m"><label for="m"> M </label></div>
+<img class="product__media" src="//cdn.shopify.com/s/files/edge.jpg?v=1&amp;width=100">
+</body></html>'''.encode())
+
+
+def test_backends_give_the_same_item(product_page):
+    items = parse_product(product_page, 'lxml')
+    assert items and items[0]['product_name']
+    assert parse_product(product_page, 'lexbor') == items
+
+
+def test_backends_agree_on_edge_cases():
+    assert parse_product(EDGE_PAGE, 'lexbor') == parse_product(EDGE_PAGE, 'lxml')
+
+
+@pytest.mark.parametrize('css', [
+    'h1.product__title::text',
+    '.product__description::text',
+    '.product-form__input input[name*="Size"] + label::text',
+    'img.product__media::attr(src)',
+    'meta[name="description"]::attr(content)',
+])
+def test_backends_return_the_same_values(css):
+    values = {}
+    for backend in sorted(BACKENDS):
+        document = ExtractionContext.of(EDGE_PAGE, backend).document
+        values[backend] = [document.value(node) for node in document.query(document.compile(css))]
+    assert values['lexbor'] == values['lxml']
+    assert values['lxml']
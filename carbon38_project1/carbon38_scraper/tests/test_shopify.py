@@ -0,0 +1,83 @@
+import pytest
+
+from carbon38_scraper import shopify
+from carbon38_scraper.extraction import ExtractionContext
+
+from conftest import parse_product
+from fixture_server import product
+
+
+def test_item_from_product():
+    item = shopify.item_from_product(product(7), 'https://carbon38.com/', collection='sports-bras')
+    assert item['product_name'] == 'Item 7 - Black'
+    assert item['brand'] == 'ALO'
+    assert item['product_id'] == '1007'
+    # The first variant that is in stock, as the product page preselects it
+    assert item['sku'] == 'SKU-7-S'
+    assert item['price'] == '57.00'
+    assert item['description'] == 'Soft & light'
+    assert item['reviews'] == '0 Reviews'
+    assert item['colour'] == 'Black'
+    assert item['sizes'] == ['XS', 'S']
+    assert item['breadcrumbs'] == ['Home', 'Sports Bras']
+    assert item['primary_image_url'] == 'https://cdn.shopify.com/s/files/item-7.jpg?v=1'
+    assert item['image_urls'] == ['https://cdn.shopify.com/s/files/item-7.jpg?v=1']
+    assert item['product_url'] == 'https://carbon38.com/products/item-7'
+    assert [variant['sku'] for variant in item['variants']] == ['SKU-7-XS', 'SKU-7-S']
+
+
+def test_item_from_product_without_variants_or_images():
+    item = shopify.item_from_product({'id': 5, 'title': 'Bare', 'handle': 'bare'}, 'https://carbon38.com')
+    assert item['price'] is None and item['sku'] is None
+    assert item['primary_image_url'] is None and item['image_urls'] == []
+    assert item['sizes'] == [] and item['variants'] == []
+    assert item['breadcrumbs'] == []
+
+
+@pytest.mark.parametrize('metafields, count', [
+    ([{'namespace': 'reviews', 'key': 'rating_count', 'value': '12'}], 12),
+    ({'judgeme.review_count': 3}, 3),
+    ({'reviews.rating_count': {'value': 7}}, 7),
+    ({'reviews.rating_count': 'n/a', 'yotpo.reviews_count': '4'}, 4),
+    ({}, None),
+    (None, None),
+])
+def test_review_count_from_metafields(metafields, count):
+    assert shopify.review_count({'metafields': metafields}) == count
+    assert shopify.item_from_product({'metafields': metafields}, 'https://carbon38.com')['reviews'] == \
+        f'{count or 0} Reviews'
+
+
+def test_json_and_html_paths_agree_on_reviews_and_breadcrumbs(product_page):
+    # The theme embeds the product JSON in the page: the same product, both paths
+    data = ExtractionContext.of(product_page).product_json
+    from_json = shopify.item_from_product(data, 'https://carbon38.com', collection='tops')
+    [from_html] = parse_product(product_page, collection='tops')
+    assert from_json['breadcrumbs'] == from_html['breadcrumbs'] == ['Home', 'Tops']
+    assert from_json['reviews'] == from_html['reviews']
+
+
+def test_variants_from_json_endpoint():
+    assert shopify.variants_from_product(product(7)) == [
+        {'variant_id': '1', 'sku': 'SKU-7-XS', 'size': 'XS', 'colour': 'Black', 'price': 57.0, 'available': False},
+        {'variant_id': '2', 'sku': 'SKU-7-S', 'size': 'S', 'colour': 'Black', 'price': 57.0, 'available': True},
+    ]
+
+
+def test_variants_from_theme_product_json():
+    # .js and the theme's product JSON: option names only, prices in cents,
+    # and the size option first
+    data = {
+        'options': ['Size', 'Colour'],
+        'variants': [{'id': 11, 'sku': '', 'price': 12800, 'available': 1, 'option1': 'M', 'option2': 'Sand'}],
+    }
+    assert shopify.variants_from_product(data) == [
+        {'variant_id': '11', 'sku': None, 'size': 'M', 'colour': 'Sand', 'price': 128.0, 'available': True},
+    ]
+
+
+def test_variants_without_availability_or_options():
+    data = {'variants': [{'id': 3, 'price': 'n/a'}, 'not a variant']}
+    assert shopify.variants_from_product(data) == [
+        {'variant_id': '3', 'sku': None, 'size': None, 'colour': None, 'price': None, 'available': None},
+    ]
@@ -0,0 +1,131 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+import scrapy
+from scrapy.http import Response, TextResponse
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.test import get_crawler
+from twisted.python.failure import Failure
+
+from carbon38_scraper.spiders.carbon38 import Carbon38Spider
+
+from fixture_server import FixtureServer, page_handles, product
+
+PROJECT = Path(__file__).parent.parent
+
+
+def make_spider(**settings):
+    crawler = get_crawler(Carbon38Spider, {'CARBON38_TIMING': False, **settings})
+    return Carbon38Spider.from_crawler(crawler)
+
+
+def catalog_response(spider, handle, page, products):
+    request = spider.catalog_request(handle, page)
+    body = json.dumps({'products': products}).encode()
+    return TextResponse(request.url, body=body, encoding='utf-8', request=request)
+
+
+def parse_catalog(spider, handle, page, products):
+    response = catalog_response(spider, handle, page, products)
+    return list(spider.parse_catalog(response, **response.request.cb_kwargs))
+
+
+def test_parse_catalog_requests_the_next_page_after_a_full_one():
+    spider = make_spider(CARBON38_CATALOG_PAGE_SIZE=3)
+    results = parse_catalog(spider, 'tops', 1, [product(n) for n in range(3)])
+    items = [r for r in results if not isinstance(r, scrapy.Request)]
+    requests = [r for r in results if isinstance(r, scrapy.Request)]
+    assert [item['sku'] for item in items] == ['SKU-0-S', 'SKU-1-S', 'SKU-2-S']
+    assert all(item['breadcrumbs'] == ['Home', 'Tops'] for item in items)
+    assert [r.url for r in requests] == ['https://carbon38.com/collections/tops/products.json?limit=3&page=2']
+    assert requests[0].cb_kwargs == {'handle': 'tops', 'page': 2}
+
+
+def test_parse_catalog_stops_after_a_short_page():
+    spider = make_spider(CARBON38_CATALOG_PAGE_SIZE=3)
+    results = parse_catalog(spider, 'tops', 2, [product(n) for n in range(3, 5)])
+    assert len(results) == 2
+    assert not any(isinstance(r, scrapy.Request) for r in results)
+
+
+def test_parse_catalog_skips_products_seen_in_another_collection():
+    spider = make_spider(CARBON38_CATALOG_PAGE_SIZE=3)
+    parse_catalog(spider, 'tops', 1, [product(n) for n in range(3)])
+    results = parse_catalog(spider, 'sets', 1, [product(n) for n in range(2, 4)])
+    assert [item['sku'] for item in results] == ['SKU-3-S']
+
+
+def test_parse_catalog_stops_at_the_item_budget():
+    spider = make_spider(CARBON38_CATALOG_PAGE_SIZE=3, CARBON38_MAX_ITEMS=2)
+    results = parse_catalog(spider, 'tops', 1, [product(n) for n in range(3)])
+    assert len(results) == 2
+    assert not any(isinstance(r, scrapy.Request) for r in results)
+
+
+def test_catalog_404_falls_back_to_the_html_listing():
+    spider = make_spider()
+    request = spider.catalog_request('tops', 1)
+    failure = Failure(HttpError(Response(request.url, status=404, request=request)))
+    failure.request = request
+    [fallback] = spider.catalog_failed(failure)
+    assert fallback.url == 'https://carbon38.com/collections/tops'
+    assert fallback.callback == spider.parse
+    # Later pages fail quietly: page 1 already fell back
+    request = spider.catalog_request('tops', 2)
+    failure = Failure(HttpError(Response(request.url, status=404, request=request)))
+    failure.request = request
+    assert list(spider.catalog_failed(failure)) == []
+
+
+def test_catalog_without_json_falls_back_to_the_html_listing():
+    spider = make_spider()
+    request = spider.catalog_request('tops', 1)
+    response = TextResponse(request.url, body=b'<html></html>', encoding='utf-8', request=request)
+    [fallback] = spider.parse_catalog(response, 'tops', 1)
+    assert fallback.url == 'https://carbon38.com/collections/tops'
+
+
+@pytest.fixture
+def store():
+    # products.json of "sets" answers 404; its HTML listing links the fixture pages
+    server = FixtureServer(products=300, missing={'sets'}).start()
+    yield server
+    server.stop()
+
+
+def test_crawl_against_the_fixture_store(store, tmp_path):
+    output = tmp_path / 'items.jsonl'
+    env = dict(os.environ, SCRAPY_SETTINGS_MODULE='carbon38_scraper.settings',
+               PYTHONPATH=os.pathsep.join(filter(None, [str(PROJECT), os.environ.get('PYTHONPATH')])))
+    settings = {
+        'CARBON38_BASE_URL': store.url,
+        'CARBON38_MAX_ITEMS': 0,
+        'CARBON38_DATABASE': str(tmp_path / 'products.db'),
+        'HTTPCACHE_ENABLED': False,
+        'DOWNLOAD_DELAY': 0,
+        'LOG_LEVEL': 'WARNING',
+    }
+    command = [sys.executable, '-m', 'scrapy', 'crawl', 'carbon38', '-O', str(output)]
+    for name, value in settings.items():
+        command += ['-s', f'{name}={value}']
+    subprocess.run(command, cwd=tmp_path, env=env, check=True, timeout=120)
+
+    items = [json.loads(line) for line in output.read_text().splitlines()]
+    urls = sorted(item['product_url'] for item in items)
+    # Two products.json pages per collection, products shared between collections
+    generated = sorted(f'{store.url}/products/item-{n}' for n in range(300))
+    # No .json for the pages listed by "sets", so they come from their HTML
+    scraped = sorted(f'{store.url}/products/{handle}' for handle in page_handles())
+    assert urls == sorted(generated + scraped)
+    collections = {'Home', 'Tops', 'Bottoms', 'Sets', 'Outerwear', 'Sports Bras'}
+    for item in items:
+        assert item['reviews'] == 0
+        assert len(item['breadcrumbs']) == 2 and set(item['breadcrumbs']) <= collections
+        if item['product_url'] in scraped:
+            assert item['product_name'] and item['product_name'] != item['product_url']
+            # Listed by "sets" only
+            assert item['breadcrumbs'] == ['Home', 'Sets']
@@ -0,0 +1,55 @@
+import pytest
+from scrapy.http import HtmlResponse
+
+from carbon38_scraper.extraction import SCRIPT_LOOKUPS, ExtractionContext
+from carbon38_scraper.trimming import trim_html
+
+from conftest import parse_product
+
+
+# Every lookup matches one script here, and a later script matches it too
+LOOKUP_PAGE = HtmlResponse('https://carbon38.com/products/test', encoding='utf-8', body=b'''<html><head>
+<style>.a { color: red }</style>
+<script>var theme = {"cart": true};</script>
+<script>var reviews = {"review_count": 12};</script>
+<script>var variant = {"Color": "Black", "size": "M", "sku": "SKU-M"};</script>
+<script>var other = {"review_count": 3, "color": "Red", "size": "L", "sku": "SKU-L"};</script>
+<script>var meta = {"productId": "gid-1", "handle": "test"};</script>
+</head><body><svg><path d="M0 0"/></svg><h1 class="product__title">Test</h1></body></html>''')
+
+
+def trimmed(response):
+    return response.replace(body=trim_html(response.body))
+
+
+def test_trimmed_page_gives_the_same_item(product_page):
+    smaller = trimmed(product_page)
+    assert len(smaller.body) < len(product_page.body)
+    items = parse_product(product_page)
+    assert items and items[0]['product_name']
+    assert parse_product(smaller) == items
+
+
+@pytest.mark.parametrize('name', sorted(SCRIPT_LOOKUPS))
+def test_trimming_keeps_the_script_each_lookup_reads(product_page, name):
+    before = ExtractionContext.of(product_page)
+    after = ExtractionContext.of(trimmed(product_page))
+    if len(SCRIPT_LOOKUPS[name]) == 1:
+        assert after.lookup_all(name) == before.lookup_all(name)
+    assert after.lookup(name) == before.lookup(name)
+
+
+def test_trimming_keeps_only_the_scripts_lookups_read():
+    body = trim_html(LOOKUP_PAGE.body)
+    assert b'"review_count": 12' in body and b'"productId"' in body
+    assert b'"cart"' not in body and b'"Red"' not in body
+    page = ExtractionContext.of(LOOKUP_PAGE.replace(body=body))
+    assert {name: page.lookup(name) for name in SCRIPT_LOOKUPS} == {
+        'reviews': '12', 'colour': 'Black', 'sizes': 'M', 'sku': 'SKU-M', 'product_id': 'gid-1'}
+
+
+def test_trimming_drops_styles_svg_and_other_scripts(product_page):
+    body = trim_html(product_page.body).lower()
+    assert b'<style' not in body
+    assert b'<svg' not in body
+    assert body.count(b'<script') < product_page.body.lower().count(b'<script')